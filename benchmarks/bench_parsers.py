@@ -0,0 +1,192 @@
+"""
+Microbenchmarks of the configuration parsers against their previous implementations.
+
+Usage:
+    python benchmarks/bench_parsers.py [--hosts 200] [--repeat 5] [--corpus DIR]
+
+--corpus replays configuration files collected from a fleet: DIR/<host>/<name> where
+name is sshd_config, chrony.conf, sudoers or a file of /etc/logrotate.d. Without it,
+stock-like files are generated. Every parser is checked to return the same result as
+its previous implementation before it is timed.
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from libs.gatherer import linux_optional  # noqa: E402
+from libs.gatherer.tokenizer import \
+    strip_comments, strip_sudoers_comments, parse_key_values  # noqa: E402
+
+def previous_remove_comment(text: str, comment: str = '#'):
+    result = []
+    for l in text.splitlines():
+        stripped_l = l.strip()
+        if not stripped_l or stripped_l.startswith(comment):
+            continue
+        comment_index = l.find(comment)
+        if not comment_index == -1:
+            l = l[:comment_index].rstrip()
+        result.append(l)
+    return result
+
+def previous_parse_key_values(text: str) -> list:
+    result = []
+    for line in previous_remove_comment(text):
+        spl = line.split()
+        result.append({'key': spl[0], 'value': ' '.join(spl[1:])})
+    return result
+
+def previous_remove_comment_sudoers(text: str):
+    result = []
+    for l in text.splitlines():
+        stripped_l = l.strip()
+        if not stripped_l or re.match(r'^#+($|\s)', stripped_l):
+            continue
+        result.append(l.replace('\t', '    '))
+    return result
+
+def previous_parse_logrotate_config(text: str):
+    lines = previous_remove_comment(text)
+    files = []
+    for line in lines:
+        if re.match(r'^/\S+', line):
+            files.append(line.replace('{', '').strip())
+    config_block = re.findall(r'\{((.|\s)*)\}', '\n'.join(lines))
+    fixed_config = previous_remove_comment(
+        ' '.join(config_block[0]).replace('\t', '    '))
+    return {'target': files, 'config': fixed_config}
+
+def __stock_sshd_config(host: int) -> str:
+    lines = ['#\t$OpenBSD: sshd_config,v 1.104 2021/07/02 05:11:21 dtucker Exp $', '']
+    for index in range(40):
+        lines.append(f'# This is the sshd server system-wide configuration file, option {index}.')
+        lines.append(f'#Option{index} default{index}')
+        lines.append('')
+    lines += [
+        'Include /etc/ssh/sshd_config.d/*.conf',
+        f'Port {22 + host % 3}',
+        'PermitRootLogin no    # hardened',
+        'AuthorizedKeysFile\t.ssh/authorized_keys',
+        'Subsystem\tsftp\t/usr/libexec/openssh/sftp-server',
+    ]
+    return '\n'.join(lines) + '\n'
+
+def __stock_chrony_conf(host: int) -> str:
+    return (
+        '# Use public servers from the pool.ntp.org project.\n'
+        f'pool {host % 4}.rhel.pool.ntp.org iburst\n\n'
+        '# Record the rate at which the system clock gains/losses time.\n'
+        'driftfile /var/lib/chrony/drift\n'
+        'makestep 1.0 3\nrtcsync\n'
+        '#allow 192.168.0.0/16\n#local stratum 10\n'
+        'keyfile /etc/chrony.keys\nleapsectz right/UTC\nlogdir /var/log/chrony\n'
+    )
+
+def __stock_sudoers(host: int) -> str:
+    lines = ['## Sudoers allows particular users to run various commands as', '## the root user.', '']
+    for index in range(30):
+        lines += [f'## Command alias {index}', f'# Cmnd_Alias ALIAS{index} = /sbin/cmd{index}', '']
+    lines += [
+        'Defaults   !visiblepw',
+        'Defaults    always_set_home',
+        'root\tALL=(ALL) \tALL',
+        f'%wheel{host % 2}\tALL=(ALL)\tALL',
+        '#includedir /etc/sudoers.d',
+    ]
+    return '\n'.join(lines) + '\n'
+
+def __stock_logrotate(host: int) -> str:
+    return (
+        '# rotate the system logs\n'
+        f'/var/log/app{host % 5}.log\n/var/log/app-error.log\n{{\n'
+        '\tdaily\n\trotate 7\n\tmissingok   # ignore missing files\n'
+        '\tsharedscripts\n\tpostrotate\n\t\t/usr/bin/systemctl reload app.service > /dev/null\n'
+        '\tendscript\n}\n'
+    )
+
+def load_inputs(hosts: int, corpus: str = None) -> dict[str, list[str]]:
+    """Return the texts to parse per format."""
+    inputs = {'key_values': [], 'sudoers': [], 'logrotate': []}
+    if corpus is None:
+        for host in range(hosts):
+            inputs['key_values'] += [__stock_sshd_config(host), __stock_chrony_conf(host)]
+            inputs['sudoers'].append(__stock_sudoers(host))
+            inputs['logrotate'].append(__stock_logrotate(host))
+        return inputs
+
+    for host in sorted(os.listdir(corpus)):
+        for name in sorted(os.listdir(os.path.join(corpus, host))):
+            with open(os.path.join(corpus, host, name), encoding='utf-8', errors='replace') as f:
+                text = f.read()
+            if name in ('sshd_config', 'chrony.conf'):
+                inputs['key_values'].append(text)
+            elif name == 'sudoers':
+                inputs['sudoers'].append(text)
+            elif '{' in text:
+                inputs['logrotate'].append(text)
+    return inputs
+
+def bench(function, texts: list[str], repeat: int) -> float:
+    """Return the best seconds of parsing all texts."""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for text in texts:
+            function(text)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--hosts', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--corpus', default=None)
+    args = parser.parse_args()
+
+    inputs = load_inputs(args.hosts, args.corpus)
+    parse_logrotate = getattr(linux_optional, '__parse_logrotate_config')
+    cases = [
+        ('remove_comment', previous_remove_comment, strip_comments, inputs['key_values']),
+        ('key_values', previous_parse_key_values, parse_key_values, inputs['key_values']),
+        ('sudoers', previous_remove_comment_sudoers, strip_sudoers_comments, inputs['sudoers']),
+        ('logrotate', previous_parse_logrotate_config, parse_logrotate, inputs['logrotate']),
+    ]
+
+    print(f"{'case':<16}{'files':>8}{'previous ms':>14}{'current ms':>14}{'speedup':>10}")
+    for name, previous, current, texts in cases:
+        for text in texts:
+            if previous(text) != current(text):
+                print(f'{name}: results differ for {text[:80]!r}', file=sys.stderr)
+                return 1
+        previous_seconds = bench(previous, texts, args.repeat)
+        current_seconds = bench(current, texts, args.repeat)
+        print(
+            f'{name:<16}{len(texts):>8}{previous_seconds * 1000:>14.2f}'
+            f'{current_seconds * 1000:>14.2f}{previous_seconds / current_seconds:>9.1f}x'
+        )
+
+    # An unterminated block: the previous regex backtracks exponentially in the indentation.
+    for width in (16, 20, 22):
+        text = '/var/log/app.log {\n' + ' \t' * (width // 2)
+        started = time.perf_counter()
+        re.findall(r'\{((.|\s)*)\}', text)
+        previous_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        try:
+            parse_logrotate(text)
+        except ValueError:
+            pass
+        current_seconds = time.perf_counter() - started
+        print(
+            f'unterminated block, {width} whitespace: previous {previous_seconds * 1000:.1f} ms, '
+            f'current {current_seconds * 1000:.3f} ms'
+        )
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
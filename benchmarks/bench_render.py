@@ -0,0 +1,87 @@
+"""
+Rendering time of per-host workbooks by number of processes.
+
+Usage:
+    python benchmarks/bench_render.py [--hosts 200] [--workers 1,2,4,8] [--store FILE]
+
+Without --store, a result store of stock-like hosts (about 1500 packages, 40 users and
+400 systemd units each) is generated in a temporary directory. The speedup of each number
+of processes is relative to one process.
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from libs.fleet.store import ResultStore  # noqa: E402
+from libs.sheet import render_hosts  # noqa: E402
+
+def __stock_results(host: int) -> dict:
+    return {
+        'selinux': {'SELINUX': 'enforcing', 'SELINUXTYPE': 'targeted'},
+        'rhel_version': f'Red Hat Enterprise Linux release 9.{host % 4} (Plow)',
+        'rpm_packages': [f'package{index}-1.{host % 7}.{index % 13}-1.el9.x86_64' for index in range(1500)],
+        'user': [
+            {
+                'name': f'user{index}', 'uid': str(1000 + index),
+                'group': {'gid': str(1000 + index), 'name': f'user{index}'},
+                'description': '', 'home_directory': f'/home/user{index}',
+                'shell': '/bin/bash', 'groups': [{'gid': '10', 'name': 'wheel'}],
+            }
+                for index in range(40)
+        ],
+        'systemd_units': [
+            {'unit_file': f'unit{index}.service', 'state': 'enabled', 'preset': 'disabled'}
+                for index in range(400)
+        ],
+        'sshd': {'/etc/ssh/sshd_config': [{'key': 'PermitRootLogin', 'value': 'no'}]},
+    }
+
+def create_store(path: str, hosts: int) -> None:
+    """Create a result store of stock-like hosts."""
+    store = ResultStore(path)
+    for host in range(hosts):
+        for gatherer, result in __stock_results(host).items():
+            store.add(f'host{host:05d}.example.com', gatherer, result)
+    store.add('down.example.com', 'selinux', None, 'PreflightException: Connection refused')
+    store.close()
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--hosts', type=int, default=200)
+    parser.add_argument('--workers', default=None,
+        help='comma separated numbers of processes (default: 1, 2, 4, ... up to the CPUs)')
+    parser.add_argument('--store', default=None)
+    args = parser.parse_args()
+
+    if args.workers:
+        counts = [int(count) for count in args.workers.split(',')]
+    else:
+        counts = [1]
+        while counts[-1] * 2 <= (os.cpu_count() or 1):
+            counts.append(counts[-1] * 2)
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = args.store
+        if store is None:
+            store = os.path.join(directory, 'results.db')
+            create_store(store, args.hosts)
+
+        print(f"{'workers':>8}{'hosts':>8}{'rows':>10}{'seconds':>10}{'hosts/s':>10}{'speedup':>10}")
+        baseline = None
+        for count in counts:
+            report = render_hosts(store, os.path.join(directory, f'out{count}'), workers=count)
+            if report['failed']:
+                print(f"{report['failed']} hosts failed to render", file=sys.stderr)
+                return 1
+            baseline = baseline or report['seconds']
+            print(
+                f"{count:>8}{report['hosts']:>8}{report['rows']:>10}{report['seconds']:>10.2f}"
+                f"{report['hosts_per_second']:>10.1f}{baseline / report['seconds']:>9.2f}x"
+            )
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""
+Startup time of the main entry points, measured with python -X importtime.
+
+Usage:
+    python benchmarks/bench_startup.py [--repeat 5] [--check]
+
+Each entry point is started in a fresh interpreter. The import time is the cumulative time of
+the modules it imports, best of --repeat runs, and the heavy modules it loads are listed.
+--check exits with 1 if an entry point loads a heavy module it doesn't need, so that an eager
+import of the SSH stack or the Excel writer is noticed before it slows down every command.
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Modules that dominate the startup time when they are loaded.
+HEAVY_MODULES = ['paramiko', 'cryptography', 'nacl', 'bcrypt', 'openpyxl']
+
+# (name, python arguments, heavy modules the entry point may load)
+ENTRY_POINTS = [
+    ('os2sheet --help', ['os2sheet.py', '--help'], []),
+    ('libs.cli', ['-c', 'import libs.cli'], []),
+    ('libs.fleet.journal', ['-c', 'import libs.fleet.journal'], []),
+    ('libs.fleet.store', ['-c', 'import libs.fleet.store'], []),
+    ('libs.gatherer.registry', ['-c', 'import libs.gatherer.registry'], []),
+    ('libs.sheet.flatten', ['-c', 'from libs.sheet import flatten'], []),
+    ('libs.fleet.pipeline', ['-c', 'import libs.fleet.pipeline'], []),
+    ('libs.utils.CommandRunner', ['-c', 'from libs.utils import CommandRunner'],
+        ['paramiko', 'cryptography', 'nacl', 'bcrypt']),
+]
+
+IMPORTTIME_PATTERN = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)')
+
+def measure(arguments: list[str]) -> dict:
+    """
+    Start an entry point once.
+
+    Returns:
+        dict: 'seconds' of the process, 'import_ms' of all imports, the loaded 'modules'
+            and the 'error' of a failed start, or None.
+    """
+    started = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', *arguments],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    seconds = time.perf_counter() - started
+
+    import_us = 0
+    modules = set()
+    error = None
+    for line in process.stderr.splitlines():
+        match = IMPORTTIME_PATTERN.match(line)
+        if match is None:
+            if line.strip() and not line.startswith('import time:'):
+                error = line.strip()
+            continue
+        modules.add(match.group(4))
+        if not match.group(3):
+            # Top level imports; their cumulative time includes the nested ones.
+            import_us += int(match.group(2))
+    return {
+        'seconds': seconds,
+        'import_ms': import_us / 1000,
+        'modules': modules,
+        'error': error if process.returncode != 0 else None,
+    }
+
+def heavy_modules(modules: set[str]) -> list[str]:
+    """Return the heavy modules among the loaded modules."""
+    return [
+        heavy for heavy in HEAVY_MODULES
+            if any(module == heavy or module.startswith(f'{heavy}.') for module in modules)
+    ]
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--check', action='store_true')
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'entry point':<28}{'imports ms':>12}{'process ms':>12}{'modules':>9}  heavy modules")
+    for name, arguments, allowed in ENTRY_POINTS:
+        runs = [measure(arguments) for _ in range(args.repeat)]
+        best = min(runs, key=lambda run: run['import_ms'])
+        heavy = heavy_modules(best['modules'])
+        unexpected = [module for module in heavy if module not in allowed]
+        print(
+            f"{name:<28}{best['import_ms']:>12.1f}"
+            f"{min(run['seconds'] for run in runs) * 1000:>12.1f}"
+            f"{len(best['modules']):>9}  {', '.join(heavy) or '-'}"
+        )
+        if best['error'] is not None:
+            print(f'  failed: {best["error"]}')
+            failed = failed or not allowed
+        if unexpected:
+            print(f"  unexpected: {', '.join(unexpected)}")
+            failed = True
+
+    return 1 if args.check and failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -77,4 +77,4 @@ pprint(fstab_config)
 #pprint(sudoers)
 #
 #firewalld = linux_optional.firewalld(cmd_runner)
-#pprint(firewalld)
\ No newline at end of file
+#pprint(firewalld)
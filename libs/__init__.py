@@ -1,7 +1,13 @@
-from . import utils
-from . import gatherer
+import importlib
 
+# Subpackages are imported on first access, so that importing libs.cli or libs.fleet.store
+# doesn't load the SSH stack.
 __all__ = [
     'utils',
     'gatherer'
-]
\ No newline at end of file
+]
+
+def __getattr__(name: str):
+    if name not in __all__:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    return importlib.import_module(f'.{name}', __name__)
@@ -0,0 +1,383 @@
+import argparse
+import json
+import sys
+
+def __split(value: str) -> list[str]:
+    """Split a comma separated command line value."""
+    return [v.strip() for v in value.split(',') if v.strip()]
+
+def __governor_settings(args: argparse.Namespace) -> dict:
+    """Return the ConnectionGovernor arguments given on the command line, or None if no limit is given."""
+    if not (args.subnet_rate or args.bastion_rate or args.auth_rate or args.max_handshakes):
+        return None
+    return {
+        'subnet_rate': args.subnet_rate,
+        'bastion_rate': args.bastion_rate,
+        'auth_rate': args.auth_rate,
+        'initial_concurrency': min(8, args.max_handshakes or 8),
+        'max_concurrency': args.max_handshakes,
+    }
+
+def __credentials_settings(args: argparse.Namespace) -> dict:
+    """Return the CredentialCache arguments given on the command line, or None if no option is given."""
+    if not (args.known_hosts or args.algorithm_cache or args.ssh_agent):
+        return None
+    return {
+        'known_hosts': args.known_hosts,
+        'algorithms': args.algorithm_cache,
+        'use_agent': args.ssh_agent,
+    }
+
+def __preflight_settings(args: argparse.Namespace) -> dict:
+    """Return the Preflight arguments given on the command line, or None if it is disabled."""
+    if args.no_preflight:
+        return None
+    return {
+        'timeout': args.preflight_timeout,
+        'concurrency': args.preflight_concurrency,
+    }
+
+def __pipeline_settings(args: argparse.Namespace, run: bool = True) -> dict:
+    """
+    Return the FleetPipeline settings given on the command line as plain values,
+    which can be passed to worker processes, see build_pipeline_args.
+
+    Args:
+        args: The parsed command line.
+        run: Whether the command has the arguments of a fleet run, see __add_run_arguments.
+    """
+    return {
+        'io_workers': args.io_workers,
+        'parse_workers': args.parse_workers,
+        'governor': __governor_settings(args),
+        'credentials': __credentials_settings(args),
+        'bastions': {
+            'channels_per_session': args.bastion_channels,
+            'sessions_per_bastion': args.bastion_sessions,
+        },
+        'preflight': __preflight_settings(args) if run else None,
+        'history': args.history if run else None,
+    }
+
+def __pipeline_args(args: argparse.Namespace, run: bool = True) -> dict:
+    """Return the FleetPipeline keyword arguments given on the command line."""
+    from libs.fleet.coordinator import build_pipeline_args
+
+    return build_pipeline_args(**__pipeline_settings(args, run))
+
+def collect(args: argparse.Namespace) -> int:
+    """Collect the gatherers of all hosts in the inventory into a fleet workbook."""
+    from libs.fleet import load_inventory, FleetPipeline, Journal
+    from libs.sheet import FleetWorkbook
+
+    journal = None
+    if args.journal:
+        journal = Journal(
+            args.journal, resume=args.resume,
+            fsync=args.fsync, fsync_interval=args.fsync_interval
+        )
+    pipeline = FleetPipeline(
+        load_inventory(args.inventory),
+        gatherers=__split(args.gatherers) if args.gatherers else None,
+        queue_size=args.queue_size,
+        journal=journal,
+        **__pipeline_args(args)
+    )
+    workbook = FleetWorkbook()
+    try:
+        report = {'stages': pipeline.run(workbook)}
+    finally:
+        if journal is not None:
+            journal.close()
+        pipeline.bastions.close()
+    workbook.save(args.output)
+    report['transfer'] = pipeline.transfer_report()
+    if journal is not None:
+        report['replayed'] = pipeline.replayed
+    if pipeline.preflight is not None:
+        report['preflight'] = pipeline.preflight.report()
+    if pipeline.schedule is not None:
+        report['schedule'] = pipeline.schedule
+    if pipeline.credentials is not None:
+        pipeline.credentials.save()
+    if pipeline.governor is not None:
+        report['governor'] = pipeline.governor.report()
+    bastions = pipeline.bastions.report()
+    if bastions:
+        report['bastions'] = bastions
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    return 0
+
+def coordinate(args: argparse.Namespace) -> int:
+    """Shard the inventory, run local workers and merge the results into one workbook."""
+    from libs.fleet import coordinator
+
+    progress = coordinator.coordinate(
+        args.queue, args.inventory, args.output,
+        gatherers=__split(args.gatherers) if args.gatherers else None,
+        shard_size=args.shard_size,
+        local_workers=args.local_workers,
+        lease_seconds=args.lease_seconds,
+        **__pipeline_settings(args)
+    )
+    json.dump(progress, sys.stdout, indent=2)
+    print()
+    return 0 if progress[coordinator.SHARD_FAILED] == 0 else 1
+
+def worker(args: argparse.Namespace) -> int:
+    """Process shards of a coordinated run."""
+    from libs.fleet import coordinator
+
+    coordinator.run_worker(
+        args.queue, args.inventory,
+        worker=args.worker_id,
+        lease_seconds=args.lease_seconds,
+        **__pipeline_settings(args)
+    )
+    return 0
+
+def serve(args: argparse.Namespace) -> int:
+    """Keep warm sessions to the hosts of the inventory and serve collection requests."""
+    from libs.fleet import load_inventory
+    from libs.service import CollectorService, serve as serve_service
+
+    pipeline_args = __pipeline_args(args, run=False)
+    service = CollectorService(
+        load_inventory(args.inventory),
+        governor=pipeline_args['governor'],
+        credentials=pipeline_args['credentials'],
+        request_workers=args.io_workers,
+        bastions=pipeline_args['bastions']
+    )
+    service.warm()
+    try:
+        serve_service(
+            service, listen=args.listen, unix_socket=args.socket, token_file=args.token_file)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+        pipeline_args['bastions'].close()
+    return 0
+
+def monitor(args: argparse.Namespace) -> int:
+    """Check the hosts of the inventory on a jittered interval and log only the changes."""
+    from libs.fleet import load_inventory, DriftMonitor
+
+    pipeline_args = __pipeline_args(args, run=False)
+    drift_monitor = DriftMonitor(
+        load_inventory(args.inventory),
+        gatherers=__split(args.gatherers) if args.gatherers else None,
+        state_path=args.state,
+        changes_path=args.changes,
+        interval=args.interval,
+        jitter=args.jitter,
+        workers=args.io_workers,
+        keep_sessions=not args.close_sessions,
+        governor=pipeline_args['governor'],
+        credentials=pipeline_args['credentials'],
+        bastions=pipeline_args['bastions']
+    )
+    try:
+        stats = drift_monitor.run(cycles=1 if args.once else None)
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        pipeline_args['bastions'].close()
+    json.dump(stats, sys.stdout, indent=2)
+    print()
+    return 0
+
+def estimate(args: argparse.Namespace) -> int:
+    """Predict the collect makespan of the inventory from the duration history."""
+    from libs.fleet import load_inventory, DurationHistory
+    from libs.gatherer.registry import gatherer_names
+
+    history = DurationHistory(args.history)
+    gatherers = gatherer_names(__split(args.gatherers) if args.gatherers else None)
+    inventory = load_inventory(args.inventory)
+    _, prediction = history.schedule(
+        [(entry['host'], gatherers) for entry in inventory],
+        max(1, min(args.io_workers, len(inventory)))
+    )
+    json.dump({'estimate': prediction, 'runs': history.runs(args.runs)}, sys.stdout, indent=2)
+    print()
+    return 0
+
+def render(args: argparse.Namespace) -> int:
+    """Render one workbook per host and an index workbook from a result store."""
+    from libs.sheet import render_hosts
+
+    report = render_hosts(
+        args.store, args.output_dir,
+        hosts=__split(args.hosts) if args.hosts else None,
+        workers=args.workers
+    )
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    return 0 if report['failed'] == 0 else 1
+
+def __add_pipeline_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the arguments shared by the commands that run a FleetPipeline."""
+    parser.add_argument('-i', '--inventory', required=True,
+        help='inventory JSON file')
+    parser.add_argument('--io-workers', type=int, default=32,
+        help='concurrent SSH sessions (default: 32)')
+    parser.add_argument('--parse-workers', type=int, default=None,
+        help='parser processes (default: number of CPUs)')
+    parser.add_argument('--subnet-rate', type=float, default=None,
+        help='SSH handshakes per second per target subnet (default: no limit)')
+    parser.add_argument('--bastion-rate', type=float, default=None,
+        help='SSH handshakes per second per bastion (default: no limit)')
+    parser.add_argument('--auth-rate', type=float, default=None,
+        help='SSH handshakes per second per auth backend (default: no limit)')
+    parser.add_argument('--max-handshakes', type=int, default=None,
+        help='upper bound of the adaptive handshake concurrency per subnet and bastion')
+    parser.add_argument('--known-hosts', default=None,
+        help='known hosts file, loaded once and extended with new host keys')
+    parser.add_argument('--algorithm-cache', default=None,
+        help='JSON file to reuse the algorithms negotiated with each host')
+    parser.add_argument('--ssh-agent', action='store_true',
+        help='authenticate with the keys of a running ssh-agent')
+    parser.add_argument('--bastion-channels', type=int, default=10,
+        help='maximum tunnels carried by one bastion session (default: 10)')
+    parser.add_argument('--bastion-sessions', type=int, default=4,
+        help='maximum sessions per bastion (default: 4)')
+
+def __add_run_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the arguments of the reachability sweep and the scheduling of a fleet run."""
+    parser.add_argument('--no-preflight', action='store_true',
+        help='connect to every host instead of probing all SSH ports first')
+    parser.add_argument('--preflight-timeout', type=float, default=3.0,
+        help='seconds to wait for the TCP connect and the SSH banner of a host (default: 3.0)')
+    parser.add_argument('--preflight-concurrency', type=int, default=1000,
+        help='maximum probes in flight (default: 1000)')
+    parser.add_argument('--history', default=None,
+        help='SQLite file of the durations of previous runs, to collect the slowest hosts first')
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build the command line parser."""
+    parser = argparse.ArgumentParser(
+        prog='os2sheet',
+        description='Collect system parameters via SSH and create a parameter sheet in Excel.'
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    collect_parser = subparsers.add_parser(
+        'collect', help='collect a fleet into one workbook')
+    __add_pipeline_arguments(collect_parser)
+    __add_run_arguments(collect_parser)
+    collect_parser.add_argument('-o', '--output', required=True,
+        help='output Excel file')
+    collect_parser.add_argument('-g', '--gatherers',
+        help='comma separated gatherer names (default: all)')
+    collect_parser.add_argument('--queue-size', type=int, default=64,
+        help='maximum items waiting between two stages (default: 64)')
+    collect_parser.add_argument('--journal', default=None,
+        help='journal file every result is appended to as soon as it completes')
+    collect_parser.add_argument('--resume', action='store_true',
+        help='keep the results in the journal and only collect what is missing or failed')
+    collect_parser.add_argument('--fsync', choices=['always', 'interval', 'never'], default='interval',
+        help='when to sync the journal to disk (default: interval)')
+    collect_parser.add_argument('--fsync-interval', type=float, default=1.0,
+        help='seconds between two journal syncs with --fsync interval (default: 1.0)')
+    collect_parser.set_defaults(func=collect)
+
+    coordinate_parser = subparsers.add_parser(
+        'coordinate', help='shard a fleet run over workers and merge the results')
+    __add_pipeline_arguments(coordinate_parser)
+    __add_run_arguments(coordinate_parser)
+    coordinate_parser.add_argument('-q', '--queue', required=True,
+        help='job queue database, on shared storage for remote workers')
+    coordinate_parser.add_argument('-o', '--output', required=True,
+        help='output Excel file')
+    coordinate_parser.add_argument('-g', '--gatherers',
+        help='comma separated gatherer names (default: all)')
+    coordinate_parser.add_argument('--shard-size', type=int, default=50,
+        help='hosts per shard (default: 50)')
+    coordinate_parser.add_argument('--local-workers', type=int, default=1,
+        help='worker processes on this machine (default: 1)')
+    coordinate_parser.add_argument('--lease-seconds', type=int, default=300,
+        help='seconds until the shard of a silent worker is re-leased (default: 300)')
+    coordinate_parser.set_defaults(func=coordinate)
+
+    worker_parser = subparsers.add_parser(
+        'worker', help='process shards of a coordinated run')
+    __add_pipeline_arguments(worker_parser)
+    __add_run_arguments(worker_parser)
+    worker_parser.add_argument('-q', '--queue', required=True,
+        help='job queue database of the coordinator')
+    worker_parser.add_argument('--worker-id', default=None,
+        help='worker id (default: hostname:pid)')
+    worker_parser.add_argument('--lease-seconds', type=int, default=300,
+        help='seconds until the shard of a silent worker is re-leased (default: 300)')
+    worker_parser.set_defaults(func=worker)
+
+    serve_parser = subparsers.add_parser(
+        'serve', help='keep warm sessions and serve collection requests on localhost')
+    __add_pipeline_arguments(serve_parser)
+    serve_listen = serve_parser.add_mutually_exclusive_group(required=True)
+    serve_listen.add_argument('--listen', default=None,
+        help='localhost address to serve HTTP on, e.g. 127.0.0.1:8765')
+    serve_listen.add_argument('--socket', default=None,
+        help='Unix socket to serve HTTP on')
+    serve_parser.add_argument('--token-file', default=None,
+        help='file of the bearer token required with --listen, readable by the owner only; '
+            'created with a random token if missing')
+    serve_parser.set_defaults(func=serve)
+
+    monitor_parser = subparsers.add_parser(
+        'monitor', help='check hosts on an interval and log configuration drift')
+    __add_pipeline_arguments(monitor_parser)
+    monitor_parser.add_argument('-g', '--gatherers',
+        help='comma separated gatherer names (default: all)')
+    monitor_parser.add_argument('--state', required=True,
+        help='SQLite database holding the last snapshot of each host')
+    monitor_parser.add_argument('--changes', required=True,
+        help='change log, appended as JSON lines')
+    monitor_parser.add_argument('--interval', type=float, default=3600,
+        help='average seconds between two checks of a host (default: 3600)')
+    monitor_parser.add_argument('--jitter', type=float, default=0.1,
+        help='fraction of the interval by which checks are randomly spread (default: 0.1)')
+    monitor_parser.add_argument('--close-sessions', action='store_true',
+        help='close the SSH session of a host between its checks')
+    monitor_parser.add_argument('--once', action='store_true',
+        help='check each host once and exit')
+    monitor_parser.set_defaults(func=monitor)
+
+    estimate_parser = subparsers.add_parser(
+        'estimate', help='predict the makespan of a run from the duration history')
+    estimate_parser.add_argument('-i', '--inventory', required=True,
+        help='inventory JSON file')
+    estimate_parser.add_argument('--history', required=True,
+        help='SQLite file of the durations of previous runs')
+    estimate_parser.add_argument('-g', '--gatherers',
+        help='comma separated gatherer names (default: all)')
+    estimate_parser.add_argument('--io-workers', type=int, default=32,
+        help='concurrent SSH sessions (default: 32)')
+    estimate_parser.add_argument('--runs', type=int, default=10,
+        help='previous runs to show with their predicted and actual makespan (default: 10)')
+    estimate_parser.set_defaults(func=estimate)
+
+    render_parser = subparsers.add_parser(
+        'render', help='render one workbook per host from stored results')
+    render_parser.add_argument('-s', '--store', required=True,
+        help='result store, e.g. the job queue of coordinate or the state of monitor')
+    render_parser.add_argument('-o', '--output-dir', required=True,
+        help='directory of the host workbooks and index.xlsx')
+    render_parser.add_argument('--hosts',
+        help='comma separated hosts to render (default: all hosts in the store)')
+    render_parser.add_argument('--workers', type=int, default=None,
+        help='rendering processes (default: number of CPUs)')
+    render_parser.set_defaults(func=render)
+
+    return parser
+
+def main(argv: list[str] = None) -> int:
+    args = build_parser().parse_args(argv)
+    if getattr(args, 'resume', False) and not args.journal:
+        build_parser().error('--resume requires --journal')
+    if getattr(args, 'listen', None) and not args.token_file:
+        build_parser().error('--listen requires --token-file')
+    return args.func(args)
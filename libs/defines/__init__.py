@@ -1,4 +1,11 @@
-from .linux_general_props import NMCLI_TARGET_PROPS
+from .linux_general_props import \
+    NMCLI_TARGET_PROPS, \
+    LSBLK_COLUMNS, \
+    SELINUX_CONF_FILE, \
+    GROUP_FILE, \
+    PASSWD_FILE, \
+    REDHAT_RELEASE_FILE, \
+    FSTAB_FILE
 from .linux_optional_props import \
     RSYSLOG_CONF_FILE, \
     RSYSLOG_CONF_D, \
@@ -13,10 +20,17 @@ from .linux_optional_props import \
     DNF_REPO_D, \
     DNF_REPO_EXCLUSION, \
     SUDOERS_CONF, \
-    SUDOERS_CONF_D
+    SUDOERS_CONF_D, \
+    SYSCONFIG_GRUB_FILE
 
 __all__ = [
     'NMCLI_TARGET_PROPS',
+    'LSBLK_COLUMNS',
+    'SELINUX_CONF_FILE',
+    'GROUP_FILE',
+    'PASSWD_FILE',
+    'REDHAT_RELEASE_FILE',
+    'FSTAB_FILE',
     'RSYSLOG_CONF_FILE',
     'RSYSLOG_CONF_D',
     'SSHD_CONF_FILE',
@@ -30,5 +44,6 @@ __all__ = [
     'DNF_REPO_D',
     'DNF_REPO_EXCLUSION',
     'SUDOERS_CONF',
-    'SUDOERS_CONF_D'
+    'SUDOERS_CONF_D',
+    'SYSCONFIG_GRUB_FILE'
 ]
\ No newline at end of file
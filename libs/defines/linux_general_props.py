@@ -18,4 +18,12 @@ NMCLI_TARGET_PROPS = [
     'bond.miimon',
     'bond.lacp_rate',
     'bond.xmit_hash_policy',
-]
\ No newline at end of file
+]
+
+LSBLK_COLUMNS = 'NAME,UUID,SIZE,TYPE,MOUNTPOINT,PKNAME'
+
+SELINUX_CONF_FILE = '/etc/selinux/config'
+GROUP_FILE = '/etc/group'
+PASSWD_FILE = '/etc/passwd'
+REDHAT_RELEASE_FILE = '/etc/redhat-release'
+FSTAB_FILE = '/etc/fstab'
\ No newline at end of file
@@ -16,3 +16,4 @@ DNF_REPO_EXCLUSION = [
 ]
 SUDOERS_CONF = '/etc/sudoers'
 SUDOERS_CONF_D = '/etc/sudoers.d'
+SYSCONFIG_GRUB_FILE = '/etc/sysconfig/grub'
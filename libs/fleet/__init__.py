@@ -0,0 +1,33 @@
+import importlib
+
+# Names are imported from their modules on first access, see libs.utils.
+__LAZY_NAMES = {
+    'load_inventory': '.inventory',
+    'connect': '.inventory',
+    'FleetPipeline': '.pipeline',
+    'ConnectionGovernor': '.governor',
+    'DriftMonitor': '.drift',
+    'Journal': '.journal',
+    'BastionPool': '.bastion',
+    'Preflight': '.preflight',
+    'DurationHistory': '.history',
+}
+
+__all__ = [
+    'load_inventory',
+    'connect',
+    'FleetPipeline',
+    'ConnectionGovernor',
+    'DriftMonitor',
+    'Journal',
+    'BastionPool',
+    'Preflight',
+    'DurationHistory'
+]
+
+def __getattr__(name: str):
+    if name not in __LAZY_NAMES:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module(__LAZY_NAMES[name], __name__), name)
+    globals()[name] = value
+    return value
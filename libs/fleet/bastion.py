@@ -0,0 +1,232 @@
+from __future__ import annotations
+import threading
+from typing import TYPE_CHECKING
+
+# bastion_spec and bastion_name are used by the ConnectionGovernor without any bastion,
+# so paramiko is only imported when a session is opened.
+if TYPE_CHECKING:
+    import paramiko
+    from libs.utils import CredentialCache
+
+DEFAULT_BASTION_PORT = 22
+DEFAULT_CHANNELS_PER_SESSION = 10
+DEFAULT_SESSIONS_PER_BASTION = 4
+DEFAULT_BASTION_TIMEOUT = 60
+# Closed channels don't notify the pool, so waiting openers recheck at this interval.
+BASTION_POLL_SECONDS = 0.2
+
+class BastionPoolException(Exception):
+    pass
+
+def bastion_spec(bastion) -> dict:
+    """
+    Normalize the bastion of an inventory entry.
+
+    Args:
+        bastion: Either "[user@]host[:port]", or a dictionary with the keys 'host' and optionally
+            'port', 'user', 'password', 'keyfile' and 'passphrase'.
+
+    Returns:
+        dict: The bastion as a dictionary with at least 'host' and 'port'.
+
+    Raises:
+        BastionPoolException: If the bastion has no host.
+    """
+    if isinstance(bastion, dict):
+        spec = dict(bastion)
+    else:
+        spec = {}
+        user, _, address = str(bastion).rpartition('@')
+        if user:
+            spec['user'] = user
+        host, _, port = address.partition(':')
+        spec['host'] = host
+        if port:
+            spec['port'] = int(port)
+
+    if not spec.get('host'):
+        raise BastionPoolException(f'Bastion has no host: {bastion}')
+    spec.setdefault('port', DEFAULT_BASTION_PORT)
+    return spec
+
+def bastion_name(bastion) -> str:
+    """Return the name of a bastion, "[user@]host:port", see bastion_spec."""
+    spec = bastion_spec(bastion)
+    user = f"{spec['user']}@" if spec.get('user') else ''
+    return f"{user}{spec['host']}:{spec['port']}"
+
+class BastionSession():
+    def __init__(self, spec: dict, credentials: CredentialCache = None, timeout: int = DEFAULT_BASTION_TIMEOUT):
+        """
+        Initializes an authenticated SSH session to a bastion.
+
+        Args:
+            spec: The bastion, see bastion_spec.
+            credentials: A CredentialCache for keys, known hosts and the SSH agent, or None.
+            timeout: The timeout for the handshake in seconds.
+        """
+        import paramiko
+
+        connect_args = {}
+        keyfile = spec.get('keyfile')
+        if credentials is not None:
+            connect_args['allow_agent'] = credentials.use_agent
+            connect_args['look_for_keys'] = False
+            if keyfile is not None:
+                connect_args['pkey'] = credentials.private_key(keyfile, spec.get('passphrase'))
+                keyfile = None
+
+        self.client = paramiko.SSHClient()
+        if credentials is not None:
+            self.client.set_missing_host_key_policy(credentials.host_key_policy)
+        else:
+            self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        self.client.connect(
+            spec['host'],
+            port=spec['port'],
+            username=spec.get('user'),
+            password=spec.get('password'),
+            key_filename=keyfile,
+            passphrase=spec.get('passphrase'),
+            timeout=timeout,
+            **connect_args
+        )
+        self.transport = self.client.get_transport()
+        self.channels = []
+        self.reserved = 0
+
+    def active(self) -> bool:
+        return self.transport is not None and self.transport.is_active()
+
+    def load(self) -> int:
+        """Return the number of open and reserved channels, forgetting closed ones."""
+        self.channels = [channel for channel in self.channels if not channel.closed]
+        return len(self.channels) + self.reserved
+
+    def close(self) -> None:
+        self.client.close()
+
+class BastionPool():
+    def __init__(
+        self, credentials: CredentialCache = None,
+        channels_per_session: int = DEFAULT_CHANNELS_PER_SESSION,
+        sessions_per_bastion: int = DEFAULT_SESSIONS_PER_BASTION
+    ):
+        """
+        Initializes a pool of bastion sessions that tunnel connections to the hosts behind them.
+
+        Each bastion is authenticated once per session, and connections to targets are opened
+        as direct-tcpip channels over the session transport. A new session is only opened when
+        all sessions to the bastion carry channels_per_session channels; when sessions_per_bastion
+        sessions are full, openers wait until a channel is closed.
+
+        Args:
+            credentials: A CredentialCache for the bastion handshakes, or None.
+            channels_per_session: The maximum number of channels carried by one session.
+            sessions_per_bastion: The maximum number of sessions to one bastion.
+        """
+        self.credentials = credentials
+        self.channels_per_session = channels_per_session
+        self.sessions_per_bastion = sessions_per_bastion
+        self.sessions = {}
+        self.connecting = {}
+        self.condition = threading.Condition()
+
+    def __reserve(self, name: str) -> BastionSession:
+        """
+        Reserve a channel on the least loaded session to a bastion. Called with the condition held.
+
+        Returns:
+            BastionSession: The session, or None if the caller has to open a new session.
+        """
+        while True:
+            sessions = []
+            for session in self.sessions.get(name, []):
+                if session.active():
+                    sessions.append(session)
+                else:
+                    # The transport is down, but the client still holds its socket and threads.
+                    session.close()
+            self.sessions[name] = sessions
+            available = [
+                session for session in sessions
+                    if session.load() < self.channels_per_session
+            ]
+            if available:
+                session = min(available, key=lambda session: session.load())
+                session.reserved += 1
+                return session
+            if len(sessions) + self.connecting.get(name, 0) < self.sessions_per_bastion:
+                self.connecting[name] = self.connecting.get(name, 0) + 1
+                return None
+            self.condition.wait(BASTION_POLL_SECONDS)
+
+    def open_channel(
+        self, bastion, host: str, port: int = 22,
+        timeout: int = DEFAULT_BASTION_TIMEOUT
+    ) -> paramiko.Channel:
+        """
+        Open a tunnel to a host through a bastion.
+
+        Args:
+            bastion: The bastion, see bastion_spec.
+            host: The target host, as resolved by the bastion.
+            port: The target port.
+            timeout: The timeout for the bastion handshake and for opening the channel in seconds.
+
+        Returns:
+            paramiko.Channel: The channel, to be passed as sock to CommandRunner.
+                The channel is released when it is closed.
+
+        Raises:
+            paramiko.SSHException: If the bastion handshake or the channel fails.
+        """
+        spec = bastion_spec(bastion)
+        name = bastion_name(spec)
+        with self.condition:
+            session = self.__reserve(name)
+
+        if session is None:
+            try:
+                session = BastionSession(spec, self.credentials, timeout)
+            except Exception:
+                with self.condition:
+                    self.connecting[name] -= 1
+                    self.condition.notify_all()
+                raise
+            with self.condition:
+                self.connecting[name] -= 1
+                session.reserved += 1
+                self.sessions[name].append(session)
+
+        channel = None
+        try:
+            channel = session.transport.open_channel(
+                'direct-tcpip', (host, port), ('127.0.0.1', 0), timeout=timeout)
+            return channel
+        finally:
+            with self.condition:
+                session.reserved -= 1
+                if channel is not None:
+                    session.channels.append(channel)
+                self.condition.notify_all()
+
+    def report(self) -> list[dict]:
+        """Return the number of sessions and open channels per bastion."""
+        with self.condition:
+            return [
+                {
+                    'bastion': name,
+                    'sessions': len(sessions),
+                    'channels': sum(session.load() for session in sessions),
+                }
+                    for name, sessions in self.sessions.items()
+            ]
+
+    def close(self) -> None:
+        """Close all bastion sessions, and with them every tunnel."""
+        with self.condition:
+            for sessions in self.sessions.values():
+                for session in sessions:
+                    session.close()
+            self.sessions.clear()
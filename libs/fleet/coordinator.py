@@ -0,0 +1,402 @@
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+from libs.gatherer.registry import gatherer_names
+from .bastion import BastionPool
+from .governor import ConnectionGovernor
+from .history import DurationHistory
+from .inventory import load_inventory
+from .pipeline import FleetPipeline, DEFAULT_IO_WORKERS
+from .preflight import Preflight
+from .store import ResultStore, SQLITE_TIMEOUT
+
+SHARD_PENDING = 'pending'
+SHARD_LEASED = 'leased'
+SHARD_DONE = 'done'
+SHARD_FAILED = 'failed'
+
+DEFAULT_SHARD_SIZE = 50
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_POLL_INTERVAL = 5
+
+class JobQueue():
+    def __init__(self, path: str, timeout: int = SQLITE_TIMEOUT):
+        """
+        Initializes a SQLite job queue of inventory shards.
+
+        Workers lease shards for a limited time and renew the lease while they work.
+        A shard whose lease has expired, because its worker died or lost the storage,
+        is leased to the next worker that asks. Only host names are stored; each worker
+        reads the host entries from its own copy of the inventory.
+
+        Args:
+            path: The path of the SQLite database. It may be on shared storage.
+            timeout: The seconds to wait for a lock held by another process.
+        """
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS shards ('
+            'id INTEGER PRIMARY KEY, hosts TEXT NOT NULL, '
+            'status TEXT NOT NULL, worker TEXT, '
+            'lease_expires REAL, attempts INTEGER NOT NULL DEFAULT 0)'
+        )
+
+    def has_run(self) -> bool:
+        """Return True if a run has been created in this queue."""
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE key = 'gatherers'").fetchone()
+        return row is not None
+
+    def create_run(
+        self, hosts: list[str], gatherers: list[str],
+        shard_size: int = DEFAULT_SHARD_SIZE
+    ) -> int:
+        """
+        Split the hosts into shards and queue them.
+
+        Args:
+            hosts: The host names.
+            gatherers: The gatherer names every worker runs.
+            shard_size: The number of hosts per shard.
+
+        Returns:
+            int: The number of shards.
+        """
+        shards = [
+            hosts[i:i + shard_size] for i in range(0, len(hosts), shard_size)
+        ]
+        self.connection.execute('BEGIN IMMEDIATE')
+        self.connection.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('gatherers', ?)",
+            (json.dumps(gatherers),)
+        )
+        self.connection.executemany(
+            'INSERT INTO shards (hosts, status) VALUES (?, ?)',
+            [(json.dumps(shard), SHARD_PENDING) for shard in shards]
+        )
+        self.connection.execute('COMMIT')
+        return len(shards)
+
+    def gatherers(self) -> list[str]:
+        """Return the gatherer names of the run."""
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE key = 'gatherers'").fetchone()
+        return json.loads(row[0])
+
+    def lease(
+        self, worker: str, lease_seconds: int = DEFAULT_LEASE_SECONDS,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS
+    ) -> tuple[int, list[str]]:
+        """
+        Lease the next pending or expired shard.
+
+        Expired shards that have already been attempted max_attempts times are marked as failed.
+
+        Args:
+            worker: The worker id.
+            lease_seconds: The seconds until the lease expires unless renewed.
+            max_attempts: The maximum number of leases per shard.
+
+        Returns:
+            tuple[int, list[str]]: The shard id and its hosts, or None if no shard is available.
+        """
+        now = time.time()
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            self.connection.execute(
+                'UPDATE shards SET status = ?, worker = NULL '
+                'WHERE status = ? AND lease_expires < ? AND attempts >= ?',
+                (SHARD_FAILED, SHARD_LEASED, now, max_attempts)
+            )
+            row = self.connection.execute(
+                'SELECT id, hosts FROM shards '
+                'WHERE status = ? OR (status = ? AND lease_expires < ?) '
+                'ORDER BY id LIMIT 1',
+                (SHARD_PENDING, SHARD_LEASED, now)
+            ).fetchone()
+            if row is not None:
+                self.connection.execute(
+                    'UPDATE shards SET status = ?, worker = ?, lease_expires = ?, '
+                    'attempts = attempts + 1 WHERE id = ?',
+                    (SHARD_LEASED, worker, now + lease_seconds, row[0])
+                )
+            self.connection.execute('COMMIT')
+        except Exception:
+            self.connection.execute('ROLLBACK')
+            raise
+
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def renew(
+        self, shard_id: int, worker: str,
+        lease_seconds: int = DEFAULT_LEASE_SECONDS
+    ) -> bool:
+        """
+        Extend the lease of a shard.
+
+        Returns:
+            bool: False if the shard is no longer leased by the worker.
+        """
+        cursor = self.connection.execute(
+            'UPDATE shards SET lease_expires = ? '
+            'WHERE id = ? AND worker = ? AND status = ?',
+            (time.time() + lease_seconds, shard_id, worker, SHARD_LEASED)
+        )
+        return cursor.rowcount == 1
+
+    def complete(self, shard_id: int, worker: str) -> None:
+        """Mark a shard leased by the worker as done."""
+        self.connection.execute(
+            'UPDATE shards SET status = ?, lease_expires = NULL '
+            'WHERE id = ? AND worker = ?',
+            (SHARD_DONE, shard_id, worker)
+        )
+
+    def release(self, shard_id: int, worker: str) -> None:
+        """Give a shard leased by the worker back to the queue."""
+        self.connection.execute(
+            'UPDATE shards SET status = ?, worker = NULL, lease_expires = NULL '
+            'WHERE id = ? AND worker = ? AND status = ?',
+            (SHARD_PENDING, shard_id, worker, SHARD_LEASED)
+        )
+
+    def progress(self) -> dict[str, int]:
+        """Return the number of shards per status."""
+        progress = {
+            SHARD_PENDING: 0, SHARD_LEASED: 0, SHARD_DONE: 0, SHARD_FAILED: 0
+        }
+        for status, count in self.connection.execute(
+            'SELECT status, COUNT(*) FROM shards GROUP BY status'
+        ):
+            progress[status] = count
+        return progress
+
+    def finished(self) -> bool:
+        """Return True if no shard is pending or leased."""
+        progress = self.progress()
+        return progress[SHARD_PENDING] == 0 and progress[SHARD_LEASED] == 0
+
+    def close(self) -> None:
+        self.connection.close()
+
+def __heartbeat(
+    queue_path: str, shard_id: int, worker: str,
+    lease_seconds: int, stop: threading.Event
+) -> None:
+    """
+    Renew the lease of a shard until stop is set.
+
+    A renewal that fails on a locked database is retried after DEFAULT_POLL_INTERVAL seconds,
+    so the lease is kept while another process writes to the database.
+    """
+    jobs = JobQueue(queue_path)
+    interval = lease_seconds / 3
+    try:
+        while not stop.wait(interval):
+            try:
+                if not jobs.renew(shard_id, worker, lease_seconds):
+                    break
+                interval = lease_seconds / 3
+            except sqlite3.OperationalError:
+                interval = min(lease_seconds / 3, DEFAULT_POLL_INTERVAL)
+    finally:
+        jobs.close()
+
+def build_pipeline_args(
+    io_workers: int = DEFAULT_IO_WORKERS, parse_workers: int = None,
+    governor: dict = None, credentials: dict = None, bastions: dict = None,
+    preflight: dict = None, history: str = None
+) -> dict:
+    """
+    Build the FleetPipeline keyword arguments of a worker from plain settings.
+
+    The settings can be passed to a worker process, unlike the objects built from them,
+    which hold locks. Each worker process builds its own objects, so the handshake rates
+    of a governor apply per worker.
+
+    Args:
+        io_workers: The number of concurrent SSH sessions.
+        parse_workers: The number of parser processes, or None for the number of CPUs.
+        governor: Keyword arguments for a ConnectionGovernor, or None.
+        credentials: Keyword arguments for a CredentialCache, or None.
+        bastions: Keyword arguments for the BastionPool, except credentials.
+        preflight: Keyword arguments for a Preflight, or None.
+        history: The path of a DurationHistory, or None.
+
+    Returns:
+        dict: Keyword arguments for FleetPipeline.
+    """
+    from libs.utils import CredentialCache
+
+    credentials = CredentialCache(**credentials) if credentials is not None else None
+    return {
+        'io_workers': io_workers,
+        'parse_workers': parse_workers,
+        'governor': ConnectionGovernor(**governor) if governor is not None else None,
+        'credentials': credentials,
+        'bastions': BastionPool(credentials=credentials, **(bastions or {})),
+        'preflight': Preflight(**preflight) if preflight is not None else None,
+        'history': DurationHistory(history) if history is not None else None,
+    }
+
+def run_worker(
+    queue_path: str, inventory_path: str, worker: str = None,
+    lease_seconds: int = DEFAULT_LEASE_SECONDS,
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    poll_interval: int = DEFAULT_POLL_INTERVAL,
+    **settings
+) -> int:
+    """
+    Process shards from a job queue until the run is finished.
+
+    Each shard is collected with a FleetPipeline into the result store of the queue database.
+    While shards are leased by other workers, the worker keeps polling, so it takes over
+    the shards of workers that die.
+
+    Args:
+        queue_path: The path of the job queue database.
+        inventory_path: The path of the inventory file.
+        worker: The worker id. Defaults to hostname:pid.
+        lease_seconds: The seconds until a lease expires unless renewed.
+        max_attempts: The maximum number of leases per shard.
+        poll_interval: The seconds to wait while all remaining shards are leased.
+        **settings: Plain settings of the pipeline, see build_pipeline_args.
+
+    Returns:
+        int: The number of shards this worker completed.
+    """
+    worker = worker or f'{socket.gethostname()}:{os.getpid()}'
+    pipeline_args = build_pipeline_args(**settings)
+    inventory = {entry['host']: entry for entry in load_inventory(inventory_path)}
+    jobs = JobQueue(queue_path)
+    gatherers = jobs.gatherers()
+    completed = 0
+    try:
+        while True:
+            lease = jobs.lease(worker, lease_seconds, max_attempts)
+            if lease is None:
+                if jobs.finished():
+                    break
+                time.sleep(poll_interval)
+                continue
+
+            shard_id, hosts = lease
+            stop = threading.Event()
+            heartbeat = threading.Thread(
+                target=__heartbeat,
+                args=(queue_path, shard_id, worker, lease_seconds, stop),
+                daemon=True
+            )
+            heartbeat.start()
+            store = ResultStore(queue_path)
+            try:
+                entries = []
+                for host in hosts:
+                    if host in inventory:
+                        entries.append(inventory[host])
+                    else:
+                        for gatherer in gatherers:
+                            store.add(host, gatherer, None, 'Host not found in the inventory of the worker')
+                if entries:
+                    FleetPipeline(entries, gatherers, **pipeline_args).run(store)
+                store.commit()
+                jobs.complete(shard_id, worker)
+                completed += 1
+            except Exception:
+                jobs.release(shard_id, worker)
+                raise
+            finally:
+                stop.set()
+                heartbeat.join()
+                store.close()
+    finally:
+        jobs.close()
+        if pipeline_args.get('credentials') is not None:
+            pipeline_args['credentials'].save()
+        if pipeline_args.get('bastions') is not None:
+            pipeline_args['bastions'].close()
+
+    return completed
+
+def coordinate(
+    queue_path: str, inventory_path: str, output: str,
+    gatherers: list[str] = None,
+    shard_size: int = DEFAULT_SHARD_SIZE,
+    local_workers: int = 1,
+    poll_interval: int = DEFAULT_POLL_INTERVAL,
+    **worker_args
+) -> dict[str, int]:
+    """
+    Shard a fleet run, wait for the workers and merge their results into one workbook.
+
+    If the queue database already holds a run, it is continued instead of being created again.
+    Workers on other machines can join with run_worker as long as they can reach the
+    queue database and have the inventory.
+
+    Args:
+        queue_path: The path of the job queue database.
+        inventory_path: The path of the inventory file.
+        output: The path of the merged Excel file.
+        gatherers: The gatherer names, or None for all gatherers.
+        shard_size: The number of hosts per shard.
+        local_workers: The number of worker processes to start on this machine.
+        poll_interval: The seconds between progress checks.
+        **worker_args: Keyword arguments for run_worker, plain values that can be passed
+            to the worker processes, see build_pipeline_args.
+
+    Returns:
+        dict[str, int]: The number of shards per status at the end of the run.
+    """
+    from libs.sheet import FleetWorkbook
+
+    jobs = JobQueue(queue_path)
+    if not jobs.has_run():
+        hosts = [entry['host'] for entry in load_inventory(inventory_path)]
+        gatherers = gatherer_names(gatherers)
+        if worker_args.get('history') is not None:
+            # Shards are leased in order, so the slowest hosts are sharded and leased first.
+            order, _ = DurationHistory(worker_args['history']).schedule(
+                [(host, gatherers) for host in hosts], local_workers)
+            hosts = [hosts[index] for index in order]
+        jobs.create_run(hosts, gatherers, shard_size)
+
+    processes = []
+    for index in range(local_workers):
+        process = multiprocessing.Process(
+            target=run_worker,
+            args=(queue_path, inventory_path,
+                f'{socket.gethostname()}:{os.getpid()}:{index}'),
+            kwargs=dict(poll_interval=poll_interval, **worker_args)
+        )
+        process.start()
+        processes.append(process)
+
+    while not jobs.finished():
+        if processes and not any(p.is_alive() for p in processes):
+            # Local workers are gone and no remote worker has finished the run.
+            # Their shards stay in the queue for the next coordinator or worker.
+            break
+        time.sleep(poll_interval)
+    for process in processes:
+        process.join()
+
+    workbook = FleetWorkbook()
+    store = ResultStore(queue_path)
+    for host, gatherer, result, error in store.results():
+        workbook.add(host, gatherer, result, error)
+    store.close()
+    workbook.save(output)
+
+    progress = jobs.progress()
+    jobs.close()
+    return progress
@@ -0,0 +1,230 @@
+import heapq
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from libs.gatherer.registry import gatherer_names
+from .store import ResultStore, dump_result
+
+logger = logging.getLogger(__name__)
+
+DRIFT_ADDED = 'added'
+DRIFT_REMOVED = 'removed'
+DRIFT_CHANGED = 'changed'
+
+DEFAULT_INTERVAL = 3600
+DEFAULT_JITTER = 0.1
+DEFAULT_WORKERS = 16
+
+# Keys that identify the items of a list of dictionaries,
+# e.g. the units of systemd_units or the settings of sshd.
+ITEM_ID_KEYS = ('name', 'key', 'mountpoint')
+
+def __item_id(item) -> str:
+    for key in ITEM_ID_KEYS:
+        if isinstance(item, dict) and key in item:
+            return str(item[key])
+    return None
+
+def __index_items(items: list) -> dict:
+    """
+    Index the items of a list for comparison.
+
+    Dictionaries are indexed by their id key if all ids are unique, everything else by its JSON text,
+    so that reordering or inserting items doesn't show up as a change.
+    """
+    ids = [__item_id(item) for item in items]
+    if None not in ids and len(set(ids)) == len(ids):
+        return dict(zip(ids, items))
+    return {json.dumps(item, sort_keys=True): item for item in items}
+
+def diff(old, new, path: str = '') -> list[dict]:
+    """
+    Compare two results of a gatherer.
+
+    Dictionaries are compared key by key and lists as sets of items, see __index_items.
+
+    Args:
+        old: The previous result.
+        new: The current result.
+        path: The dotted path of old and new in the result.
+
+    Returns:
+        list[dict]: One change per added, removed or changed item, with the keys
+            'path', 'change' and 'old' and/or 'new'.
+    """
+    if isinstance(old, list) and isinstance(new, list):
+        old, new = __index_items(old), __index_items(new)
+        if not all(isinstance(v, (dict, list)) for v in list(old.values()) + list(new.values())):
+            # Plain values: only additions and removals matter.
+            changes = [
+                {'path': path, 'change': DRIFT_REMOVED, 'old': old[key]}
+                    for key in old if key not in new
+            ]
+            changes.extend(
+                {'path': path, 'change': DRIFT_ADDED, 'new': new[key]}
+                    for key in new if key not in old
+            )
+            return changes
+
+    if isinstance(old, dict) and isinstance(new, dict):
+        changes = []
+        for key in old:
+            child_path = f'{path}.{key}' if path else str(key)
+            if key not in new:
+                changes.append({'path': child_path, 'change': DRIFT_REMOVED, 'old': old[key]})
+            else:
+                changes.extend(diff(old[key], new[key], child_path))
+        for key in new:
+            if key not in old:
+                child_path = f'{path}.{key}' if path else str(key)
+                changes.append({'path': child_path, 'change': DRIFT_ADDED, 'new': new[key]})
+        return changes
+
+    if old != new:
+        return [{'path': path, 'change': DRIFT_CHANGED, 'old': old, 'new': new}]
+    return []
+
+class DriftMonitor():
+    def __init__(
+        self, inventory: list[dict], gatherers: list[str],
+        state_path: str, changes_path: str,
+        interval: float = DEFAULT_INTERVAL, jitter: float = DEFAULT_JITTER,
+        workers: int = DEFAULT_WORKERS, keep_sessions: bool = True,
+        governor=None, credentials=None, bastions=None
+    ):
+        """
+        Initializes a drift monitor that collects hosts on a jittered interval and logs only changes.
+
+        The last result of each (host, gatherer) is kept in a ResultStore. A new result is compared
+        with it only if its JSON text differs, and only the differences are appended to the change log
+        as JSON lines. The first result of a host is stored as the baseline without logging anything.
+
+        Args:
+            inventory: The inventory entries.
+            gatherers: The gatherer names to monitor.
+            state_path: The path of the SQLite database holding the last snapshot.
+            changes_path: The path of the change log.
+            interval: The average seconds between two checks of a host.
+            jitter: The fraction of interval by which each check is randomly moved,
+                so that hosts don't all get checked at once.
+            workers: The number of hosts checked in parallel.
+            keep_sessions: True to keep the SSH sessions open between checks.
+            governor: A ConnectionGovernor, or None.
+            credentials: A CredentialCache, or None.
+            bastions: A BastionPool for hosts behind a bastion, or None.
+        """
+        from libs.service.daemon import WarmSession
+
+        self.gatherers = gatherer_names(gatherers)
+        self.sessions = {
+            entry['host']: WarmSession(entry, governor, credentials, bastions)
+                for entry in inventory
+        }
+        self.store = ResultStore(state_path)
+        self.changes_path = changes_path
+        self.interval = interval
+        self.jitter = jitter
+        self.workers = workers
+        self.keep_sessions = keep_sessions
+        self.lock = threading.Lock()
+        self.stats = {'checks': 0, 'changes': 0, 'errors': 0}
+
+    def check(self, host: str) -> list[dict]:
+        """
+        Collect a host, log the changes since its last snapshot and update the snapshot.
+
+        Args:
+            host: The host name.
+
+        Returns:
+            list[dict]: The logged changes, each with 'time', 'host' and 'gatherer' added.
+        """
+        session = self.sessions[host]
+        results = session.collect(self.gatherers)
+        if not self.keep_sessions:
+            session.close()
+
+        now = time.strftime('%Y-%m-%dT%H:%M:%S%z')
+        changes = []
+        errors = 0
+        with self.lock:
+            for gatherer, value in results.items():
+                if value['error'] is not None:
+                    errors += 1
+                    continue
+
+                text = dump_result(value['result'])
+                previous = self.store.get(host, gatherer)
+                if previous is not None and previous[0] == text:
+                    continue
+                if previous is not None and previous[0] is not None:
+                    for change in diff(json.loads(previous[0]), value['result']):
+                        changes.append(dict(time=now, host=host, gatherer=gatherer, **change))
+                self.store.add(host, gatherer, value['result'])
+
+            self.store.commit()
+            if changes:
+                with open(self.changes_path, 'a', encoding='utf-8') as f:
+                    for change in changes:
+                        f.write(json.dumps(change, ensure_ascii=False) + '\n')
+            self.stats['checks'] += 1
+            self.stats['changes'] += len(changes)
+            self.stats['errors'] += errors
+
+        return changes
+
+    def __check_done(self, host: str, future, pending: threading.Semaphore) -> None:
+        """Count and log a check that failed as a whole, e.g. on a store or change log error."""
+        pending.release()
+        error = future.exception()
+        if error is not None:
+            logger.error('Drift check of %s failed', host, exc_info=error)
+            with self.lock:
+                self.stats['errors'] += 1
+
+    def __next_due(self, due: float) -> float:
+        return due + self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def run(self, cycles: int = None) -> dict:
+        """
+        Check the hosts until interrupted, or for the given number of cycles.
+
+        Args:
+            cycles: The number of checks per host, or None to run forever.
+
+        Returns:
+            dict: The number of checks, logged changes, and errors of gatherers and of failed checks.
+        """
+        now = time.time()
+        # Spread the first checks over the jitter window.
+        schedule = [
+            (now + random.uniform(0, self.interval * self.jitter), host, 0)
+                for host in self.sessions
+        ]
+        heapq.heapify(schedule)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = threading.Semaphore(self.workers)
+            try:
+                while schedule:
+                    due, host, count = heapq.heappop(schedule)
+                    delay = due - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                    # Don't queue more checks than can run, so late hosts stay in due order.
+                    pending.acquire()
+                    future = executor.submit(self.check, host)
+                    future.add_done_callback(
+                        lambda future, host=host: self.__check_done(host, future, pending))
+                    if cycles is None or count + 1 < cycles:
+                        heapq.heappush(schedule, (self.__next_due(due), host, count + 1))
+            finally:
+                executor.shutdown(wait=True)
+                for session in self.sessions.values():
+                    session.close()
+                self.store.close()
+
+        return dict(self.stats)
@@ -0,0 +1,246 @@
+import ipaddress
+import threading
+import time
+from contextlib import contextmanager
+from .bastion import bastion_name
+
+DEFAULT_SUBNET_PREFIX = 24
+DEFAULT_LATENCY_SPIKE_FACTOR = 3.0
+DEFAULT_BACKOFF_FACTOR = 0.5
+LATENCY_EWMA_WEIGHT = 0.1
+
+GOVERNOR_SUBNET = 'subnet'
+GOVERNOR_BASTION = 'bastion'
+GOVERNOR_AUTH = 'auth'
+
+class TokenBucket():
+    def __init__(self, rate: float, burst: int = 1):
+        """
+        Initializes a token bucket that allows rate handshakes per second on average.
+
+        Args:
+            rate: The number of tokens added per second.
+            burst: The maximum number of tokens that can be saved up.
+        """
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Take a token, going into debt if none is left.
+
+        Returns:
+            float: The seconds the caller must wait before using the token.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+class AdaptiveLimiter():
+    def __init__(
+        self, initial: int, minimum: int = 1, maximum: int = None,
+        backoff_factor: float = DEFAULT_BACKOFF_FACTOR,
+        latency_spike_factor: float = DEFAULT_LATENCY_SPIKE_FACTOR
+    ):
+        """
+        Initializes an AIMD concurrency limiter for handshakes.
+
+        The limit grows by about one for every limit successful handshakes, and is multiplied
+        by backoff_factor on a failure or when a handshake takes latency_spike_factor times
+        longer than the moving average.
+
+        Args:
+            initial: The initial number of concurrent handshakes.
+            minimum: The lowest limit.
+            maximum: The highest limit, or None for no upper bound.
+            backoff_factor: The factor applied to the limit on backoff.
+            latency_spike_factor: The latency ratio to the moving average that counts as a spike.
+        """
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff_factor = backoff_factor
+        self.latency_spike_factor = latency_spike_factor
+        self.latency = None
+        self.in_flight = 0
+        self.backoffs = 0
+        self.condition = threading.Condition()
+
+    def acquire(self) -> None:
+        """Wait until a handshake can start."""
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, ok: bool, latency: float) -> None:
+        """
+        Finish a handshake and adapt the limit.
+
+        Args:
+            ok: True if the handshake succeeded.
+            latency: The seconds the handshake took.
+        """
+        with self.condition:
+            self.in_flight -= 1
+            spike = ok and self.latency is not None and \
+                latency > self.latency * self.latency_spike_factor
+            if ok:
+                if self.latency is None:
+                    self.latency = latency
+                else:
+                    self.latency += (latency - self.latency) * LATENCY_EWMA_WEIGHT
+
+            if not ok or spike:
+                self.limit = max(self.minimum, self.limit * self.backoff_factor)
+                self.backoffs += 1
+            else:
+                self.limit += 1 / self.limit
+                if self.maximum is not None:
+                    self.limit = min(self.maximum, self.limit)
+            self.condition.notify_all()
+
+class ConnectionGovernor():
+    def __init__(
+        self, subnet_rate: float = None, bastion_rate: float = None,
+        auth_rate: float = None, burst: int = 1,
+        initial_concurrency: int = 8, max_concurrency: int = None,
+        subnet_prefix: int = DEFAULT_SUBNET_PREFIX
+    ):
+        """
+        Initializes a governor for SSH handshakes of a fleet run.
+
+        Handshakes are rate limited by token buckets per target subnet, per bastion and
+        per authentication backend, and their concurrency is adapted per subnet and per bastion.
+        The bastion and the authentication backend of a host are taken from the
+        'bastion' and 'auth_backend' keys of its inventory entry.
+
+        Args:
+            subnet_rate: Handshakes per second per subnet, or None for no limit.
+            bastion_rate: Handshakes per second per bastion, or None for no limit.
+            auth_rate: Handshakes per second per authentication backend, or None for no limit.
+            burst: The number of handshakes each bucket allows at once.
+            initial_concurrency: The initial number of concurrent handshakes per subnet and bastion.
+            max_concurrency: The maximum number of concurrent handshakes per subnet and bastion.
+            subnet_prefix: The prefix length that groups IPv4 targets into subnets.
+        """
+        self.rates = {
+            GOVERNOR_SUBNET: subnet_rate,
+            GOVERNOR_BASTION: bastion_rate,
+            GOVERNOR_AUTH: auth_rate,
+        }
+        self.burst = burst
+        self.initial_concurrency = initial_concurrency
+        self.max_concurrency = max_concurrency
+        self.subnet_prefix = subnet_prefix
+        self.buckets = {}
+        self.limiters = {}
+        self.lock = threading.Lock()
+        self.stats = {'handshakes': 0, 'failures': 0, 'wait_seconds': 0.0}
+
+    def keys(self, entry: dict) -> list[tuple[str, str]]:
+        """
+        Return the (kind, key) pairs that govern the handshake of an inventory entry.
+
+        Hosts given by name are grouped by their domain instead of a subnet.
+        """
+        host = entry['host']
+        try:
+            address = ipaddress.ip_address(host)
+            prefix = self.subnet_prefix if address.version == 4 else 64
+            subnet = str(ipaddress.ip_network(f'{host}/{prefix}', strict=False))
+        except ValueError:
+            subnet = host.split('.', 1)[1] if '.' in host else host
+
+        keys = []
+        if entry.get('bastion'):
+            keys.append((GOVERNOR_BASTION, bastion_name(entry['bastion'])))
+        keys.append((GOVERNOR_SUBNET, subnet))
+        keys.append((GOVERNOR_AUTH, str(entry.get('auth_backend', 'default'))))
+        return keys
+
+    def __bucket(self, kind: str, key: str) -> TokenBucket:
+        with self.lock:
+            bucket = self.buckets.get((kind, key))
+            if bucket is None:
+                bucket = TokenBucket(self.rates[kind], self.burst)
+                self.buckets[(kind, key)] = bucket
+            return bucket
+
+    def __limiter(self, kind: str, key: str) -> AdaptiveLimiter:
+        with self.lock:
+            limiter = self.limiters.get((kind, key))
+            if limiter is None:
+                limiter = AdaptiveLimiter(
+                    self.initial_concurrency, maximum=self.max_concurrency)
+                self.limiters[(kind, key)] = limiter
+            return limiter
+
+    @contextmanager
+    def handshake(self, entry: dict):
+        """
+        Govern the handshake of an inventory entry.
+
+        Use it around the construction of a CommandRunner (and su). Any exception raised
+        inside counts as a failed handshake and makes the governor back off.
+
+        Args:
+            entry: The inventory entry of the host.
+        """
+        keys = self.keys(entry)
+        limiters = [
+            self.__limiter(kind, key) for kind, key in keys
+                if kind in (GOVERNOR_BASTION, GOVERNOR_SUBNET)
+        ]
+
+        waited = time.monotonic()
+        # Always in the order of keys(), so two handshakes can't wait on each other.
+        for limiter in limiters:
+            limiter.acquire()
+        delay = 0.0
+        for kind, key in keys:
+            if self.rates[kind]:
+                delay = max(delay, self.__bucket(kind, key).reserve())
+        if delay:
+            time.sleep(delay)
+        started = time.monotonic()
+
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            latency = time.monotonic() - started
+            for limiter in reversed(limiters):
+                limiter.release(ok, latency)
+            with self.lock:
+                self.stats['handshakes'] += 1
+                self.stats['failures'] += 0 if ok else 1
+                self.stats['wait_seconds'] += started - waited
+
+    def report(self) -> dict:
+        """
+        Report the handshakes, failures and time spent waiting, and the current
+        concurrency limit of each subnet and bastion.
+        """
+        with self.lock:
+            report = dict(self.stats)
+            report['wait_seconds'] = round(report['wait_seconds'], 3)
+            report['concurrency'] = {
+                f'{kind}:{key}': {
+                    'limit': int(limiter.limit),
+                    'backoffs': limiter.backoffs,
+                    'latency': round(limiter.latency, 3) if limiter.latency else None,
+                }
+                    for (kind, key), limiter in self.limiters.items()
+            }
+        return report
@@ -0,0 +1,221 @@
+import heapq
+import sqlite3
+import time
+from .store import SQLITE_TIMEOUT
+
+# The name the connect time of a host, with the prefetch of its files, is recorded under.
+HISTORY_CONNECT = ':connect'
+HISTORY_EWMA_WEIGHT = 0.5
+# The seconds assumed for a gatherer that has not been timed on any host yet.
+DEFAULT_GATHERER_SECONDS = 1.0
+# Hosts per query, below the SQLite limit of bound parameters.
+HISTORY_QUERY_HOSTS = 500
+
+def makespan(durations: list[float], workers: int) -> float:
+    """
+    Simulate list scheduling: each job, in order, goes to the first free worker.
+
+    Args:
+        durations: The seconds of each job, in the order they are queued.
+        workers: The number of workers.
+
+    Returns:
+        float: The seconds until the last job finishes.
+    """
+    loads = [0.0] * max(1, workers)
+    for seconds in durations:
+        heapq.heapreplace(loads, loads[0] + seconds)
+    return max(loads)
+
+class DurationHistory():
+    def __init__(
+        self, path: str, timeout: int = SQLITE_TIMEOUT,
+        weight: float = HISTORY_EWMA_WEIGHT
+    ):
+        """
+        Initializes a SQLite history of collect durations, kept across fleet runs.
+
+        The connect time of each host and the collect time of each gatherer on each host are
+        kept as moving averages, and per gatherer over all hosts for hosts without history.
+        Each method opens its own connection, so a history can be passed to worker processes
+        and shared by several processes, and on shared storage by several machines.
+
+        Args:
+            path: The path of the SQLite database.
+            timeout: The seconds to wait for a lock held by another process.
+            weight: The weight of the latest run in the moving averages.
+        """
+        self.path = path
+        self.timeout = timeout
+        self.weight = weight
+        connection = self.__connect()
+        try:
+            with connection:
+                connection.execute(
+                    'CREATE TABLE IF NOT EXISTS durations ('
+                    'host TEXT NOT NULL, gatherer TEXT NOT NULL, '
+                    'seconds REAL NOT NULL, runs INTEGER NOT NULL, '
+                    'PRIMARY KEY (host, gatherer))'
+                )
+                connection.execute(
+                    'CREATE TABLE IF NOT EXISTS gatherers ('
+                    'gatherer TEXT PRIMARY KEY, seconds REAL NOT NULL, runs INTEGER NOT NULL)'
+                )
+                connection.execute(
+                    'CREATE TABLE IF NOT EXISTS runs ('
+                    'id INTEGER PRIMARY KEY, finished REAL NOT NULL, '
+                    'hosts INTEGER NOT NULL, workers INTEGER NOT NULL, '
+                    'predicted REAL NOT NULL, actual REAL NOT NULL)'
+                )
+        finally:
+            connection.close()
+
+    def __connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=self.timeout)
+
+    def __load(self, hosts: list[str]) -> tuple[dict, dict]:
+        """Return the durations of the hosts by host and gatherer, and the gatherer averages."""
+        hosts = list(set(hosts))
+        history = {}
+        connection = self.__connect()
+        try:
+            for index in range(0, len(hosts), HISTORY_QUERY_HOSTS):
+                chunk = hosts[index:index + HISTORY_QUERY_HOSTS]
+                cursor = connection.execute(
+                    'SELECT host, gatherer, seconds FROM durations '
+                    f"WHERE host IN ({','.join('?' * len(chunk))})",
+                    chunk
+                )
+                for host, gatherer, seconds in cursor:
+                    history.setdefault(host, {})[gatherer] = seconds
+            averages = dict(connection.execute('SELECT gatherer, seconds FROM gatherers'))
+        finally:
+            connection.close()
+        return history, averages
+
+    def predict(self, jobs: list[tuple[str, list[str]]]) -> list[float]:
+        """
+        Predict the collect seconds of hosts.
+
+        Args:
+            jobs: (host, gatherer names) per host.
+
+        Returns:
+            list[float]: The predicted seconds of each job: the connect time plus the collect
+                time of each gatherer, from the history of the host or else the average of the
+                gatherer over all hosts.
+        """
+        return self.__predict(jobs, *self.__load([host for host, _ in jobs]))
+
+    def __predict(
+        self, jobs: list[tuple[str, list[str]]], history: dict, averages: dict
+    ) -> list[float]:
+        predictions = []
+        for host, gatherers in jobs:
+            known = history.get(host, {})
+            predictions.append(sum(
+                known.get(gatherer, averages.get(gatherer, DEFAULT_GATHERER_SECONDS))
+                    for gatherer in [HISTORY_CONNECT, *gatherers]
+            ))
+        return predictions
+
+    def schedule(self, jobs: list[tuple[str, list[str]]], workers: int) -> tuple[list[int], dict]:
+        """
+        Order hosts longest first (LPT), so that the slowest hosts don't start last and leave
+        a long tail of one busy worker.
+
+        Args:
+            jobs: (host, gatherer names) per host, in inventory order.
+            workers: The number of collect workers.
+
+        Returns:
+            tuple[list[int], dict]: The indices of the jobs longest first, and the estimate:
+                the predicted makespan in this order and in inventory order, and the number
+                of hosts and of hosts with a history.
+        """
+        history, averages = self.__load([host for host, _ in jobs])
+        predictions = self.__predict(jobs, history, averages)
+        order = sorted(range(len(jobs)), key=lambda index: -predictions[index])
+        return order, {
+            'hosts': len(jobs),
+            'hosts_with_history': sum(1 for host, _ in jobs if host in history),
+            'workers': workers,
+            'predicted_makespan': round(
+                makespan([predictions[index] for index in order], workers), 3),
+            'predicted_makespan_inventory_order': round(makespan(predictions, workers), 3),
+        }
+
+    def record(self, durations: list[tuple[str, str, float]]) -> None:
+        """
+        Fold the durations of a run into the history.
+
+        Args:
+            durations: (host, gatherer name or HISTORY_CONNECT, seconds) per measurement.
+        """
+        if not durations:
+            return
+        totals = {}
+        for _, gatherer, seconds in durations:
+            total = totals.setdefault(gatherer, [0.0, 0])
+            total[0] += seconds
+            total[1] += 1
+
+        upsert = (
+            'INSERT INTO {table} ({key}, seconds, runs) VALUES ({values}, :seconds, 1) '
+            'ON CONFLICT ({key}) DO UPDATE SET '
+            'seconds = seconds * (1 - :weight) + excluded.seconds * :weight, runs = runs + 1'
+        )
+        connection = self.__connect()
+        try:
+            with connection:
+                connection.executemany(
+                    upsert.format(table='durations', key='host, gatherer', values=':host, :gatherer'),
+                    [
+                        {'host': host, 'gatherer': gatherer, 'seconds': seconds, 'weight': self.weight}
+                            for host, gatherer, seconds in durations
+                    ]
+                )
+                connection.executemany(
+                    upsert.format(table='gatherers', key='gatherer', values=':gatherer'),
+                    [
+                        {'gatherer': gatherer, 'seconds': total / count, 'weight': self.weight}
+                            for gatherer, (total, count) in totals.items()
+                    ]
+                )
+        finally:
+            connection.close()
+
+    def record_run(self, hosts: int, workers: int, predicted: float, actual: float) -> None:
+        """Record the predicted and actual makespan of a run."""
+        connection = self.__connect()
+        try:
+            with connection:
+                connection.execute(
+                    'INSERT INTO runs (finished, hosts, workers, predicted, actual) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (time.time(), hosts, workers, predicted, actual)
+                )
+        finally:
+            connection.close()
+
+    def runs(self, limit: int = 10) -> list[dict]:
+        """Return the latest runs with their predicted and actual makespan, latest first."""
+        connection = self.__connect()
+        try:
+            rows = connection.execute(
+                'SELECT finished, hosts, workers, predicted, actual FROM runs '
+                'ORDER BY id DESC LIMIT ?',
+                (limit,)
+            ).fetchall()
+        finally:
+            connection.close()
+        return [
+            {
+                'finished': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(finished)),
+                'hosts': hosts,
+                'workers': workers,
+                'predicted_makespan': round(predicted, 3),
+                'actual_makespan': round(actual, 3),
+            }
+                for finished, hosts, workers, predicted, actual in rows
+        ]
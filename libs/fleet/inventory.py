@@ -0,0 +1,96 @@
+from __future__ import annotations
+import json
+from typing import TYPE_CHECKING
+from .bastion import DEFAULT_BASTION_TIMEOUT
+
+if TYPE_CHECKING:
+    from libs.utils import CommandRunner, CredentialCache
+
+# Keys of an inventory entry that are not passed to CommandRunner.
+INVENTORY_EXTRA_KEYS = {'root_password', 'set_lang_c', 'bastion', 'auth_backend'}
+
+def load_inventory(path: str) -> list[dict]:
+    """
+    Load an inventory file.
+
+    The inventory is a JSON list of host entries. Each entry holds the keyword arguments of
+    CommandRunner, e.g. {"host": "192.0.2.10", "user": "admin", "password": "..."},
+    and optionally "root_password" to switch to the root user after login.
+    "bastion" is the jump host the host is reached through, see bastion_spec, and
+    "auth_backend" names the authentication backend (e.g. an LDAP domain) of the host
+    for the ConnectionGovernor.
+
+    Args:
+        path: The path of the inventory file.
+
+    Returns:
+        A list of host entries.
+
+    Raises:
+        ValueError: If the inventory is not a list of entries with a host and a user.
+    """
+    with open(path, encoding='utf-8') as f:
+        inventory = json.load(f)
+
+    if not isinstance(inventory, list):
+        raise ValueError(f'Inventory must be a list of hosts: {path}')
+    for entry in inventory:
+        if not isinstance(entry, dict) or 'host' not in entry or 'user' not in entry:
+            raise ValueError(f'Inventory entry must have a host and a user: {entry}')
+
+    return inventory
+
+def connect(
+    entry: dict, governor=None, credentials: CredentialCache = None, bastions=None
+) -> CommandRunner:
+    """
+    Connect to the host of an inventory entry.
+
+    Args:
+        entry: The host entry.
+        governor: A ConnectionGovernor that the handshake waits for, or None.
+        credentials: A CredentialCache shared by all connections, or None.
+        bastions: A BastionPool to tunnel through if the entry has a bastion, or None
+            to connect directly.
+
+    Returns:
+        A CommandRunner, switched to the root user if the entry has a root_password.
+    """
+    runner_args = {
+        key: value for key, value in entry.items()
+            if key not in INVENTORY_EXTRA_KEYS
+    }
+    if credentials is not None:
+        runner_args['credentials'] = credentials
+    if bastions is not None and entry.get('bastion'):
+        # Opened before the handshake is governed: the wait for a session of the bastion pool
+        # is no latency of the target.
+        runner_args['sock'] = bastions.open_channel(
+            entry['bastion'], entry['host'], entry.get('port', 22),
+            entry.get('timeout', DEFAULT_BASTION_TIMEOUT)
+        )
+
+    try:
+        if governor is not None:
+            with governor.handshake(entry):
+                return __login(runner_args, entry)
+        return __login(runner_args, entry)
+    except Exception:
+        if 'sock' in runner_args:
+            runner_args['sock'].close()
+        raise
+
+def __login(runner_args: dict, entry: dict) -> CommandRunner:
+    """Create the runner of an entry and switch to root, closing the runner if su fails."""
+    # Imported here so that loading an inventory doesn't load paramiko.
+    from libs.utils import CommandRunner
+
+    runner = CommandRunner(**runner_args)
+    if entry.get('root_password') is not None:
+        try:
+            runner.su(entry['root_password'], entry.get('set_lang_c', True))
+        except Exception:
+            runner.close()
+            raise
+
+    return runner
@@ -0,0 +1,163 @@
+import json
+import os
+import time
+
+FSYNC_ALWAYS = 'always'
+FSYNC_INTERVAL = 'interval'
+FSYNC_NEVER = 'never'
+FSYNC_POLICIES = (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER)
+
+DEFAULT_FSYNC_INTERVAL = 1.0
+
+JOURNAL_OK = b'ok'
+JOURNAL_ERROR = b'error'
+
+class JournalException(Exception):
+    pass
+
+class Journal():
+    def __init__(
+        self, path: str, resume: bool = False,
+        fsync: str = FSYNC_INTERVAL, fsync_interval: float = DEFAULT_FSYNC_INTERVAL
+    ):
+        """
+        Initializes an append-only journal of (host, gatherer) results.
+
+        Each entry is one line: host, gatherer and status separated by tabs, followed by the
+        result or error as JSON. Resuming only splits off the first three fields of each line,
+        so the completed work of a journal with millions of entries is known without parsing
+        any result. A torn last line of an interrupted run is cut off.
+
+        Every entry is written to the file when it is added, so a crash of the collector loses
+        nothing. The fsync policy decides what survives a crash of the machine:
+        'always' syncs every entry, 'interval' at most every fsync_interval seconds and
+        'never' leaves it to the OS.
+
+        Args:
+            path: The journal file.
+            resume: True to keep the entries of an existing journal, False to start a new one.
+            fsync: The fsync policy, one of FSYNC_POLICIES.
+            fsync_interval: The seconds between two syncs with the 'interval' policy.
+
+        Raises:
+            JournalException: The fsync policy is unknown.
+        """
+        if fsync not in FSYNC_POLICIES:
+            raise JournalException(f'Unknown fsync policy {fsync}, expected one of {FSYNC_POLICIES}')
+
+        self.path = path
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.last_sync = time.monotonic()
+        # (host, gatherer) as bytes -> offset of the last successful entry.
+        self.completed = {}
+
+        if resume and os.path.exists(path):
+            end = self.__scan()
+            self.file = open(path, 'r+b')
+            self.file.truncate(end)
+            self.file.seek(end)
+        else:
+            self.file = open(path, 'wb')
+
+    def __scan(self) -> int:
+        """
+        Read the completed work of the journal.
+
+        Returns:
+            int: The offset after the last complete entry.
+        """
+        completed = self.completed
+        offset = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                fields = line.split(b'\t', 3)
+                if len(fields) != 4:
+                    break
+
+                key = (fields[0], fields[1])
+                if fields[2] == JOURNAL_OK:
+                    completed[key] = offset
+                else:
+                    # A later failure replaces an earlier success.
+                    completed.pop(key, None)
+                offset += len(line)
+        return offset
+
+    def done(self, host: str, gatherer: str) -> bool:
+        """Return True if the journal holds a successful result of the gatherer for the host."""
+        return (host.encode(), gatherer.encode()) in self.completed
+
+    def replay(self, sink) -> int:
+        """
+        Add the last successful result of each (host, gatherer) in the journal to a sink.
+
+        Args:
+            sink: An object with an add(host, gatherer, result, error) method.
+
+        Returns:
+            int: The number of replayed results.
+        """
+        if not self.completed:
+            return 0
+
+        offsets = set(self.completed.values())
+        self.file.flush()
+        count = 0
+        offset = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if offset in offsets:
+                    host, gatherer, _, payload = line.split(b'\t', 3)
+                    sink.add(host.decode(), gatherer.decode(), json.loads(payload), None)
+                    count += 1
+                offset += len(line)
+        return count
+
+    def add(self, host: str, gatherer: str, result=None, error: str = None) -> None:
+        """
+        Append a result to the journal.
+
+        Args:
+            host: The host name.
+            gatherer: The gatherer name.
+            result: The gatherer result, ignored if error is given.
+            error: The error message, or None if the gatherer succeeded.
+
+        Raises:
+            JournalException: The host or gatherer name contains a tab or a line break.
+        """
+        if any(c in host + gatherer for c in '\t\r\n'):
+            raise JournalException(f'Cannot journal {host!r} {gatherer!r}: tab or line break in name')
+
+        key = (host.encode(), gatherer.encode())
+        status = JOURNAL_OK if error is None else JOURNAL_ERROR
+        payload = json.dumps(result if error is None else error, separators=(',', ':'))
+        offset = self.file.tell()
+        self.file.write(b'\t'.join((*key, status, payload.encode())) + b'\n')
+        self.file.flush()
+
+        if error is None:
+            self.completed[key] = offset
+        else:
+            self.completed.pop(key, None)
+
+        if self.fsync == FSYNC_ALWAYS or (
+            self.fsync == FSYNC_INTERVAL
+            and time.monotonic() - self.last_sync >= self.fsync_interval
+        ):
+            self.sync()
+
+    def sync(self) -> None:
+        """Flush the journal to disk."""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_sync = time.monotonic()
+
+    def close(self) -> None:
+        if not self.file.closed:
+            if self.fsync != FSYNC_NEVER:
+                self.sync()
+            self.file.close()
@@ -0,0 +1,379 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from libs.gatherer.registry import GATHERERS, gatherer_names, prefetch_paths
+from .history import HISTORY_CONNECT
+from .inventory import connect
+
+DEFAULT_IO_WORKERS = 32
+DEFAULT_QUEUE_SIZE = 64
+
+class StageStats():
+    def __init__(self, name: str, workers: int):
+        """
+        Initializes the throughput counters of a pipeline stage.
+
+        Args:
+            name: The stage name.
+            workers: The number of workers of the stage.
+        """
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.started = None
+        self.finished = None
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        """Record one processed item that kept a worker busy for the given seconds."""
+        with self.lock:
+            if self.started is None:
+                self.started = time.monotonic() - seconds
+            self.items += 1
+            self.busy_seconds += seconds
+            self.finished = time.monotonic()
+
+    def report(self) -> dict:
+        """
+        Report the throughput of the stage.
+
+        Returns:
+            dict: The number of items, the wall time between the first and the last item,
+                the items per second and the average utilization of the workers.
+        """
+        wall_seconds = 0.0
+        if self.started is not None:
+            wall_seconds = self.finished - self.started
+        return {
+            'stage': self.name,
+            'workers': self.workers,
+            'items': self.items,
+            'busy_seconds': round(self.busy_seconds, 3),
+            'wall_seconds': round(wall_seconds, 3),
+            'items_per_second': round(self.items / wall_seconds, 2) if wall_seconds else None,
+            'utilization': round(self.busy_seconds / (wall_seconds * self.workers), 3)
+                if wall_seconds else None,
+        }
+
+def parse_result(gatherer: str, raw) -> tuple:
+    """
+    Parse a collected gatherer output. Runs in a worker process.
+
+    Args:
+        gatherer: The gatherer name.
+        raw: The output of the collect function of the gatherer.
+
+    Returns:
+        tuple: The parsed result, the error message or None, and the seconds spent.
+    """
+    started = time.monotonic()
+    try:
+        result, error = GATHERERS[gatherer][1](raw), None
+    except Exception as e:
+        result, error = None, f'{type(e).__name__}: {e}'
+    return result, error, time.monotonic() - started
+
+def _done(result, error: str = None) -> Future:
+    """Return a completed future for an item that needs no parsing."""
+    future = Future()
+    future.set_result((result, error, 0.0))
+    return future
+
+class FleetPipeline():
+    def __init__(
+        self, inventory: list[dict], gatherers: list[str] = None,
+        io_workers: int = DEFAULT_IO_WORKERS, parse_workers: int = None,
+        queue_size: int = DEFAULT_QUEUE_SIZE, governor=None,
+        credentials=None, journal=None, bastions=None, preflight=None, history=None
+    ):
+        """
+        Initializes a collect -> parse -> render pipeline over a fleet.
+
+        SSH I/O runs in a thread pool, parsing of collected outputs runs in a process pool
+        and rendering into a sink (a FleetWorkbook or a ResultStore) runs in a single thread. The stages are connected by bounded queues,
+        so a slow stage blocks the previous one instead of letting outputs pile up in memory.
+
+        Args:
+            inventory: The host entries, see load_inventory.
+            gatherers: The gatherer names, or None for all gatherers.
+            io_workers: The number of concurrent SSH sessions.
+            parse_workers: The number of parser processes. Defaults to the number of CPUs.
+            queue_size: The maximum number of items waiting between two stages.
+            governor: A ConnectionGovernor for the SSH handshakes, or None.
+            credentials: A CredentialCache shared by all connections, or None.
+            journal: A Journal every result is appended to as soon as it is rendered, or None.
+                Results already in the journal are replayed into the sink instead of collected again.
+            bastions: A BastionPool for hosts behind a bastion, or None to connect directly.
+            preflight: A Preflight that probes all hosts before collection, or None.
+                The gatherers of unreachable hosts fail at once instead of each host
+                holding a collect worker until the SSH timeout.
+            history: A DurationHistory to queue the slowest hosts first by, or None to queue
+                the hosts in inventory order. The durations of the run are added to it.
+        """
+        self.inventory = inventory
+        self.gatherers = gatherer_names(gatherers)
+        self.io_workers = max(1, min(io_workers, len(inventory)))
+        self.parse_workers = parse_workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.governor = governor
+        self.credentials = credentials
+        self.journal = journal
+        self.bastions = bastions
+        self.preflight = preflight
+        self.history = history
+        self.replayed = 0
+        self.unreachable = {}
+        self.durations = []
+        self.transfers = []
+        self.schedule = None
+
+        self.host_queue = queue.Queue()
+        self.parse_queue = queue.Queue(maxsize=self.queue_size)
+        self.render_queue = queue.Queue(maxsize=self.queue_size)
+        self.render_error = None
+        self.parse_error = None
+        self.stats = {
+            'collect': StageStats('collect', self.io_workers),
+            'parse': StageStats('parse', self.parse_workers),
+            'render': StageStats('render', 1),
+        }
+
+    def __time(self, host: str, name: str, seconds: float) -> None:
+        """Keep a collect duration for the history."""
+        if self.history is not None:
+            self.durations.append((host, name, seconds))
+
+    def __collect_worker(self) -> None:
+        """Collect the gatherer outputs of hosts from the host queue."""
+        # Imported here so that the parser processes, which import this module, don't load paramiko.
+        from libs.utils.command_runner import OS2SheetCommandRunnerException
+
+        while True:
+            item = self.host_queue.get()
+            if item is None:
+                break
+            entry, gatherers = item
+
+            host = entry['host']
+            started = time.monotonic()
+            try:
+                if host in self.unreachable:
+                    raise self.unreachable[host]
+                runner = connect(entry, self.governor, self.credentials, self.bastions)
+            except Exception as e:
+                # Not kept for the history: a failed connect, e.g. after the full SSH timeout,
+                # would queue dead hosts first in the next run.
+                self.stats['collect'].record(time.monotonic() - started)
+                for gatherer in gatherers:
+                    self.parse_queue.put(
+                        (host, gatherer, None, f'{type(e).__name__}: {e}'))
+                continue
+
+            # The error of a failed reconnect, which the remaining gatherers of the host fail with.
+            failure = None
+            try:
+                try:
+                    runner.prefetch_files(prefetch_paths(gatherers))
+                except OS2SheetCommandRunnerException:
+                    runner, failure = self.__reconnect(entry, runner)
+                except Exception:
+                    # The gatherers read the files one by one instead.
+                    pass
+                self.__time(host, HISTORY_CONNECT, time.monotonic() - started)
+                for gatherer in gatherers:
+                    started = time.monotonic()
+                    if failure is not None:
+                        raw, error = None, failure
+                    else:
+                        try:
+                            raw, error = GATHERERS[gatherer][0](runner), None
+                        except OS2SheetCommandRunnerException as e:
+                            raw, error = None, f'{type(e).__name__}: {e}'
+                            runner, failure = self.__reconnect(entry, runner)
+                        except Exception as e:
+                            raw, error = None, f'{type(e).__name__}: {e}'
+                    seconds = time.monotonic() - started
+                    self.stats['collect'].record(seconds)
+                    self.__time(host, gatherer, seconds)
+                    self.parse_queue.put((host, gatherer, raw, error))
+            finally:
+                if runner is not None:
+                    self.transfers.append(runner.transfer_report())
+                    runner.close()
+
+    def __reconnect(self, entry: dict, runner) -> tuple:
+        """
+        Replace the runner of a host after a runner error, e.g. a timeout: the command may
+        still be running in its shell, and its output would be read by the next command.
+
+        Returns:
+            tuple: The new runner and None, or None and the error of the reconnect.
+        """
+        self.transfers.append(runner.transfer_report())
+        runner.close()
+        try:
+            return connect(entry, self.governor, self.credentials, self.bastions), None
+        except Exception as e:
+            return None, f'{type(e).__name__}: {e}'
+
+    def __parse_dispatcher(self, pool: ProcessPoolExecutor) -> None:
+        """Hand collected outputs to the process pool in collection order."""
+        while True:
+            item = self.parse_queue.get()
+            if item is None:
+                break
+
+            host, gatherer, raw, error = item
+            if error is None and GATHERERS[gatherer][1] is not None:
+                try:
+                    future = pool.submit(parse_result, gatherer, raw)
+                except Exception as e:
+                    # The pool is broken, e.g. a parser process was killed. The item fails
+                    # and the queue keeps draining, so that the collect workers don't block.
+                    self.parse_error = self.parse_error or e
+                    future = _done(None, f'{type(e).__name__}: {e}')
+            else:
+                future = _done(raw, error)
+            # Blocks while the render stage is behind, which bounds the futures in flight.
+            self.render_queue.put((host, gatherer, future))
+
+        self.render_queue.put(None)
+
+    def __render(self, sink) -> None:
+        """Write parsed results into the sink."""
+        # A ResultStore holds the write lock of its database until it commits, which would
+        # block the lease renewals of the job queue while the stage waits for results.
+        commit = getattr(sink, 'commit', None)
+        while True:
+            if commit is not None and self.render_error is None and self.render_queue.empty():
+                self.__commit(commit)
+            item = self.render_queue.get()
+            if item is None:
+                break
+
+            host, gatherer, future = item
+            if commit is not None and self.render_error is None and not future.done():
+                self.__commit(commit)
+            try:
+                result, error, parse_seconds = future.result()
+            except Exception as e:
+                self.parse_error = self.parse_error or e
+                result, error, parse_seconds = None, f'{type(e).__name__}: {e}', 0.0
+            if parse_seconds:
+                self.stats['parse'].record(parse_seconds)
+
+            if self.render_error is not None:
+                # Keep draining, so that the other stages don't block forever.
+                continue
+            started = time.monotonic()
+            try:
+                sink.add(host, gatherer, result, error)
+                if self.journal is not None:
+                    self.journal.add(host, gatherer, result, error)
+            except Exception as e:
+                self.render_error = e
+            self.stats['render'].record(time.monotonic() - started)
+
+    def transfer_report(self) -> dict:
+        """
+        Report the data transferred from the hosts collected so far, see CommandRunner.transfer_report.
+
+        Returns:
+            dict: The number of hosts and of hosts with remote compression, and the totals of
+                'received_bytes', 'payload_bytes' and 'bytes_saved'.
+        """
+        transfers = list(self.transfers)
+        return {
+            'hosts': len(transfers),
+            'remote_compression_hosts': sum(1 for report in transfers if report['remote_compression']),
+            'received_bytes': sum(report['received_bytes'] for report in transfers),
+            'payload_bytes': sum(report['payload_bytes'] for report in transfers),
+            'bytes_saved': sum(report['bytes_saved'] for report in transfers),
+        }
+
+    def __commit(self, commit) -> None:
+        """Commit the results added to the sink so far."""
+        try:
+            commit()
+        except Exception as e:
+            self.render_error = e
+
+    def run(self, sink) -> list[dict]:
+        """
+        Run the pipeline.
+
+        Args:
+            sink: The object results are added to, with an add(host, gatherer, result, error) method,
+                e.g. a FleetWorkbook or a ResultStore. The caller saves or closes it.
+                If the sink has a commit method, it is called whenever the render stage waits.
+
+        Returns:
+            list[dict]: The throughput report of each stage, see StageStats.report.
+
+        Raises:
+            Exception: The first exception raised by the sink or the journal, or else the
+                failure of the parser pool, e.g. BrokenProcessPool. The results of the items
+                that could not be parsed are added to the sink as errors.
+        """
+        items = []
+        for entry in self.inventory:
+            gatherers = self.gatherers
+            if self.journal is not None:
+                gatherers = [
+                    gatherer for gatherer in gatherers
+                        if not self.journal.done(entry['host'], gatherer)
+                ]
+            if gatherers:
+                items.append((entry, gatherers))
+        if self.preflight is not None:
+            self.unreachable = self.preflight.sweep([entry for entry, _ in items])
+        if self.history is not None:
+            # Unreachable hosts take no time, they are queued last.
+            reachable = [item for item in items if item[0]['host'] not in self.unreachable]
+            order, self.schedule = self.history.schedule(
+                [(entry['host'], gatherers) for entry, gatherers in reachable], self.io_workers)
+            items = [reachable[index] for index in order] + [
+                item for item in items if item[0]['host'] in self.unreachable
+            ]
+        for item in items:
+            self.host_queue.put(item)
+        if self.journal is not None:
+            self.replayed = self.journal.replay(sink)
+        for _ in range(self.io_workers):
+            self.host_queue.put(None)
+
+        with ProcessPoolExecutor(max_workers=self.parse_workers) as pool:
+            collectors = [
+                threading.Thread(target=self.__collect_worker, daemon=True)
+                    for _ in range(self.io_workers)
+            ]
+            dispatcher = threading.Thread(
+                target=self.__parse_dispatcher, args=(pool,), daemon=True)
+            renderer = threading.Thread(
+                target=self.__render, args=(sink,), daemon=True)
+
+            started = time.monotonic()
+            for thread in collectors + [dispatcher, renderer]:
+                thread.start()
+            for thread in collectors:
+                thread.join()
+            collect_seconds = time.monotonic() - started
+            self.parse_queue.put(None)
+            dispatcher.join()
+            renderer.join()
+
+        if self.history is not None:
+            self.history.record(self.durations)
+            self.schedule['actual_makespan'] = round(collect_seconds, 3)
+            self.history.record_run(
+                self.schedule['hosts'], self.io_workers,
+                self.schedule['predicted_makespan'], collect_seconds
+            )
+        if self.render_error is not None:
+            raise self.render_error
+        if self.parse_error is not None:
+            raise self.parse_error
+        return [stats.report() for stats in self.stats.values()]
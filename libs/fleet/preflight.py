@@ -0,0 +1,205 @@
+import asyncio
+import errno
+import os
+import socket
+import time
+from .bastion import bastion_spec, bastion_name
+
+DEFAULT_PREFLIGHT_TIMEOUT = 3.0
+DEFAULT_PREFLIGHT_CONCURRENCY = 1000
+# A server may send other lines before its version line (RFC 4253 4.2).
+MAX_BANNER_LINES = 16
+
+# Connect errors that mean the host can't be reached. Other errors, e.g. running out of
+# file descriptors locally, leave the host to the SSH handshake.
+UNREACHABLE_ERRNOS = {
+    errno.ECONNREFUSED,
+    errno.ECONNRESET,
+    errno.EHOSTUNREACH,
+    errno.ENETUNREACH,
+    errno.EHOSTDOWN,
+    errno.ETIMEDOUT,
+}
+
+class PreflightException(Exception):
+    pass
+
+class Preflight():
+    def __init__(
+        self, timeout: float = DEFAULT_PREFLIGHT_TIMEOUT,
+        concurrency: int = DEFAULT_PREFLIGHT_CONCURRENCY, banner: bool = True
+    ):
+        """
+        Initializes a reachability sweep, run over the whole inventory before collection.
+
+        Every SSH port is probed at once with asyncio: a TCP connect, and then the wait for the
+        SSH version line of the server. Host names are resolved before the connect is timed,
+        so a slow resolver does not drop reachable hosts. For hosts behind a bastion only the
+        SSH port of the bastion is probed, not the host itself, so they are only marked
+        unreachable when the bastion is. Hosts are only marked
+        on a timeout, a refused or unroutable connection, an unknown host name or a server that
+        sends no SSH banner, so that the sweep never drops a host the SSH handshake could reach.
+
+        Args:
+            timeout: The timeout of the connect to each address of a host and of the banner
+                in seconds.
+            concurrency: The maximum number of probes in flight. It is capped to half of the
+                file descriptor limit of the process.
+            banner: Whether to wait for the SSH banner, or only for the TCP connect.
+        """
+        try:
+            import resource
+            limit, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+            if limit != resource.RLIM_INFINITY:
+                concurrency = min(concurrency, max(1, limit // 2))
+        except ImportError:
+            pass
+
+        self.timeout = timeout
+        self.concurrency = max(1, concurrency)
+        self.banner = banner
+        self.targets = 0
+        self.unreachable = 0
+        self.seconds = 0.0
+
+    async def __read_banner(self, reader: asyncio.StreamReader) -> None:
+        """Read lines until the SSH version line."""
+        for _ in range(MAX_BANNER_LINES):
+            line = await reader.readline()
+            if not line:
+                raise PreflightException('closed the connection before the SSH banner')
+            if line.startswith(b'SSH-'):
+                return
+        raise PreflightException('sent no SSH banner')
+
+    async def __connect(self, addresses: list[tuple]) -> tuple:
+        """
+        Connect to the first of the resolved addresses that accepts, as socket.create_connection does.
+
+        Each address gets the whole timeout, so that a blackholed address, e.g. an unrouted IPv6
+        address, doesn't use up the time of the next one.
+
+        Raises:
+            asyncio.TimeoutError: If the last address timed out.
+            OSError: The connect error of the last address.
+        """
+        loop = asyncio.get_running_loop()
+        error = None
+        for family, socket_type, proto, _, address in addresses:
+            sock = socket.socket(family, socket_type, proto)
+            sock.setblocking(False)
+            try:
+                await asyncio.wait_for(loop.sock_connect(sock, address), self.timeout)
+            except (OSError, asyncio.TimeoutError) as e:
+                sock.close()
+                error = e
+                continue
+            except BaseException:
+                sock.close()
+                raise
+            return await asyncio.open_connection(sock=sock)
+        raise error
+
+    async def __probe(self, host: str, port: int) -> PreflightException:
+        """
+        Probe one SSH port.
+
+        Returns:
+            PreflightException: Why the port is unreachable, or None.
+        """
+        # Resolved outside the timeout: the resolver runs in the few threads of the default
+        # executor, so the names of a large sweep wait for each other.
+        try:
+            addresses = await asyncio.get_running_loop().getaddrinfo(
+                host, port, type=socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            if e.errno == socket.EAI_AGAIN:
+                return None
+            return PreflightException(f'Cannot resolve {host}: {e.strerror}')
+
+        try:
+            reader, writer = await self.__connect(addresses)
+        except asyncio.TimeoutError:
+            return PreflightException(f'Connect to {host}:{port} timed out after {self.timeout}s')
+        except OSError as e:
+            if e.errno in UNREACHABLE_ERRNOS:
+                return PreflightException(
+                    f'Cannot connect to {host}:{port}: {os.strerror(e.errno)}')
+            return None
+
+        try:
+            if self.banner:
+                await asyncio.wait_for(self.__read_banner(reader), self.timeout)
+            return None
+        except asyncio.TimeoutError:
+            return PreflightException(
+                f'{host}:{port} sent no SSH banner within {self.timeout}s')
+        except PreflightException as e:
+            return PreflightException(f'{host}:{port} {e}')
+        except OSError as e:
+            return PreflightException(f'{host}:{port} failed before the SSH banner: {e}')
+        finally:
+            writer.close()
+
+    async def __probe_all(self, targets: list[tuple[str, int]]) -> list[PreflightException]:
+        """Probe the targets with at most concurrency probes in flight."""
+        results = [None] * len(targets)
+        pending = iter(range(len(targets)))
+
+        async def probe_next() -> None:
+            # The iterator is shared by all probers, each takes the next target when it is free.
+            for index in pending:
+                results[index] = await self.__probe(*targets[index])
+
+        await asyncio.gather(*(
+            probe_next() for _ in range(min(self.concurrency, len(targets)))
+        ))
+        return results
+
+    def sweep(self, inventory: list[dict]) -> dict[str, PreflightException]:
+        """
+        Probe the hosts of an inventory.
+
+        Args:
+            inventory: The host entries, see load_inventory.
+
+        Returns:
+            dict[str, PreflightException]: Why each unreachable host is unreachable, by host.
+        """
+        started = time.monotonic()
+        # The hosts behind each (host, port) to probe, with the bastion they are reached through.
+        targets = {}
+        for entry in inventory:
+            if entry.get('bastion'):
+                spec = bastion_spec(entry['bastion'])
+                target = (spec['host'], spec['port'])
+                via = bastion_name(spec)
+            else:
+                target = (entry['host'], entry.get('port') or 22)
+                via = None
+            targets.setdefault(target, []).append((entry['host'], via))
+
+        probed = list(targets)
+        unreachable = {}
+        if probed:
+            for target, error in zip(probed, asyncio.run(self.__probe_all(probed))):
+                if error is None:
+                    continue
+                for host, via in targets[target]:
+                    if via is None:
+                        unreachable[host] = PreflightException(str(error))
+                    else:
+                        unreachable[host] = PreflightException(f'Bastion {via}: {error}')
+
+        self.targets += len(probed)
+        self.unreachable += len(unreachable)
+        self.seconds += time.monotonic() - started
+        return unreachable
+
+    def report(self) -> dict:
+        """Return the number of probed targets and unreachable hosts, and the seconds spent."""
+        return {
+            'targets': self.targets,
+            'unreachable_hosts': self.unreachable,
+            'seconds': round(self.seconds, 3),
+        }
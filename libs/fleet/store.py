@@ -0,0 +1,115 @@
+import json
+import sqlite3
+from typing import Iterator
+
+SQLITE_TIMEOUT = 60
+STORE_COMMIT_INTERVAL = 200
+
+def dump_result(result) -> str:
+    """
+    Return the JSON text a result is stored as.
+
+    Keys are sorted, so equal results are stored as equal text and can be compared
+    without parsing them, see DriftMonitor.check.
+    """
+    return json.dumps(result, sort_keys=True)
+
+class ResultStore():
+    def __init__(self, path: str, timeout: int = SQLITE_TIMEOUT):
+        """
+        Initializes a SQLite store of gatherer results.
+
+        Results are kept per (host, gatherer); adding a result again replaces the previous one.
+        The store can be shared by several processes, and on shared storage by several machines.
+
+        Args:
+            path: The path of the SQLite database.
+            timeout: The seconds to wait for a lock held by another process.
+        """
+        self.path = path
+        # The store is used by one thread at a time, e.g. the render stage of a FleetPipeline.
+        self.connection = sqlite3.connect(
+            path, timeout=timeout, check_same_thread=False)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS results ('
+            'host TEXT NOT NULL, gatherer TEXT NOT NULL, '
+            'result TEXT, error TEXT, '
+            'PRIMARY KEY (host, gatherer))'
+        )
+        self.connection.commit()
+        self.pending = 0
+
+    def add(self, host: str, gatherer: str, result=None, error: str = None) -> None:
+        """
+        Add the result of a gatherer for a host.
+
+        Args:
+            host: The host the result was gathered from.
+            gatherer: The gatherer name.
+            result: The gatherer result, which must be JSON serializable.
+            error: The error message if the gatherer failed.
+        """
+        self.connection.execute(
+            'INSERT OR REPLACE INTO results (host, gatherer, result, error) '
+            'VALUES (?, ?, ?, ?)',
+            (host, gatherer, dump_result(result), error)
+        )
+        self.pending += 1
+        if self.pending >= STORE_COMMIT_INTERVAL:
+            self.commit()
+
+    def commit(self) -> None:
+        """Commit the results added so far."""
+        self.connection.commit()
+        self.pending = 0
+
+    def get(self, host: str, gatherer: str) -> tuple:
+        """
+        Return the stored result of a gatherer for a host.
+
+        Returns:
+            tuple: (result JSON text, error), or None if nothing is stored.
+        """
+        return self.connection.execute(
+            'SELECT result, error FROM results WHERE host = ? AND gatherer = ?',
+            (host, gatherer)
+        ).fetchone()
+
+    def results(self, hosts: list[str] = None) -> Iterator[tuple]:
+        """
+        Iterate over the stored results.
+
+        Args:
+            hosts: The hosts to return results for, or None for all hosts.
+
+        Yields:
+            tuple: (host, gatherer, result, error), ordered by host and gatherer.
+        """
+        if hosts is None:
+            cursor = self.connection.execute(
+                'SELECT host, gatherer, result, error FROM results ORDER BY host, gatherer'
+            )
+            for host, gatherer, result, error in cursor:
+                yield host, gatherer, json.loads(result), error
+            return
+
+        # One lookup of the primary key per host instead of a scan of all results.
+        for host in sorted(set(hosts)):
+            cursor = self.connection.execute(
+                'SELECT gatherer, result, error FROM results WHERE host = ? ORDER BY gatherer',
+                (host,)
+            )
+            for gatherer, result, error in cursor:
+                yield host, gatherer, json.loads(result), error
+
+    def hosts(self) -> list[str]:
+        """Return the hosts with stored results, in order."""
+        return [
+            row[0] for row in self.connection.execute(
+                'SELECT DISTINCT host FROM results ORDER BY host')
+        ]
+
+    def close(self) -> None:
+        """Commit and close the store."""
+        self.commit()
+        self.connection.close()
@@ -1,16 +1,19 @@
-import re
+from .tokenizer import strip_comments
+
+# The line breaks of str.splitlines() other than \n, as awk escapes. 0302 and 0342 are the
+# first bytes of U+0085, U+2028 and U+2029 (and of other characters) in UTF-8.
+REMOTE_LINE_BREAKS = r'\r\v\f\034\035\036\302\342'
+
+# An awk command that removes from a file, on the target system, the lines remove_comment drops
+# and the text of trailing comments, keeping the '#' so that remove_comment still strips the
+# whitespace before it. A line is only changed if the removed part holds none of the line breaks
+# of str.splitlines(), so remove_comment returns exactly the same for the filtered file.
+# The file path is appended as the last argument. Only valid for UTF-8 (or ASCII) files.
+REMOTE_COMMENT_FILTER = (
+    "LC_ALL=C awk '"
+    f"/^[ \\t]*(#[^{REMOTE_LINE_BREAKS}]*)?$/ {{ next }} "
+    f"{{ sub(/#[^{REMOTE_LINE_BREAKS}]*$/, \"#\"); print }}'"
+)
 
 def remove_comment(text: str, comment: str = '#'):
-    result = []
-    for l in text.splitlines():
-        stripped_l = l.strip()
-        if not stripped_l or stripped_l.startswith(comment):
-            continue
-        
-        comment_index = l.find(comment)
-        if not comment_index == -1:
-            l = l[:comment_index].rstrip()
-        
-        result.append(l)
-    
-    return result
+    return strip_comments(text, comment)
@@ -1,7 +1,30 @@
-from libs.utils import CommandRunner
-from libs.defines import NMCLI_TARGET_PROPS
-from .gatherer_utils import remove_comment
+from __future__ import annotations
+from typing import TYPE_CHECKING
+from libs.defines import \
+    NMCLI_TARGET_PROPS, \
+    LSBLK_COLUMNS, \
+    SELINUX_CONF_FILE, \
+    GROUP_FILE, \
+    PASSWD_FILE, \
+    REDHAT_RELEASE_FILE, \
+    FSTAB_FILE
+from .gatherer_utils import remove_comment, REMOTE_COMMENT_FILTER
+from .tokenizer import parse_assignments
 import re
+import json
+
+# Only for annotations: importing CommandRunner loads paramiko, which the parse
+# processes and report-only commands don't need.
+if TYPE_CHECKING:
+    from libs.utils import CommandRunner
+
+LSBLK_FORMAT_JSON = 'json'
+LSBLK_FORMAT_PAIRS = 'pairs'
+LSBLK_FORMAT_TREE = 'tree'
+LSBLK_PAIR_PATTERN = re.compile(r'(\w+)="([^"]*)"')
+NMCLI_CONNECTION_PATTERN = re.compile(r'.+:(.+ethernet|vlan|bond|bridge):')
+GROUP_LINE_PATTERN = re.compile(r'.+:.+:.+:')
+PASSWD_LINE_PATTERN = re.compile(r'.+:.+:.+:.+:.+:.+')
 
 def selinux(runner: CommandRunner) -> dict[str, str]:
     """
@@ -15,16 +38,8 @@ def selinux(runner: CommandRunner) -> dict[str, str]:
             - SELINUX: The value of SELINUX in /etc/selinux/config.
             - SELINUXTYPE: The value of SELINUXTYPE in /etc/selinux/config.
     """
-    selinux_settings = {}
-    config_text = runner.exec('cat /etc/selinux/config')
-
-    for line in config_text.splitlines():
-        if line.startswith('SELINUX='):
-            selinux_settings['SELINUX'] = line.split('=')[1].strip()
-        elif line.startswith('SELINUXTYPE='):
-            selinux_settings['SELINUXTYPE'] = line.split('=')[1].strip()
-
-    return selinux_settings
+    config_text = runner.read_file(SELINUX_CONF_FILE)
+    return parse_assignments(config_text.splitlines(), {'SELINUX', 'SELINUXTYPE'})
 
 def __parse_nmcli_line(line: str) -> tuple[str, str]:
     """Parses a line of nmcli output and returns a tuple of (property, value) or None if the line is not a valid property."""
@@ -45,9 +60,11 @@ def nmcli(runner: CommandRunner) -> dict[str, dict]:
     """
     connections = {}
     nmcli_output = runner.exec('nmcli -t --colors no con show')
+    if runner.last_exit_status:
+        return connections
 
     for line in nmcli_output.splitlines():
-        if re.match(r'.+:(.+ethernet|vlan|bond|bridge):', line):
+        if NMCLI_CONNECTION_PATTERN.match(line):
             connection_name = line.split(':')[0]
             connections[connection_name] = {}
 
@@ -61,24 +78,94 @@ def nmcli(runner: CommandRunner) -> dict[str, dict]:
 
 def __remove_lsblk_prefix(line: str) -> str:
     """Removes the prefix from a line of 'lsblk' output if it matches a specific pattern."""
-    if re.match(r'[`|]-', line):
+    if line[:2] in ('`-', '|-'):
         return line[2:]
     else:
         return line
 
-def localdisk(runner: CommandRunner) -> dict[str, dict]:
+def collect_localdisk(runner: CommandRunner) -> dict[str, str]:
     """
-    Gather information about local disks from lsblk.
+    Collect the raw lsblk output for parse_localdisk.
+
+    The most structured output format lsblk supports on the host is detected once per host:
+    JSON (util-linux 2.27 or later), key="value" pairs with parent names, or the tree of older versions.
 
     Args:
         runner: A CommandRunner instance.
 
     Returns:
-        A dictionary where each key is a disk name and each value is a dictionary containing the disk's name, size, and a list of its partitions. Each partition is a dictionary with the partition's name, uuid, size, type, and mountpoint. If the partition is an LVM, it also contains a list of its volumes, each of which is a dictionary with the volume's name, uuid, size, type, and mountpoint.
+        A dictionary with the keys 'format' ('json', 'pairs' or 'tree') and 'output'.
     """
+    if runner.probe('lsblk_json', 'lsblk -J -o NAME'):
+        return {
+            'format': LSBLK_FORMAT_JSON,
+            'output': runner.exec(f'lsblk -J -b -o {LSBLK_COLUMNS}', compressible=True),
+        }
+    if runner.probe('lsblk_pairs', 'lsblk -P -o PKNAME'):
+        return {
+            'format': LSBLK_FORMAT_PAIRS,
+            'output': runner.exec(f'lsblk -P -b -o {LSBLK_COLUMNS}', compressible=True),
+        }
+    return {
+        'format': LSBLK_FORMAT_TREE,
+        'output': runner.exec('lsblk -o NAME,UUID,SIZE,TYPE,MOUNTPOINT'),
+    }
+
+def __lsblk_size(device: dict) -> str:
+    """Return the size of an lsblk device as a string, whether lsblk printed a number or a string."""
+    size = device.get('size')
+    return '' if size is None else str(size)
+
+def __lsblk_volume(device: dict) -> dict:
+    """Convert an lsblk device and its children into the volume format of localdisk."""
+    volume = {
+        'name': device['name'],
+        'uuid': device.get('uuid') or '',
+        'size': __lsblk_size(device),
+        'type': device.get('type'),
+        'volumes': [__lsblk_volume(child) for child in device.get('children', [])],
+    }
+    if device.get('mountpoint'):
+        volume['mountpoint'] = device['mountpoint']
+    return volume
+
+def __lsblk_disks(devices: list[dict]) -> dict[str, dict]:
+    """Convert a tree of lsblk devices into the result of localdisk."""
     disks = {}
-    lsblk_output = runner.exec('lsblk -o NAME,UUID,SIZE,TYPE,MOUNTPOINT')
+    for device in devices:
+        if device.get('type') != 'disk':
+            continue
+        disks[device['name']] = {
+            'name': device['name'],
+            'size': __lsblk_size(device),
+            'partition': [__lsblk_volume(child) for child in device.get('children', [])],
+        }
+    return disks
 
+def __parse_lsblk_pairs(lsblk_output: str) -> list[dict]:
+    """Build the device tree from 'lsblk -P' output, using the PKNAME column to find parents."""
+    devices = []
+    last_seen = {}
+    for line in lsblk_output.splitlines():
+        device = {
+            key.lower(): value for key, value in LSBLK_PAIR_PATTERN.findall(line)
+        }
+        if 'name' not in device:
+            continue
+        device['children'] = []
+        # lsblk lists a device right after its parent, and once per parent
+        # if it has several (md, multipath), so the last one seen is the parent.
+        parent = last_seen.get(device.pop('pkname', ''))
+        if parent is not None:
+            parent['children'].append(device)
+        else:
+            devices.append(device)
+        last_seen[device['name']] = device
+    return devices
+
+def __parse_lsblk_tree(lsblk_output: str) -> dict[str, dict]:
+    """Parse the tree output of lsblk versions without -J or -P."""
+    disks = {}
     current_disk = None
     current_part = None
     for line in lsblk_output.splitlines():
@@ -129,6 +216,34 @@ def localdisk(runner: CommandRunner) -> dict[str, dict]:
 
     return disks
 
+def parse_localdisk(raw: dict[str, str]) -> dict[str, dict]:
+    """
+    Parse the lsblk output collected by collect_localdisk.
+
+    Args:
+        raw: The result of collect_localdisk.
+
+    Returns:
+        See localdisk.
+    """
+    if raw['format'] == LSBLK_FORMAT_JSON:
+        return __lsblk_disks(json.loads(raw['output']).get('blockdevices', []))
+    if raw['format'] == LSBLK_FORMAT_PAIRS:
+        return __lsblk_disks(__parse_lsblk_pairs(raw['output']))
+    return __parse_lsblk_tree(raw['output'])
+
+def localdisk(runner: CommandRunner) -> dict[str, dict]:
+    """
+    Gather information about local disks from lsblk.
+
+    Args:
+        runner: A CommandRunner instance.
+
+    Returns:
+        A dictionary where each key is a disk name and each value is a dictionary containing the disk's name, size, and a list of its partitions. Each partition is a dictionary with the partition's name, uuid, size, type, mountpoint, and a list of the volumes on it (LVM, crypt, md, multipath), each of which has the same keys, down to any depth. Sizes are in bytes unless the host's lsblk only supports the tree output.
+    """
+    return parse_localdisk(collect_localdisk(runner))
+
 def default_target(runner: CommandRunner) -> str:
     """
     Get the default target of the given host.
@@ -153,12 +268,17 @@ def timezone(runner: CommandRunner) -> str:
         runner: A CommandRunner instance.
 
     Returns:
-        The name of the timezone, or None if it cannot be determined.
+        The name of the timezone, e.g. 'Asia/Tokyo', or None if it cannot be determined.
     """
+    if runner.probe('timedatectl_show', 'timedatectl show -p Timezone'):
+        output = runner.exec('timedatectl show -p Timezone --value')
+        return output.strip() or None
+
     output = runner.exec('timedatectl')
     for line in output.splitlines():
         if 'Time zone:' in line:
-            return ' '.join(line.split()[2:])
+            fields = line.split()
+            return fields[2] if len(fields) > 2 else None
     return None
 
 def locale(runner: CommandRunner) -> str:
@@ -169,13 +289,26 @@ def locale(runner: CommandRunner) -> str:
         runner: A CommandRunner instance.
 
     Returns:
-        The name of the locale, or None if it cannot be determined.
+        The system locale settings separated by spaces, e.g. 'LANG=en_US.UTF-8 LC_TIME=C',
+        or None if they cannot be determined.
     """
-    output = runner.exec('localectl')
+    output = runner.exec('localectl status')
+    settings = []
+    in_system_locale = False
     for line in output.splitlines():
-        if 'System Locale:' in line:
-            return ' '.join(line.split()[2:])
-    return None
+        # System Locale is a list of KEY=value settings, one per line,
+        # and the next label ends it. Values may contain ':' too, e.g. LANGUAGE=en_US:en.
+        label, _, value = line.partition(':')
+        if _ and label.strip() and '=' not in label:
+            in_system_locale = label.strip() == 'System Locale'
+        elif not in_system_locale:
+            continue
+        else:
+            value = line
+        if in_system_locale and '=' in value:
+            settings.append(value.strip())
+
+    return ' '.join(settings) if settings else None
 
 def group(runner: CommandRunner) -> list[dict]:
     """
@@ -188,10 +321,9 @@ def group(runner: CommandRunner) -> list[dict]:
         A list of dictionaries, where each dictionary contains the keys 'name'
         and 'gid', which are the group name and GID, respectively.
     """
-    group_config = runner.exec('cat /etc/group')
     groups = []
-    for line in group_config.splitlines():
-        if re.match('.+:.+:.+:', line):
+    for line in runner.read_lines(GROUP_FILE, compressible=True):
+        if GROUP_LINE_PATTERN.match(line):
             group_info = line.split(':')
             groups.append({
                 'name': group_info[0],
@@ -224,7 +356,7 @@ def __get_user_subgroup(
 
 def __get_group_by_gid(runner: CommandRunner, group_id: str) -> dict[str, str]:
     """Get the group information from the given group ID."""
-    group_info_output = runner.exec(f'getent group {group_id}')
+    group_info_output = runner.exec(f'getent group {group_id}', cached=True)
     group_info = {}
     for line in group_info_output.splitlines():
         if f':{group_id}' in line:
@@ -249,21 +381,23 @@ def user(runner: CommandRunner) -> list[dict]:
         'uid', 'group', 'description', 'home_directory', 'shell', and 'groups'.
         The 'groups' key is a list of subgroups of the user, if any.
     """
-    passwd_output = runner.exec('cat /etc/passwd')
+    entries = []
+    for entry in runner.read_lines(PASSWD_FILE, compressible=True):
+        if PASSWD_LINE_PATTERN.match(entry):
+            entries.append(entry.split(':'))
+
     users = []
-    for entry in passwd_output.splitlines():
-        if re.match(r'.+:.+:.+:.+:.+:.+', entry):
-            fields = entry.split(':')
-            user_groups = __get_user_subgroup(runner, fields[0], fields[3])
-            users.append({
-                'name': fields[0],
-                'uid': fields[2],
-                'group': __get_group_by_gid(runner, fields[3]),
-                'description': fields[4],
-                'home_directory': fields[5],
-                'shell': fields[6],
-                'groups': user_groups,
-            })
+    for fields in entries:
+        user_groups = __get_user_subgroup(runner, fields[0], fields[3])
+        users.append({
+            'name': fields[0],
+            'uid': fields[2],
+            'group': __get_group_by_gid(runner, fields[3]),
+            'description': fields[4],
+            'home_directory': fields[5],
+            'shell': fields[6],
+            'groups': user_groups,
+        })
 
     return users
 
@@ -280,18 +414,17 @@ def systemd_units(runner: CommandRunner) -> list[dict]:
             - 'state': The state of the systemd unit.
     """
 
-    unit_status = runner.exec('systemctl list-unit-files')
     units = []
-    for line in unit_status.splitlines():
-        if not line.startswith('UNIT FILE'):
-            fields = line.split()
-            if len(fields) < 2:
-                continue
-            unit_name, unit_state = fields[0], fields[1]
-            units.append({
-                'name': unit_name,
-                'state': unit_state,
-            })
+    command = 'systemctl list-unit-files --no-legend --no-pager'
+    for line in runner.exec_stream(command, compressible=True):
+        fields = line.split()
+        if len(fields) < 2:
+            continue
+        unit_name, unit_state = fields[0], fields[1]
+        units.append({
+            'name': unit_name,
+            'state': unit_state,
+        })
 
     return units
 
@@ -306,9 +439,8 @@ def rpm_packages(runner: CommandRunner) -> list[str]:
         A list of strings, where each string is the name of an installed RPM package.
     """
 
-    package_list = runner.exec('rpm -qa')
     packages = []
-    for line in package_list.splitlines():
+    for line in runner.exec_stream('rpm -qa', compressible=True):
         packages.append(line.strip())
 
     return packages
@@ -324,7 +456,7 @@ def rhel_version(runner: CommandRunner) -> str:
         A string representing the version of RHEL installed on the host.
     """
     
-    redhat_release = runner.exec('cat /etc/redhat-release')
+    redhat_release = runner.read_file(REDHAT_RELEASE_FILE)
     version = None
     for line in redhat_release.splitlines():
         version = line.strip()
@@ -394,7 +526,7 @@ def fstab(runner: CommandRunner) -> list[dict]:
             - 'dump': Whether the filesystem should be dumped.
             - 'fsck': The fsck pass for the filesystem.
     """
-    fstab_config = runner.exec('cat /etc/fstab')
+    fstab_config = runner.read_file(FSTAB_FILE, remote_filter=REMOTE_COMMENT_FILTER)
     fstab_entries = []
 
     for line in remove_comment(fstab_config):
@@ -1,4 +1,5 @@
-from libs.utils import CommandRunner
+from __future__ import annotations
+from typing import TYPE_CHECKING
 from libs.defines import \
     RSYSLOG_CONF_FILE, RSYSLOG_CONF_D, \
     SSHD_CONF_FILE, SSHD_CONF_D, \
@@ -7,86 +8,137 @@ from libs.defines import \
     CHRONY_CONF_FILE, \
     DNF_CONF_FILE, \
     DNF_REPO_D, DNF_REPO_EXCLUSION, \
-    SUDOERS_CONF, SUDOERS_CONF_D
+    SUDOERS_CONF, SUDOERS_CONF_D, \
+    SYSCONFIG_GRUB_FILE
 from .gatherer_utils import \
-    remove_comment
+    remove_comment, \
+    REMOTE_COMMENT_FILTER, \
+    REMOTE_LINE_BREAKS
+from .tokenizer import \
+    parse_key_values, \
+    parse_ini, \
+    parse_assignments, \
+    strip_sudoers_comments, \
+    split_brace_block
 import re
-import configparser
 
-def rsyslog(runner: CommandRunner) -> dict[str, list]:
+# Only for annotations, see linux_general.
+if TYPE_CHECKING:
+    from libs.utils import CommandRunner
+
+CONF_FILE_PATTERN = re.compile(r'.+\.conf$')
+FIREWALLD_ZONE_PATTERN = re.compile(r'\S+')
+FIREWALLD_INTERFACES_PATTERN = re.compile(r'\s+interfaces:')
+GRUB_KEY_PATTERN = re.compile(r'[A-Z]+')
+
+# An awk command that removes the lines strip_sudoers_comments drops on the target system,
+# see REMOTE_COMMENT_FILTER. '#include' and '#includedir' lines are kept.
+REMOTE_SUDOERS_FILTER = (
+    "LC_ALL=C awk '"
+    f"!/^[ \\t]*(#+([ \\t][^{REMOTE_LINE_BREAKS}]*)?)?$/'"
+)
+
+def collect_rsyslog(runner: CommandRunner) -> dict[str, str]:
     result = {}
     target_file_list = [RSYSLOG_CONF_FILE]
     rsyslog_conf_d = runner.exec(f'find {RSYSLOG_CONF_D}')
     for line in rsyslog_conf_d.splitlines():
-        if line.startswith('/etc') and re.match(r'.+\.conf$', line):
+        if line.startswith('/etc') and CONF_FILE_PATTERN.match(line):
             target_file_list.append(line.strip())
 
+    runner.prefetch_files([
+        (conf_path, REMOTE_COMMENT_FILTER) for conf_path in target_file_list
+    ])
     for conf_file_path in target_file_list:
-        conf_text = runner.exec(f'cat {conf_file_path}')
-        result[conf_file_path] = remove_comment(conf_text)
+        result[conf_file_path] = runner.read_file(
+            conf_file_path, compressible=True, remote_filter=REMOTE_COMMENT_FILTER)
 
     return result
 
-def __parse_sshd_config(text: str) -> list:
-    result = []
-    fixed_text_lines = remove_comment(text)
-    for line in fixed_text_lines:
-        spl = line.split()
-        result.append({
-            'key': spl[0],
-            'value': ' '.join(spl[1:])
-        })
+def parse_rsyslog(raw: dict[str, str]) -> dict[str, list]:
+    return {
+        conf_file_path: remove_comment(conf_text)
+            for conf_file_path, conf_text in raw.items()
+    }
 
-    return result
+def rsyslog(runner: CommandRunner) -> dict[str, list]:
+    return parse_rsyslog(collect_rsyslog(runner))
 
-def sshd(runner: CommandRunner) -> dict[str, list]:
+def collect_sshd(runner: CommandRunner) -> dict[str, str]:
     result = {}
     target_file_list = [SSHD_CONF_FILE]
     sshd_conf_d = runner.exec(f'find {SSHD_CONF_D}')
     for line in sshd_conf_d.splitlines():
-        if line.startswith('/etc') and re.match(r'.+\.conf$', line):
+        if line.startswith('/etc') and CONF_FILE_PATTERN.match(line):
             target_file_list.append(line.strip())
 
+    runner.prefetch_files([
+        (conf_path, REMOTE_COMMENT_FILTER) for conf_path in target_file_list
+    ])
     for conf_file_path in target_file_list:
-        conf_text = runner.exec(f'cat {conf_file_path}')
-        result[conf_file_path] = __parse_sshd_config(conf_text)
+        result[conf_file_path] = runner.read_file(
+            conf_file_path, compressible=True, remote_filter=REMOTE_COMMENT_FILTER)
 
     return result
 
+def parse_sshd(raw: dict[str, str]) -> dict[str, list]:
+    return {
+        conf_file_path: parse_key_values(conf_text)
+            for conf_file_path, conf_text in raw.items()
+    }
+
+def sshd(runner: CommandRunner) -> dict[str, list]:
+    return parse_sshd(collect_sshd(runner))
+
 
 def __parse_logrotate_config(text: str):
     lines = remove_comment(text)
     files = []
     for line in lines:
-        if re.match(r'^/\S+', line):
+        if len(line) > 1 and line[0] == '/' and not line[1].isspace():
             files.append(line.replace('{', '').strip())
-    config_block = re.findall(r'\{((.|\s)*)\}','\n'.join(lines))
-    fixed_config = remove_comment(
-        ' '.join(config_block[0]).replace('\t', '    '))
-    
+    block = split_brace_block('\n'.join(lines))
+    if block is None:
+        raise ValueError('No { } block in logrotate config')
+    fixed_config = remove_comment(block[1].replace('\t', '    '))
+
     return {
         'target': files,
         'config': fixed_config
     }
 
 
-def logrotated(runner: CommandRunner) -> dict[str, dict]:
+def collect_logrotated(runner: CommandRunner) -> dict[str, str]:
     result = {}
     target_file_list = runner.exec(f'find {LOGROTATE_CONF_D} | egrep -v "{LOGROTATE_CONF_D}$"')
 
-    conf_text = runner.exec(f'cat {LOGROTATE_CONF_FILE}')
-    result[LOGROTATE_CONF_FILE] = {
-        'target': ['default'],
-        'config': remove_comment(conf_text)
-    }
-    
-    for conf_file_path in target_file_list.splitlines():
-        conf_text = runner.exec(f'cat {conf_file_path}')
-        result[conf_file_path] = __parse_logrotate_config(conf_text)
+    target_file_list = [LOGROTATE_CONF_FILE] + target_file_list.splitlines()
+    runner.prefetch_files([
+        (conf_path, REMOTE_COMMENT_FILTER) for conf_path in target_file_list
+    ])
+    for conf_file_path in target_file_list:
+        result[conf_file_path] = runner.read_file(
+            conf_file_path, compressible=True, remote_filter=REMOTE_COMMENT_FILTER)
+
+    return result
+
+def parse_logrotated(raw: dict[str, str]) -> dict[str, dict]:
+    result = {}
+    for conf_file_path, conf_text in raw.items():
+        if conf_file_path == LOGROTATE_CONF_FILE:
+            result[conf_file_path] = {
+                'target': ['default'],
+                'config': remove_comment(conf_text)
+            }
+        else:
+            result[conf_file_path] = __parse_logrotate_config(conf_text)
 
     return result
 
-def cron(runner: CommandRunner) -> dict[str, str]:
+def logrotated(runner: CommandRunner) -> dict[str, dict]:
+    return parse_logrotated(collect_logrotated(runner))
+
+def collect_cron(runner: CommandRunner) -> dict[str, str]:
     result = {}
     cron_conf_d = runner.exec(
         f'find {CRON_CONF_D} | egrep -v "{CRON_CONF_D}$"')
@@ -97,69 +149,67 @@ def cron(runner: CommandRunner) -> dict[str, str]:
     target_file_list.extend(remove_comment(cron_conf_d))
     target_file_list.extend(remove_comment(user_cron_conf_d))
 
+    runner.prefetch_files([
+        (conf_path, REMOTE_COMMENT_FILTER) for conf_path in target_file_list
+    ])
     for conf_path in target_file_list:
-        conf_text = runner.exec(f'cat {conf_path}')
-        result[conf_path] = remove_comment(conf_text)
+        result[conf_path] = runner.read_file(
+            conf_path, compressible=True, remote_filter=REMOTE_COMMENT_FILTER)
 
     return result
+
+def parse_cron(raw: dict[str, str]) -> dict[str, list]:
+    return {
+        conf_path: remove_comment(conf_text)
+            for conf_path, conf_text in raw.items()
+    }
+
+def cron(runner: CommandRunner) -> dict[str, list]:
+    return parse_cron(collect_cron(runner))
     
-def __parse_chrony_config(text: str) -> list:
-    result = []
-    fixed_text_lines = remove_comment(text)
-    for line in fixed_text_lines:
-        spl = line.split()
-        result.append({
-            'key': spl[0],
-            'value': ' '.join(spl[1:])
-        })
+def collect_chrony(runner: CommandRunner) -> str:
+    return runner.read_file(CHRONY_CONF_FILE, remote_filter=REMOTE_COMMENT_FILTER)
 
-    return result
+def parse_chrony(raw: str) -> list[dict]:
+    return parse_key_values(raw)
 
 def chrony(runner: CommandRunner) -> list[dict]:
-    conf_text = runner.exec(f'cat {CHRONY_CONF_FILE}')
-    return __parse_chrony_config(conf_text)
+    return parse_chrony(collect_chrony(runner))
 
-def dnf(runner: CommandRunner) -> dict[dict]:
-    conf_text = runner.exec(f'cat {DNF_CONF_FILE}')
-    parser = configparser.ConfigParser()
-    parser.read_string(conf_text)
-    conf_dict = {
-        section: dict(parser.items(section)) 
-            for section in parser.sections()
-    }
+def collect_dnf(runner: CommandRunner) -> str:
+    return runner.read_file(DNF_CONF_FILE)
 
-    return conf_dict
+def parse_dnf(raw: str) -> dict[dict]:
+    return parse_ini(raw)
 
-def dnf_repo(runner: CommandRunner) -> dict[dict]:
-    result = {}
-    target_files = runner.exec(f'find {DNF_REPO_D} | egrep -v "{DNF_REPO_D}$"')
-    for conf_file_path in target_files.splitlines():
-        if conf_file_path.split('/')[-1] in DNF_REPO_EXCLUSION:
-            continue
+def dnf(runner: CommandRunner) -> dict[dict]:
+    return parse_dnf(collect_dnf(runner))
 
-        conf_text = runner.exec(f'cat {conf_file_path}')
-        parser = configparser.ConfigParser()
-        parser.read_string(conf_text)
-        conf_dict = {
-            section: dict(parser.items(section))
-                for section in parser.sections()
-        }
-        result[conf_file_path] = conf_dict
+def collect_dnf_repo(runner: CommandRunner) -> dict[str, str]:
+    result = {}
+    # The excluded files are also dropped on the target, so they are not listed at all.
+    exclusion = '|'.join(name.replace('.', '\\.') for name in DNF_REPO_EXCLUSION)
+    target_files = runner.exec(f'find {DNF_REPO_D} | egrep -v "{DNF_REPO_D}$|/({exclusion})$"')
+    target_file_list = [
+        conf_file_path for conf_file_path in target_files.splitlines()
+            if conf_file_path.split('/')[-1] not in DNF_REPO_EXCLUSION
+    ]
+    runner.prefetch_files(target_file_list)
+    for conf_file_path in target_file_list:
+        result[conf_file_path] = runner.read_file(conf_file_path, compressible=True)
 
     return result
 
-def __remove_comment_sudoers(text: str):
-    result = []
-    for l in text.splitlines():
-        stripped_l = l.strip()
-        if not stripped_l or re.match('^#+($|\s)', stripped_l):
-            continue
-
-        result.append(l.replace('\t', '    '))
+def parse_dnf_repo(raw: dict[str, str]) -> dict[dict]:
+    return {
+        conf_file_path: parse_ini(conf_text)
+            for conf_file_path, conf_text in raw.items()
+    }
 
-    return result
+def dnf_repo(runner: CommandRunner) -> dict[dict]:
+    return parse_dnf_repo(collect_dnf_repo(runner))
 
-def sudoers(runner: CommandRunner) -> dict[list]:
+def collect_sudoers(runner: CommandRunner) -> dict[str, str]:
     result = {}
     target_files = [SUDOERS_CONF]
     sudoers_d = runner.exec(
@@ -168,12 +218,24 @@ def sudoers(runner: CommandRunner) -> dict[list]:
     for line in sudoers_d.splitlines():
         target_files.append(line)
 
+    runner.prefetch_files([
+        (conf_path, REMOTE_SUDOERS_FILTER) for conf_path in target_files
+    ])
     for conf_path in target_files:
-        conf_text = runner.exec(f'cat {conf_path}')
-        result[conf_path] = __remove_comment_sudoers(conf_text)
+        result[conf_path] = runner.read_file(
+            conf_path, compressible=True, remote_filter=REMOTE_SUDOERS_FILTER)
 
     return result
 
+def parse_sudoers(raw: dict[str, str]) -> dict[list]:
+    return {
+        conf_path: strip_sudoers_comments(conf_text)
+            for conf_path, conf_text in raw.items()
+    }
+
+def sudoers(runner: CommandRunner) -> dict[list]:
+    return parse_sudoers(collect_sudoers(runner))
+
 def __firewalld_get_opts(
     runner: CommandRunner, zone: str
 ) -> (list, list):
@@ -190,18 +252,21 @@ def __firewalld_get_opts(
         f'firewall-cmd --zone={zone} --list-rich-rules'
     )
     for line in rich_rule_text.splitlines():
-        if re.match('^rule', line.strip()):
+        if line.strip().startswith('rule'):
             rich_rules.append(line.strip())
 
     return services, rich_rules
 
 def firewalld(runner: CommandRunner) -> dict[str, dict]:
     result = {}
-    active_zones_text = runner.exec('firewall-cmd --get-active-zones') 
+    active_zones_text = runner.exec('firewall-cmd --get-active-zones')
+    if runner.last_exit_status:
+        # firewalld is not running or not installed.
+        return result
 
     zone = None
     for line in active_zones_text.splitlines():
-        if re.match('^\S+', line):
+        if FIREWALLD_ZONE_PATTERN.match(line):
             zone = line.strip()
             services, rich_rules = __firewalld_get_opts(
                 runner, zone
@@ -214,7 +279,7 @@ def firewalld(runner: CommandRunner) -> dict[str, dict]:
         if not zone:
             continue
 
-        if re.match('^\s+interfaces:', line):
+        if FIREWALLD_INTERFACES_PATTERN.match(line):
             interfaces = line.strip().split()[1:]
             result[zone]['interfaces'] = interfaces
 
@@ -222,14 +287,18 @@ def firewalld(runner: CommandRunner) -> dict[str, dict]:
 
 
 def sysconfig_grub(runner: CommandRunner) -> dict[str, str]:
-    result = {}
-    sysconfig_grub_config = runner.exec('cat /etc/sysconfig/grub')
-    print(sysconfig_grub_config)
-
-    for line in sysconfig_grub_config.splitlines():
-        if re.match(r'^[A-Z]+', line):
-            sep = line.split('=')
-            result[sep[0]] = sep[1]
-
-    return result
+    """
+    Gather the GRUB settings from /etc/sysconfig/grub.
+
+    Args:
+        runner: A CommandRunner instance.
+
+    Returns:
+        A dictionary of the settings, e.g. {'GRUB_TIMEOUT': '5'}. Values are kept as written,
+        including quotes, and may contain '='.
+    """
+    config_text = runner.read_file(SYSCONFIG_GRUB_FILE)
+    return parse_assignments(
+        [line for line in config_text.splitlines() if GRUB_KEY_PATTERN.match(line)]
+    )
 
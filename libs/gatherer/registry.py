@@ -0,0 +1,78 @@
+from libs.defines import \
+    SELINUX_CONF_FILE, GROUP_FILE, PASSWD_FILE, \
+    REDHAT_RELEASE_FILE, FSTAB_FILE, \
+    RSYSLOG_CONF_FILE, SSHD_CONF_FILE, LOGROTATE_CONF_FILE, \
+    CHRONY_CONF_FILE, DNF_CONF_FILE, SUDOERS_CONF
+from . import linux_general
+from . import linux_optional
+from .gatherer_utils import REMOTE_COMMENT_FILTER
+
+# Gatherers by name, as (collect, parse) pairs.
+# collect takes a CommandRunner and returns what parse takes.
+# parse is a pure function that can run in another process, or None if
+# collect already returns the final result.
+GATHERERS = {
+    'selinux': (linux_general.selinux, None),
+    'nmcli': (linux_general.nmcli, None),
+    'localdisk': (linux_general.collect_localdisk, linux_general.parse_localdisk),
+    'default_target': (linux_general.default_target, None),
+    'timezone': (linux_general.timezone, None),
+    'locale': (linux_general.locale, None),
+    'group': (linux_general.group, None),
+    'user': (linux_general.user, None),
+    'systemd_units': (linux_general.systemd_units, None),
+    'rpm_packages': (linux_general.rpm_packages, None),
+    'rhel_version': (linux_general.rhel_version, None),
+    'cpu': (linux_general.cpu, None),
+    'mem': (linux_general.mem, None),
+    'fstab': (linux_general.fstab, None),
+    'rsyslog': (linux_optional.collect_rsyslog, linux_optional.parse_rsyslog),
+    'sshd': (linux_optional.collect_sshd, linux_optional.parse_sshd),
+    'logrotated': (linux_optional.collect_logrotated, linux_optional.parse_logrotated),
+    'cron': (linux_optional.collect_cron, linux_optional.parse_cron),
+    'chrony': (linux_optional.collect_chrony, linux_optional.parse_chrony),
+    'dnf': (linux_optional.collect_dnf, linux_optional.parse_dnf),
+    'dnf_repo': (linux_optional.collect_dnf_repo, linux_optional.parse_dnf_repo),
+    'sudoers': (linux_optional.collect_sudoers, linux_optional.parse_sudoers),
+    'firewalld': (linux_optional.firewalld, None),
+}
+
+# Files gatherers read with CommandRunner.read_file at known paths, with the remote_filter
+# they are read with, so that the files of all selected gatherers can be prefetched at once.
+PREFETCH_FILES = {
+    'selinux': [SELINUX_CONF_FILE],
+    'group': [GROUP_FILE],
+    'user': [PASSWD_FILE],
+    'rhel_version': [REDHAT_RELEASE_FILE],
+    'fstab': [(FSTAB_FILE, REMOTE_COMMENT_FILTER)],
+    'rsyslog': [(RSYSLOG_CONF_FILE, REMOTE_COMMENT_FILTER)],
+    'sshd': [(SSHD_CONF_FILE, REMOTE_COMMENT_FILTER)],
+    'logrotated': [(LOGROTATE_CONF_FILE, REMOTE_COMMENT_FILTER)],
+    'chrony': [(CHRONY_CONF_FILE, REMOTE_COMMENT_FILTER)],
+    'dnf': [DNF_CONF_FILE],
+    'sudoers': [(SUDOERS_CONF, linux_optional.REMOTE_SUDOERS_FILTER)],
+}
+
+def prefetch_paths(names: list[str]) -> list:
+    """Return the files read by the given gatherers at known paths, see PREFETCH_FILES."""
+    return [path for name in names for path in PREFETCH_FILES.get(name, [])]
+
+def gatherer_names(names: list[str] = None) -> list[str]:
+    """
+    Validate a list of gatherer names.
+
+    Args:
+        names: The gatherer names, or None for all gatherers.
+
+    Returns:
+        The gatherer names in registry order.
+
+    Raises:
+        KeyError: If an unknown gatherer name is given.
+    """
+    if not names:
+        return list(GATHERERS)
+    for name in names:
+        if name not in GATHERERS:
+            raise KeyError(f'Unknown gatherer: {name}')
+    return [name for name in GATHERERS if name in names]
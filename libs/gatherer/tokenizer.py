@@ -0,0 +1,129 @@
+import configparser
+
+# Tokenizers for the configuration file formats read by the gatherers. Each walks the lines
+# once with string methods only, so that no input can trigger regex backtracking.
+
+def strip_comments(text: str, comment: str = '#') -> list[str]:
+    """
+    Remove blank lines, comment lines and trailing comments.
+
+    Args:
+        text: The file text.
+        comment: The comment character.
+
+    Returns:
+        list[str]: The remaining lines. Lines with a trailing comment are right-stripped,
+            other lines are returned unchanged.
+    """
+    result = []
+    for line in text.splitlines():
+        # Most comment lines start in the first column.
+        if not line or line[0] == comment:
+            continue
+        index = line.find(comment)
+        if index == -1:
+            if not line.isspace():
+                result.append(line)
+        elif index and not line[:index].isspace():
+            # Text before the comment.
+            result.append(line[:index].rstrip())
+    return result
+
+def strip_sudoers_comments(text: str) -> list[str]:
+    """
+    Remove blank lines and comment lines from a sudoers file, keeping '#include' directives
+    and lines like '#1000 ALL=...' that start with '#' followed by something other than whitespace.
+
+    Args:
+        text: The file text.
+
+    Returns:
+        list[str]: The remaining lines, with tabs replaced by four spaces.
+    """
+    result = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            continue
+        if stripped[0] == '#':
+            rest = stripped.lstrip('#')
+            if not rest or rest[0].isspace():
+                continue
+        result.append(line.replace('\t', '    '))
+    return result
+
+def parse_key_values(text: str) -> list[dict]:
+    """
+    Parse a "key value" file such as sshd_config or chrony.conf.
+
+    Args:
+        text: The file text.
+
+    Returns:
+        list[dict]: One {'key': ..., 'value': ...} per directive, in file order, with the
+            whitespace between the words of the value collapsed to single spaces.
+    """
+    result = []
+    for line in strip_comments(text):
+        fields = line.split()
+        result.append({
+            'key': fields[0],
+            'value': ' '.join(fields[1:]),
+        })
+    return result
+
+def parse_assignments(lines: list[str], keys: set[str] = None) -> dict[str, str]:
+    """
+    Parse "KEY=value" lines such as /etc/selinux/config or /etc/sysconfig/grub.
+
+    Args:
+        lines: The lines, e.g. from text.splitlines() or strip_comments.
+        keys: The keys to keep, or None for all keys.
+
+    Returns:
+        dict[str, str]: The value after the first '=' per key, stripped. Later lines win.
+    """
+    result = {}
+    for line in lines:
+        key, separator, value = line.partition('=')
+        if not separator or (keys is not None and key not in keys):
+            continue
+        result[key] = value.strip()
+    return result
+
+def parse_ini(text: str) -> dict[str, dict]:
+    """
+    Parse an ini file such as dnf.conf or a yum repository file.
+
+    Args:
+        text: The file text.
+
+    Returns:
+        dict[str, dict]: The options per section.
+
+    Raises:
+        configparser.Error: If the text is not a valid ini file.
+    """
+    parser = configparser.ConfigParser()
+    parser.read_string(text)
+    return {
+        section: dict(parser.items(section))
+            for section in parser.sections()
+    }
+
+def split_brace_block(text: str) -> tuple[str, str]:
+    """
+    Split text at its outermost brace block, from the first '{' to the last '}'.
+
+    Args:
+        text: The text.
+
+    Returns:
+        tuple[str, str]: The text before the block and the text inside it,
+            or None if there is no '{' followed by a '}'.
+    """
+    start = text.find('{')
+    end = text.rfind('}')
+    if start == -1 or end < start:
+        return None
+    return text[:start], text[start + 1:end]
@@ -0,0 +1,6 @@
+from .daemon import CollectorService, serve
+
+__all__ = [
+    'CollectorService',
+    'serve'
+]
@@ -0,0 +1,367 @@
+import hmac
+import io
+import json
+import os
+import secrets
+import socketserver
+import stat
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from libs.fleet.inventory import connect
+from libs.gatherer.registry import GATHERERS, gatherer_names, prefetch_paths
+
+DEFAULT_KEEPALIVE_SECONDS = 30
+DEFAULT_REQUEST_WORKERS = 32
+LOCAL_HOST_NAMES = ('127.0.0.1', 'localhost')
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+class WarmSession():
+    def __init__(self, entry: dict, governor=None, credentials=None, bastions=None):
+        """
+        Initializes a pooled, elevated session to a registered host.
+
+        The session is opened on first use (or by warm()) and reopened if it has broken.
+        Only one request at a time runs on a session.
+
+        Args:
+            entry: The inventory entry of the host.
+            governor: A ConnectionGovernor for reconnects, or None.
+            credentials: A CredentialCache, or None.
+            bastions: A BastionPool for hosts behind a bastion, or None.
+        """
+        self.entry = entry
+        self.governor = governor
+        self.credentials = credentials
+        self.bastions = bastions
+        self.runner = None
+        self.lock = threading.Lock()
+        self.connected_at = None
+        self.last_used = None
+        self.last_error = None
+
+    def __open(self) -> None:
+        self.__discard()
+        self.runner = connect(self.entry, self.governor, self.credentials, self.bastions)
+        self.runner.set_keepalive(DEFAULT_KEEPALIVE_SECONDS)
+        self.connected_at = time.time()
+
+    def __discard(self) -> None:
+        """Close the runner, so that the next use of the session reopens it."""
+        if self.runner is not None:
+            self.runner.close()
+            self.runner = None
+
+    def __alive(self) -> bool:
+        return self.runner is not None and self.runner.is_alive()
+
+    def warm(self) -> None:
+        """Open the session if it isn't open, recording the error if that fails."""
+        with self.lock:
+            try:
+                if not self.__alive():
+                    self.__open()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = f'{type(e).__name__}: {e}'
+
+    def collect(self, gatherers: list[str]) -> dict[str, dict]:
+        """
+        Run gatherers on the session.
+
+        If the session turns out to be broken, or a command of the gatherer fails in it, e.g. on
+        a timeout, it is reopened and the gatherer is retried once.
+        Outputs memoized by the runner are only shared within one call.
+
+        Args:
+            gatherers: The gatherer names.
+
+        Returns:
+            dict[str, dict]: {'result': ..., 'error': ...} per gatherer name.
+        """
+        from libs.utils.command_runner import OS2SheetCommandRunnerException
+
+        results = {}
+        with self.lock:
+            if self.__alive():
+                self.runner.clear_memo()
+                try:
+                    self.runner.prefetch_files(prefetch_paths(gatherers))
+                except Exception:
+                    # A timed-out read may still be running in the shell, so the session
+                    # is reopened and the gatherers read the files one by one.
+                    self.__discard()
+            for gatherer in gatherers:
+                collect, parse = GATHERERS[gatherer]
+                for attempt in range(2):
+                    try:
+                        if not self.__alive():
+                            self.__open()
+                        raw = collect(self.runner)
+                    except Exception as e:
+                        results[gatherer] = {'result': None, 'error': f'{type(e).__name__}: {e}'}
+                        if self.__alive() and not isinstance(e, OS2SheetCommandRunnerException):
+                            # The gatherer failed, not the session.
+                            break
+                        # The session is broken, or a timed-out command may still be running in it.
+                        self.__discard()
+                        continue
+                    try:
+                        result = parse(raw) if parse is not None else raw
+                        results[gatherer] = {'result': result, 'error': None}
+                    except Exception as e:
+                        results[gatherer] = {'result': None, 'error': f'{type(e).__name__}: {e}'}
+                    break
+            self.last_used = time.time()
+        return results
+
+    def state(self) -> dict:
+        """Return the state of the session."""
+        return {
+            'host': self.entry['host'],
+            'connected': self.__alive(),
+            'connected_at': self.connected_at,
+            'last_used': self.last_used,
+            'last_error': self.last_error,
+        }
+
+    def close(self) -> None:
+        with self.lock:
+            self.__discard()
+
+class CollectorService():
+    def __init__(
+        self, inventory: list[dict], governor=None, credentials=None,
+        request_workers: int = DEFAULT_REQUEST_WORKERS, bastions=None
+    ):
+        """
+        Initializes a collector service that keeps warm sessions to the hosts of an inventory.
+
+        Args:
+            inventory: The inventory entries of the registered hosts.
+            governor: A ConnectionGovernor for (re)connects, or None.
+            credentials: A CredentialCache, or None.
+            request_workers: The number of hosts collected in parallel.
+            bastions: A BastionPool for hosts behind a bastion, or None.
+        """
+        self.sessions = {
+            entry['host']: WarmSession(entry, governor, credentials, bastions)
+                for entry in inventory
+        }
+        self.executor = ThreadPoolExecutor(max_workers=request_workers)
+
+    def warm(self) -> None:
+        """Open the sessions of all registered hosts in parallel."""
+        list(self.executor.map(lambda session: session.warm(), self.sessions.values()))
+
+    def collect(self, hosts: list[str] = None, gatherers: list[str] = None) -> dict[str, dict]:
+        """
+        Collect gatherers from registered hosts on their warm sessions.
+
+        Args:
+            hosts: The host names, or None for all registered hosts.
+            gatherers: The gatherer names, or None for all gatherers.
+
+        Returns:
+            dict[str, dict]: The results per host and gatherer, see WarmSession.collect.
+
+        Raises:
+            KeyError: If a host is not registered or a gatherer is unknown.
+        """
+        gatherers = gatherer_names(gatherers)
+        hosts = hosts or list(self.sessions)
+        for host in hosts:
+            if host not in self.sessions:
+                raise KeyError(f'Host is not registered: {host}')
+
+        futures = {
+            host: self.executor.submit(self.sessions[host].collect, gatherers)
+                for host in hosts
+        }
+        return {host: future.result() for host, future in futures.items()}
+
+    def states(self) -> list[dict]:
+        """Return the state of every session."""
+        return [session.state() for session in self.sessions.values()]
+
+    def close(self) -> None:
+        for session in self.sessions.values():
+            session.close()
+        self.executor.shutdown(wait=False)
+
+class CollectorRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP API of the collector service.
+
+    GET /health, GET /hosts, and POST /collect with a JSON body
+    {"hosts": [...], "gatherers": [...], "format": "json" | "xlsx"}.
+
+    On TCP every request needs the header "Authorization: Bearer <token>", and a Host header
+    naming localhost, so that neither other local users nor web pages (by DNS rebinding)
+    can read the collected data.
+    """
+    service: CollectorService = None
+    token: str = None
+
+    def address_string(self) -> str:
+        # Unix socket clients have no address.
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def __reply(self, status: int, body: bytes, content_type: str = 'application/json') -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def __reply_json(self, status: int, value) -> None:
+        self.__reply(status, json.dumps(value).encode('utf-8'))
+
+    def __authorized(self) -> bool:
+        """Check the Host and Authorization headers of a TCP request, replying if they are refused."""
+        if self.token is None:
+            return True
+        host = self.headers.get('Host', '')
+        if host.startswith('['):
+            host = host[:host.find(']') + 1]
+        else:
+            host = host.partition(':')[0]
+        if host not in LOCAL_HOST_NAMES:
+            self.__reply_json(403, {'error': f'Host not allowed: {host}'})
+            return False
+        scheme, _, token = self.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not hmac.compare_digest(
+            token.strip().encode('utf-8'), self.token.encode('utf-8')
+        ):
+            self.__reply_json(401, {'error': 'A valid bearer token is required'})
+            return False
+        return True
+
+    def do_GET(self):
+        if not self.__authorized():
+            return
+        if self.path == '/health':
+            self.__reply_json(200, {'status': 'ok'})
+        elif self.path == '/hosts':
+            self.__reply_json(200, self.service.states())
+        else:
+            self.__reply_json(404, {'error': f'Not found: {self.path}'})
+
+    def do_POST(self):
+        if not self.__authorized():
+            return
+        if self.path != '/collect':
+            self.__reply_json(404, {'error': f'Not found: {self.path}'})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+            if not isinstance(request, dict):
+                raise ValueError('The request body must be a JSON object')
+            results = self.service.collect(request.get('hosts'), request.get('gatherers'))
+        except (ValueError, KeyError) as e:
+            self.__reply_json(400, {'error': str(e)})
+            return
+
+        if request.get('format', 'json') == 'xlsx':
+            from libs.sheet import FleetWorkbook
+            workbook = FleetWorkbook()
+            for host, host_results in results.items():
+                for gatherer, value in host_results.items():
+                    workbook.add(host, gatherer, value['result'], value['error'])
+            output = io.BytesIO()
+            workbook.save(output)
+            self.__reply(200, output.getvalue(), XLSX_CONTENT_TYPE)
+        else:
+            self.__reply_json(200, results)
+
+class UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+def __is_socket(path: str) -> bool:
+    try:
+        return stat.S_ISSOCK(os.lstat(path).st_mode)
+    except FileNotFoundError:
+        return False
+
+def load_token(path: str) -> str:
+    """
+    Load the bearer token of the TCP listener, creating the file with a random token if it is missing.
+
+    Args:
+        path: The path of the token file, readable by the owner only.
+
+    Returns:
+        str: The token.
+
+    Raises:
+        ValueError: If the file is accessible by the group or others, or empty.
+    """
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        pass
+    else:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(secrets.token_urlsafe(32) + '\n')
+
+    if os.stat(path).st_mode & 0o077:
+        raise ValueError(f'The token file must be accessible by its owner only (chmod 600): {path}')
+    with open(path, encoding='utf-8') as f:
+        token = f.read().strip()
+    if not token:
+        raise ValueError(f'The token file is empty: {path}')
+    return token
+
+def serve(
+    service: CollectorService, listen: str = None, unix_socket: str = None,
+    token_file: str = None
+) -> None:
+    """
+    Serve the HTTP API of a collector service until interrupted.
+
+    Args:
+        service: The collector service.
+        listen: A localhost "host:port" to listen on.
+        unix_socket: The path of a Unix socket to listen on, accessible by the owner only.
+        token_file: The file of the bearer token required on the listen address, see load_token.
+
+    Raises:
+        ValueError: If neither or both of listen and unix_socket are given, if listen is not
+            a loopback address or has no token file, or if something other than a socket
+            exists at unix_socket.
+    """
+    if bool(listen) == bool(unix_socket):
+        raise ValueError('Give either a listen address or a Unix socket')
+
+    attributes = {'service': service}
+    if unix_socket:
+        # Only a stale socket of an earlier run is replaced.
+        if os.path.lexists(unix_socket) and not __is_socket(unix_socket):
+            raise ValueError(f'Not a socket, refusing to replace it: {unix_socket}')
+        if os.path.lexists(unix_socket):
+            os.unlink(unix_socket)
+        handler = type('Handler', (CollectorRequestHandler,), attributes)
+        old_umask = os.umask(0o177)
+        try:
+            server = UnixHTTPServer(unix_socket, handler)
+        finally:
+            os.umask(old_umask)
+    else:
+        host, _, port = listen.rpartition(':')
+        if host not in LOCAL_HOST_NAMES:
+            raise ValueError(f'The collector service only listens on localhost: {listen}')
+        if not token_file:
+            raise ValueError('A token file is required to listen on TCP')
+        attributes['token'] = load_token(token_file)
+        handler = type('Handler', (CollectorRequestHandler,), attributes)
+        server = ThreadingHTTPServer((host, int(port)), handler)
+
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if unix_socket and __is_socket(unix_socket):
+            os.unlink(unix_socket)
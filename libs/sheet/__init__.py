@@ -0,0 +1,8 @@
+from .workbook import FleetWorkbook, flatten
+from .host_workbook import render_hosts
+
+__all__ = [
+    'FleetWorkbook',
+    'flatten',
+    'render_hosts'
+]
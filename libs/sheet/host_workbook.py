@@ -0,0 +1,215 @@
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from libs.gatherer.registry import GATHERERS
+from .workbook import flatten, ERROR_ITEM
+
+SUMMARY_SHEET = 'summary'
+INDEX_FILE = 'index.xlsx'
+HEADER_STYLE = 'os2sheet header'
+LINK_STYLE = 'Hyperlink'
+HOST_FILE_PATTERN = re.compile(r'[^A-Za-z0-9._-]')
+
+# Sheet templates: the header and the column widths in characters.
+SHEET_TEMPLATES = {
+    'gatherer': (['Item', 'Value'], [48, 96]),
+    'summary': (['Gatherer', 'Rows', 'Error'], [24, 10, 96]),
+    'index': (['Host', 'Rows', 'Errors', 'Error'], [40, 12, 10, 96]),
+}
+
+# The state of a renderer process, set up once by init_renderer: the result store
+# and the header style.
+__renderer = {}
+
+def host_file_names(hosts: list[str]) -> dict[str, str]:
+    """
+    Return a unique file name per host, with the characters that are not safe in
+    file names replaced by '_'.
+    """
+    names = {}
+    # Lower case, for case-insensitive file systems.
+    used = {INDEX_FILE}
+    for host in hosts:
+        base = HOST_FILE_PATTERN.sub('_', host) or '_'
+        name = f'{base}.xlsx'
+        suffix = 1
+        while name.lower() in used:
+            suffix += 1
+            name = f'{base}-{suffix}.xlsx'
+        used.add(name.lower())
+        names[host] = name
+    return names
+
+def init_renderer(store_path: str) -> None:
+    """
+    Open the result store and build the header style once per renderer process.
+
+    Args:
+        store_path: The path of the ResultStore database.
+    """
+    from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
+    from libs.fleet.store import ResultStore
+
+    __renderer['store'] = ResultStore(store_path)
+    side = Side(style='thin')
+    # Bound to each workbook once; a styled cell then only copies the style indexes.
+    __renderer['header'] = NamedStyle(
+        name=HEADER_STYLE,
+        font=Font(bold=True),
+        fill=PatternFill(fill_type='solid', start_color='FFD9E1F2'),
+        border=Border(left=side, right=side, top=side, bottom=side),
+        alignment=Alignment(vertical='top')
+    )
+
+def __workbook():
+    """Return an empty write-only workbook with the header style."""
+    import openpyxl
+
+    workbook = openpyxl.Workbook(write_only=True)
+    workbook.add_named_style(__renderer['header'])
+    return workbook
+
+def __create_sheet(workbook, title: str, template: str):
+    """Create a sheet from a template: column widths, frozen header and the header row."""
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.utils import get_column_letter
+
+    header, widths = SHEET_TEMPLATES[template]
+    sheet = workbook.create_sheet(title=title[:31])
+    for index, width in enumerate(widths, start=1):
+        sheet.column_dimensions[get_column_letter(index)].width = width
+    sheet.freeze_panes = 'A2'
+    cells = []
+    for value in header:
+        cell = WriteOnlyCell(sheet, value)
+        cell.style = HEADER_STYLE
+        cells.append(cell)
+    sheet.append(cells)
+    return sheet
+
+def __link(sheet, target: str, text: str):
+    """Return a cell with a HYPERLINK formula, which needs no relationship in the sheet."""
+    from openpyxl.cell import WriteOnlyCell
+
+    text = text.replace('"', '""')
+    cell = WriteOnlyCell(sheet, f'=HYPERLINK("{target}","{text}")')
+    cell.style = LINK_STYLE
+    return cell
+
+def render_host(host: str, path: str) -> dict:
+    """
+    Render the workbook of one host from the result store. Runs in a worker process.
+
+    The workbook has a summary sheet linking to one Item/Value sheet per gatherer,
+    in registry order.
+
+    Args:
+        host: The host.
+        path: The path of the Excel file.
+
+    Returns:
+        dict: The 'host', the file name, the number of 'rows' and of gatherer 'errors',
+            the 'seconds' spent and the 'error' of a failed rendering, or None.
+    """
+    started = time.monotonic()
+    report = {'host': host, 'file': os.path.basename(path), 'rows': 0, 'errors': 0, 'error': None}
+    try:
+        order = {name: index for index, name in enumerate(GATHERERS)}
+        results = sorted(
+            __renderer['store'].results([host]),
+            key=lambda item: (order.get(item[1], len(order)), item[1])
+        )
+
+        workbook = __workbook()
+        summary = __create_sheet(workbook, SUMMARY_SHEET, 'summary')
+        for _, gatherer, result, error in results:
+            sheet = __create_sheet(workbook, gatherer, 'gatherer')
+            rows = [(ERROR_ITEM, error)] if error is not None else flatten(result)
+            for row in rows:
+                sheet.append(row)
+            summary.append([
+                __link(summary, f"#'{sheet.title}'!A1", gatherer), len(rows), error
+            ])
+            report['rows'] += len(rows)
+            if error is not None:
+                report['errors'] += 1
+        workbook.save(path)
+    except Exception as e:
+        report['error'] = f'{type(e).__name__}: {e}'
+    report['seconds'] = round(time.monotonic() - started, 3)
+    return report
+
+def render_index(reports: list[dict], path: str) -> None:
+    """
+    Render the index workbook, with one row per host linking to its workbook.
+    Runs in a worker process.
+
+    Args:
+        reports: The reports of render_host.
+        path: The path of the Excel file, in the directory of the host workbooks.
+    """
+    workbook = __workbook()
+    sheet = __create_sheet(workbook, 'hosts', 'index')
+    for report in reports:
+        host = report['host'] if report['error'] is not None else \
+            __link(sheet, report['file'], report['host'])
+        sheet.append([host, report['rows'], report['errors'], report['error']])
+    workbook.save(path)
+
+def render_hosts(
+    store_path: str, output_dir: str, hosts: list[str] = None, workers: int = None
+) -> dict:
+    """
+    Render one workbook per host from a result store in a process pool, and an index workbook.
+
+    Each process opens the store and builds the header style once, then renders whole hosts,
+    so rendering scales with the number of processes until the disk is the bottleneck.
+
+    Args:
+        store_path: The path of the ResultStore database, e.g. the job queue of a coordinated
+            run or the state of a drift monitor.
+        output_dir: The directory of the host workbooks and the index, created if missing.
+        hosts: The hosts to render, or None for all hosts in the store.
+        workers: The number of processes. Defaults to the number of CPUs.
+
+    Returns:
+        dict: The number of hosts, failed hosts and rows, the seconds spent and the index path.
+
+    Raises:
+        FileNotFoundError: If the store does not exist.
+    """
+    if not os.path.exists(store_path):
+        raise FileNotFoundError(f'Result store not found: {store_path}')
+    if hosts is None:
+        from libs.fleet.store import ResultStore
+
+        store = ResultStore(store_path)
+        hosts = store.hosts()
+        store.close()
+
+    os.makedirs(output_dir, exist_ok=True)
+    files = host_file_names(hosts)
+    workers = max(1, workers or os.cpu_count() or 1)
+    started = time.monotonic()
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=init_renderer, initargs=(store_path,)
+    ) as pool:
+        reports = list(pool.map(
+            render_host, hosts,
+            [os.path.join(output_dir, files[host]) for host in hosts],
+            chunksize=max(1, len(hosts) // (workers * 4))
+        ))
+        index_path = os.path.join(output_dir, INDEX_FILE)
+        pool.submit(render_index, reports, index_path).result()
+    seconds = time.monotonic() - started
+
+    return {
+        'hosts': len(hosts),
+        'failed': sum(1 for report in reports if report['error'] is not None),
+        'rows': sum(report['rows'] for report in reports),
+        'workers': workers,
+        'seconds': round(seconds, 3),
+        'hosts_per_second': round(len(hosts) / seconds, 2) if seconds else None,
+        'index': index_path,
+    }
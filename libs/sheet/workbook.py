@@ -0,0 +1,84 @@
+HEADER = ['Host', 'Item', 'Value']
+ERROR_ITEM = 'error'
+
+def flatten(value, prefix: str = '') -> list[tuple[str, str]]:
+    """
+    Flatten a gatherer result into (item, value) rows.
+
+    Nested dictionaries and lists are joined into dotted item paths,
+    e.g. {'sda': {'partition': [{'name': 'sda1'}]}} becomes ('sda.partition.0.name', 'sda1').
+
+    Args:
+        value: The gatherer result.
+        prefix: The item path of value.
+
+    Returns:
+        A list of (item, value) tuples.
+    """
+    rows = []
+    if isinstance(value, dict):
+        if not value:
+            rows.append((prefix, ''))
+        for key, child in value.items():
+            rows.extend(flatten(child, f'{prefix}.{key}' if prefix else str(key)))
+    elif isinstance(value, (list, tuple)):
+        if not value:
+            rows.append((prefix, ''))
+        for index, child in enumerate(value):
+            rows.extend(flatten(child, f'{prefix}.{index}' if prefix else str(index)))
+    else:
+        rows.append((prefix, '' if value is None else str(value)))
+
+    return rows
+
+class FleetWorkbook():
+    def __init__(self):
+        """
+        Initializes an empty fleet workbook with one sheet per gatherer.
+
+        Rows are written as they are added, so the workbook doesn't hold the results in memory.
+        """
+        # Imported here so that flatten doesn't load openpyxl.
+        import openpyxl
+
+        self.workbook = openpyxl.Workbook(write_only=True)
+        self.sheets = {}
+
+    def add(self, host: str, gatherer: str, result=None, error: str = None) -> int:
+        """
+        Add the result of a gatherer for a host.
+
+        Args:
+            host: The host the result was gathered from.
+            gatherer: The gatherer name, which is used as the sheet name.
+            result: The gatherer result.
+            error: The error message if the gatherer failed.
+
+        Returns:
+            The number of rows written.
+        """
+        sheet = self.sheets.get(gatherer)
+        if sheet is None:
+            sheet = self.workbook.create_sheet(title=gatherer[:31])
+            sheet.append(HEADER)
+            self.sheets[gatherer] = sheet
+
+        if error is not None:
+            rows = [(ERROR_ITEM, error)]
+        else:
+            rows = flatten(result)
+        for item, value in rows:
+            sheet.append([host, item, value])
+
+        return len(rows)
+
+    def save(self, path: str) -> None:
+        """
+        Save the workbook.
+
+        Args:
+            path: The path of the Excel file.
+        """
+        if not self.sheets:
+            self.workbook.create_sheet(title='empty').append(HEADER)
+        self.workbook.save(path)
@@ -1,5 +1,20 @@
-from .command_runner import CommandRunner
+import importlib
+
+# Names are imported from their modules on first access, so that importing libs.utils
+# doesn't load paramiko and cryptography until a connection is made.
+__LAZY_NAMES = {
+    'CommandRunner': '.command_runner',
+    'CredentialCache': '.credentials',
+}
 
 __all__ = [
-    'CommandRunner'
-]
\ No newline at end of file
+    'CommandRunner',
+    'CredentialCache'
+]
+
+def __getattr__(name: str):
+    if name not in __LAZY_NAMES:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module(__LAZY_NAMES[name], __name__), name)
+    globals()[name] = value
+    return value
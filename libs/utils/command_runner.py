@@ -2,13 +2,27 @@ import paramiko
 import re
 import socket
 import select
+import base64
+import codecs
+import secrets
+import shlex
+import zlib
+from typing import Iterator
+from .credentials import CredentialCache
 
 CMD_RUNNER_UNLOGIN = 0
 CMD_RUNNER_LOGIN = 1
 CMD_RUNNER_ROOTLOGIN = 2
 
 OSTYPE_LINUX = 'linux'
-PARAMIKO_RECV_BUFFER_SIZE = 4096
+PARAMIKO_RECV_BUFFER_SIZE = 32768
+PTY_WIDTH = 32767
+# The canonical mode of a tty truncates an input line at 4095 bytes, so a longer command
+# never completes. Commands are checked against it, and prefetches are split well below it.
+TTY_LINE_LIMIT = 4095
+PREFETCH_BATCH_BYTES = 3072
+
+CMD_MARKER_PREFIX = '//O2S'
 
 class OS2SheetCommandRunnerException(Exception):
     def __init__(self, 
@@ -23,7 +37,8 @@ class OS2SheetCommandRunnerException(Exception):
         os_type: str = None,
         encoding: str = None,
         command: str = None,
-        stdout: str = None
+        stdout: str = None,
+        exit_status: int = None
     ):
         
         """
@@ -42,6 +57,7 @@ class OS2SheetCommandRunnerException(Exception):
             encoding (str, optional): The encoding for command execution. Defaults to None.
             command (str, optional): The command that caused the exception. Defaults to None.
             stdout (str, optional): The stdout of the command that caused the exception. Defaults to None.
+            exit_status (int, optional): The exit status of the command that caused the exception. Defaults to None.
         """
         super().__init__(message)
         self.host = host
@@ -55,6 +71,7 @@ class OS2SheetCommandRunnerException(Exception):
         self.encoding = encoding
         self.command = command
         self.stdout = stdout
+        self.exit_status = exit_status
 
 class CommandRunner():
     def __init__(
@@ -66,10 +83,20 @@ class CommandRunner():
         exit_command: str = 'exit',
         timeout: int = 60,
         encoding: str = 'utf-8',
-        os_type: str = OSTYPE_LINUX
+        os_type: str = OSTYPE_LINUX,
+        compress: bool = False,
+        remote_compress: bool = False,
+        passphrase: str = None,
+        credentials: CredentialCache = None,
+        sock=None,
+        remote_filter: bool = False
     ):
         """
         Initializes the CommandRunner instance and establishes an SSH connection.
+
+        On Linux targets the shell session is bootstrapped right after login: terminal echo and
+        line wrapping are disabled and a per-session sentinel prompt is set, so that the output of
+        each command can be framed by nonce markers instead of matching the prompt.
     
         Args:
             host (str): The hostname or IP address of the target server.
@@ -78,15 +105,30 @@ class CommandRunner():
             password (str, optional): The password for SSH authentication. Defaults to None.
             keyfile (str, optional): The path to the private key file for key-based authentication. Defaults to None.
             su_command (str, optional): The command to switch to the root user. Defaults to 'su'.
-            prompt_pattern (str, optional): The regex pattern for detecting the command prompt. Defaults to r'\[.+\][\$,#] $'.
+            prompt_pattern (str, optional): The regex pattern for detecting the command prompt.
+                Only used on non-Linux targets. Defaults to r'\[.+\][\$,#] $'.
             password_prompt (str, optional): The regex pattern for detecting the password prompt. Defaults to r'Password: $'.
             exit_command (str, optional): The command to exit the shell. Defaults to 'exit'.
             timeout (int, optional): The timeout for the SSH connection in seconds. Defaults to 60.
             encoding (str, optional): The encoding for command execution. Defaults to 'utf-8'.
             os_type (str, optional): The operating system type of the target server. Defaults to OSTYPE_LINUX.
+            compress (bool, optional): True to enable SSH transport compression. Defaults to False.
+            remote_compress (bool, optional): True to gzip and base64 encode large outputs on the target
+                before they are transferred. Only applied to commands executed with compressible=True,
+                and silently disabled if gzip or base64 is not available on the target. Defaults to False.
+            passphrase (str, optional): The passphrase of an encrypted private key. Defaults to None.
+            credentials (CredentialCache, optional): A cache of private keys, known hosts and negotiated
+                algorithms shared between connections. If None, the key file is read on every connection
+                and unknown host keys are accepted without being stored. Defaults to None.
+            sock (optional): A socket-like object to run the SSH connection over instead of a new
+                TCP connection, e.g. a direct-tcpip channel of a bastion session. Defaults to None.
+            remote_filter (bool, optional): True to let read_file apply the filter commands given by
+                gatherers on the target, so that e.g. comments are not transferred. Only applied on Linux
+                targets with a UTF-8 encoding. Defaults to False.
     
         Raises:
             paramiko.SSHException: If the SSH connection fails.
+            OS2SheetCommandRunnerException: If the shell session cannot be bootstrapped.
         """
         self.status = CMD_RUNNER_UNLOGIN
         self.host = host
@@ -99,20 +141,227 @@ class CommandRunner():
         self.timeout = timeout
         self.encoding = encoding
         self.os_type = os_type
+        self.compress = compress
+        self.remote_compress = remote_compress
+        self.remote_compress_available = None
+        self.remote_filter = remote_filter and os_type == OSTYPE_LINUX \
+            and codecs.lookup(encoding).name in ('utf-8', 'ascii')
+        self.session_nonce = secrets.token_hex(8)
+        self.frame_sequence = 0
+        self.last_exit_status = None
+        self.probes = {}
+        self.memo = {}
+        self.transfer_stats = {
+            'received_bytes': 0,
+            'payload_bytes': 0,
+            'compressed_commands': 0,
+            'compressed_received_bytes': 0,
+            'compressed_payload_bytes': 0,
+        }
+
+        self.credentials = credentials
+        self.ssh = None
+        self.__connect(password, keyfile, passphrase, sock)
+        self.channel = self.ssh.invoke_shell(width=PTY_WIDTH)
+
+        self.status = CMD_RUNNER_LOGIN
+        if self.os_type == OSTYPE_LINUX:
+            self.__bootstrap()
+
+    def __connect(self, password: str, keyfile: str, passphrase: str, sock=None) -> None:
+        """Establish the SSH connection, using the credential cache if there is one."""
+        connect_args = {}
+        if self.credentials is not None:
+            connect_args = self.credentials.connect_args(self.host, self.port)
+            connect_args['allow_agent'] = self.credentials.use_agent
+            connect_args['look_for_keys'] = False
+            if keyfile is not None:
+                connect_args['pkey'] = self.credentials.private_key(keyfile, passphrase)
+                keyfile = None
+
+        for reuse_algorithms in (True, False):
+            if not reuse_algorithms:
+                connect_args.pop('disabled_algorithms')
+                self.credentials.forget_algorithms(self.host, self.port)
+            self.ssh = paramiko.SSHClient()
+            if self.credentials is not None:
+                self.ssh.set_missing_host_key_policy(self.credentials.host_key_policy)
+            else:
+                self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            try:
+                self.ssh.connect(
+                    self.host,
+                    port=self.port,
+                    username=self.user,
+                    password=password,
+                    key_filename=keyfile,
+                    passphrase=passphrase,
+                    timeout=self.timeout,
+                    compress=self.compress,
+                    sock=sock,
+                    **connect_args
+                )
+                break
+            except (paramiko.AuthenticationException, paramiko.BadHostKeyException):
+                raise
+            except paramiko.SSHException:
+                # The host may no longer support the algorithms negotiated before.
+                if 'disabled_algorithms' not in connect_args:
+                    raise
+                self.ssh.close()
+                if sock is not None:
+                    # The tunnel is gone with the failed transport,
+                    # the next connection negotiates from scratch.
+                    self.credentials.forget_algorithms(self.host, self.port)
+                    raise
 
-        self.ssh = paramiko.SSHClient()
-        self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        self.ssh.connect(
-            self.host,
+        if self.credentials is not None:
+            self.credentials.remember_algorithms(
+                self.host, self.port, self.ssh.get_transport())
+
+    def __exception(
+        self, message: str, command: str = None,
+        stdout: str = None, exit_status: int = None
+    ) -> OS2SheetCommandRunnerException:
+        """Create an OS2SheetCommandRunnerException carrying the settings of this runner."""
+        return OS2SheetCommandRunnerException(
+            message=message,
+            host=self.host,
+            user=self.user,
             port=self.port,
-            username=self.user,
-            password=password,
-            key_filename=keyfile,
-            timeout=self.timeout
+            prompt_pattern=self.prompt_pattern,
+            password_prompt=self.password_prompt,
+            su_command=self.su_command,
+            exit_command=self.exit_command,
+            os_type=self.os_type,
+            encoding=self.encoding,
+            command=command,
+            stdout=stdout,
+            exit_status=exit_status
         )
-        self.channel = self.ssh.invoke_shell()
 
-        self.status = CMD_RUNNER_LOGIN
+    def __next_frame(self) -> int:
+        """
+        Return the sequence number of the next framed command.
+
+        The begin and end markers of each command carry its number, so that the late output of
+        a command that has timed out is never taken for the output of a later command.
+        """
+        self.frame_sequence += 1
+        return self.frame_sequence
+
+    def __marker(self, kind: str) -> bytes:
+        """Return the framing marker of the given kind as it appears in the output."""
+        return f'{CMD_MARKER_PREFIX}:{self.session_nonce}:{kind}'.encode()
+
+    def __marker_printf(self, kind: str, status: str = None) -> str:
+        """
+        Return a printf command that prints the framing marker of the given kind.
+
+        The marker is split into two printf arguments, so the marker never appears in
+        the output when the command line itself is echoed back by the terminal.
+        """
+        if status is None:
+            return f"printf '%s:%s\\n' '{CMD_MARKER_PREFIX}' '{self.session_nonce}:{kind}'"
+        return (
+            f"printf '\\n%s:%s%d\\n' '{CMD_MARKER_PREFIX}' "
+            f"'{self.session_nonce}:{kind}' \"{status}\""
+        )
+
+    def __recv(self, timeout: int, received: bytes) -> bytes:
+        """Receive the next chunk from the SSH channel, or raise if nothing arrives within the timeout."""
+        while True:
+            ready, _, _ = select.select([self.channel], [], [], timeout)
+            if self.channel not in ready:
+                if received:
+                    timeout_message = 'Timeout while waiting for the end of output'
+                else:
+                    timeout_message = 'Timeout while waiting for output'
+                raise self.__exception(
+                    timeout_message,
+                    stdout=bytes(received).decode(self.encoding, errors='replace')
+                )
+            try:
+                chunk = self.channel.recv(PARAMIKO_RECV_BUFFER_SIZE)
+            except socket.timeout:
+                continue
+            if not chunk:
+                raise self.__exception(
+                    'SSH channel closed while waiting for output',
+                    stdout=bytes(received).decode(self.encoding, errors='replace')
+                )
+            self.transfer_stats['received_bytes'] += len(chunk)
+            return chunk
+
+    def __finish_frame(self, tail: bytearray, timeout: int) -> int:
+        """
+        Read the status printed after an end marker and the following sentinel prompt.
+
+        Args:
+            tail (bytearray): The data already received after the end marker.
+            timeout (int): The timeout in seconds for each read.
+
+        Returns:
+            int: The status printed after the end marker.
+        """
+        sentinel = self.__marker('P> ')
+        status_end = tail.find(b'\n')
+        while status_end == -1 or tail.find(sentinel, status_end) == -1:
+            tail += self.__recv(timeout, tail)
+            if status_end == -1:
+                status_end = tail.find(b'\n')
+
+        return int(bytes(tail[:status_end]).strip())
+
+    def __read_frame(self, end_marker: bytes, timeout: int = None) -> tuple[bytes, int]:
+        """
+        Read data from the SSH channel until a framed command has completed.
+
+        The command is complete when the end marker, the status printed after it and
+        the sentinel prompt have been received. All of them are found by an exact byte search
+        over the newly received data only.
+
+        Args:
+            end_marker (bytes): The end marker, which is followed by the status and a line break.
+            timeout (int): The timeout in seconds for each read.
+
+        Returns:
+            tuple[bytes, int]: The data received before the end marker and the status.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        end_marker = b'\n' + end_marker
+        buffer = bytearray()
+        search_from = 0
+        while True:
+            buffer += self.__recv(timeout, buffer)
+            end_index = buffer.find(end_marker, search_from)
+            if end_index != -1:
+                break
+            search_from = max(0, len(buffer) - len(end_marker) + 1)
+
+        status = self.__finish_frame(buffer[end_index + len(end_marker):], timeout)
+        return bytes(buffer[:end_index]), status
+
+    def __bootstrap(self) -> int:
+        """
+        Prepare the current shell for framed command execution.
+
+        Line editing and terminal echo are disabled so that commands are not sent back,
+        the terminal is widened so that nothing is wrapped, and the sentinel prompt is set.
+
+        Returns:
+            int: The uid of the shell user.
+        """
+        self.channel.send(
+            'set +o emacs +o vi +o history 2>/dev/null; '
+            f'stty -echo -onlcr cols {PTY_WIDTH} 2>/dev/null; '
+            "unset PROMPT_COMMAND; PS2=''; "
+            f"PS1='{CMD_MARKER_PREFIX}'':{self.session_nonce}:P> '; "
+            f"{self.__marker_printf('R:', '$(id -u)')}\n"
+        )
+        _, uid = self.__read_frame(self.__marker('R:'))
+        return uid
 
     def read_until_prompt(self, prompt: str, timeout: int = None) -> str:
         """
@@ -131,8 +380,9 @@ class CommandRunner():
             This method expects the SSH channel to be open and authenticated prior to calling.
         """
         stdout = ''
-        stdout_gotten = False
-        if timeout is not None:
+        decoder = codecs.getincrementaldecoder(self.encoding)(errors='replace')
+        prompt_regex = re.compile(prompt)
+        if timeout is None:
             timeout = self.timeout
         while True:
             ready, _, _ = select.select([self.channel], [], [], timeout)
@@ -141,31 +391,18 @@ class CommandRunner():
                     stdout_buffer = self.channel.recv(PARAMIKO_RECV_BUFFER_SIZE)
                     if not stdout_buffer:
                         break
-                    stdout += stdout_buffer.decode(self.encoding)
-                    stdout_gotten = True
-                    if re.search(prompt, stdout.splitlines()[-1]):
+                    self.transfer_stats['received_bytes'] += len(stdout_buffer)
+                    stdout += decoder.decode(stdout_buffer)
+                    if prompt_regex.search(stdout[stdout.rfind('\n') + 1:]):
                         break
                 except socket.timeout:
                     pass
             else:
-                if stdout_gotten:
-                    timeout_message = 'Timeout while waiting for prompt: {prompt}'
+                if stdout:
+                    timeout_message = f'Timeout while waiting for prompt: {prompt}'
                 else:
                     timeout_message = 'Timeout while waiting for output'
-                raise OS2SheetCommandRunnerException(
-                    message=timeout_message,
-                    host=self.host,
-                    user=self.user,
-                    port=self.port,
-                    prompt_pattern=self.prompt_pattern,
-                    password_prompt=self.password_prompt,
-                    su_command=self.su_command,
-                    exit_command=self.exit_command,
-                    os_type=self.os_type,
-                    encoding=self.encoding,
-                    command=None,
-                    stdout=stdout
-                )
+                raise self.__exception(timeout_message, stdout=stdout)
         return stdout
                 
     def su(
@@ -178,18 +415,39 @@ class CommandRunner():
         Args:
             root_password (str): The password for the root user.
             set_lang_c (bool): True to set the LANG environment variable to 'C', False otherwise.
+
+        Raises:
+            OS2SheetCommandRunnerException: If switching to the root user fails.
         """
         if set_lang_c:
-            self.channel.send('LANG=C\n')
-            self.read_until_prompt(self.prompt_pattern)
+            if self.os_type == OSTYPE_LINUX:
+                # Not through exec, which runs commands in a subshell.
+                end_kind = f'E{self.__next_frame()}:'
+                self.channel.send(f"LANG=C; {self.__marker_printf(end_kind, '$?')}\n")
+                self.__read_frame(self.__marker(end_kind))
+            else:
+                self.channel.send('LANG=C\n')
+                self.read_until_prompt(self.prompt_pattern)
         
         self.channel.send(f'{self.su_command}\n')
         self.read_until_prompt(self.password_prompt)
         
         self.channel.send(f'{root_password}\n')
-        self.read_until_prompt(self.prompt_pattern)
+        if self.os_type == OSTYPE_LINUX:
+            # The new shell has its own prompt and line editing settings.
+            # If su has failed, the bootstrap runs in the original shell instead.
+            uid = self.__bootstrap()
+            if uid != 0:
+                raise self.__exception(
+                    'Failed to switch to the root user',
+                    command=self.su_command
+                )
+        else:
+            self.read_until_prompt(self.prompt_pattern)
         
         self.status = CMD_RUNNER_ROOTLOGIN
+        # Outputs read as the login user may differ for root.
+        self.clear_memo()
 
     def __exec(
         self, command: str, timeout: int = None
@@ -206,64 +464,452 @@ class CommandRunner():
         """
         self.channel.send(command + '\n')
         output = self.read_until_prompt(self.prompt_pattern, timeout)
+        self.last_exit_status = None
         return output
 
+    def __stream_frame(
+        self, command: str, timeout: int = None,
+        compressed: bool = False
+    ) -> Iterator[bytes]:
+        """
+        Execute a command on a Linux system and yield its output as it arrives.
+
+        The command is wrapped with begin and end markers that carry the session nonce
+        and the sequence number of the command.
+        The end marker also carries the exit status of the command, which is stored in last_exit_status
+        once the generator is exhausted.
+        If compressed is True, the output is compressed with gzip and encoded with base64 on the target system,
+        and decoded chunk by chunk here.
+
+        Args:
+            command (str): The command to be executed.
+            timeout (int): The timeout in seconds for each read.
+            compressed (bool): True to transfer the output gzip compressed.
+
+        Yields:
+            bytes: Chunks of the output of the command.
+
+        Raises:
+            OS2SheetCommandRunnerException: If a timeout occurs while waiting for the output,
+                if the output cannot be decoded, or if the command line is longer than
+                the tty accepts.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        received_bytes = self.transfer_stats['received_bytes']
+        # As with a plain pipe, the command sees no tty on stdout (no pager, no colors)
+        # and its stderr is not part of the output.
+        if compressed:
+            body = f'{{ {command}; }} 2>/dev/null | gzip -c | base64 -w 0'
+            encoded = bytearray()
+            decompressor = zlib.decompressobj(wbits=31)
+        else:
+            body = f'{{ {command}; }} 2>/dev/null | cat'
+        status = '${PIPESTATUS[0]}'
+        self.last_exit_status = None
+        frame = self.__next_frame()
+        begin_kind, end_kind = f'B{frame}', f'E{frame}:'
+        line = (
+            f"{self.__marker_printf(begin_kind)}; {body}; "
+            f"{self.__marker_printf(end_kind, status)}\n"
+        )
+        if len(line.encode(self.encoding, errors='replace')) > TTY_LINE_LIMIT:
+            raise self.__exception(
+                f'Command line exceeds the tty line limit of {TTY_LINE_LIMIT} bytes',
+                command=command
+            )
+        self.channel.send(line)
+
+        # Output before the begin marker, e.g. of a command that timed out earlier, is skipped.
+        begin_marker = self.__marker(begin_kind) + b'\n'
+        end_marker = b'\n' + self.__marker(end_kind)
+        buffer = bytearray()
+        begun = False
+        finished = False
+        while not finished:
+            buffer += self.__recv(timeout, buffer)
+            if not begun:
+                begin_index = buffer.find(begin_marker)
+                if begin_index == -1:
+                    continue
+                del buffer[:begin_index + len(begin_marker)]
+                begun = True
+
+            end_index = buffer.find(end_marker)
+            if end_index != -1:
+                chunk = bytes(buffer[:end_index])
+                del buffer[:end_index + len(end_marker)]
+                finished = True
+            else:
+                # Hold back anything that may be the beginning of the end marker.
+                emit = len(buffer) - len(end_marker) + 1
+                if emit <= 0:
+                    continue
+                chunk = bytes(buffer[:emit])
+                del buffer[:emit]
+
+            if compressed:
+                encoded += chunk
+                usable = len(encoded) if finished else len(encoded) // 4 * 4
+                try:
+                    chunk = decompressor.decompress(base64.b64decode(bytes(encoded[:usable])))
+                    if finished:
+                        chunk += decompressor.flush()
+                except (ValueError, zlib.error) as e:
+                    raise self.__exception(
+                        f'Failed to decode compressed output: {e}',
+                        command=command
+                    )
+                del encoded[:usable]
+                self.transfer_stats['compressed_payload_bytes'] += len(chunk)
+
+            self.transfer_stats['payload_bytes'] += len(chunk)
+            if chunk:
+                yield chunk
+
+        self.last_exit_status = self.__finish_frame(buffer, timeout)
+        if compressed:
+            self.transfer_stats['compressed_commands'] += 1
+            self.transfer_stats['compressed_received_bytes'] += \
+                self.transfer_stats['received_bytes'] - received_bytes
+
     def __exec_linux(
-        self, command: str, timeout: int = None
+        self, command: str, timeout: int = None,
+        compressed: bool = False
     ) -> str:
         """
         Execute a command on a Linux system and return the output.
 
-        This method prefixes the command with a special prefix to detect the end of the command's output.
-        It reads the output from the SSH channel until it detects the prefix, and then returns the rest of the output.
-
         Args:
             command (str): The command to be executed.
-            timeout (int): The timeout in seconds for the read operation.
+            timeout (int): The timeout in seconds for each read.
+            compressed (bool): True to transfer the output gzip compressed.
 
         Returns:
             str: The output of the command.
 
         Raises:
-            OS2SheetCommandRunnerException: If a timeout occurs while waiting for the output.
+            OS2SheetCommandRunnerException: If a timeout occurs while waiting for the output,
+                or if the output cannot be decoded.
         """
-        self.channel.send(
-            f"{{ {command}; echo; }} | "
-            "while IFS= read -r line; do "
-            "echo \"//CMD_RESULT $line\"; done\n"
-        )
-        output = self.read_until_prompt(self.prompt_pattern, timeout)
-        result_lines = []
-        for line in output.splitlines():
-            # Handling cases where line breaks due to the tty window width
-            # cause the command's prefix to appear at the beginning.
-            if line.startswith('//CMD_RESULT $line"; done'):
-                continue
-            if line.startswith('//CMD_RESULT '):
-                result_lines.append(line.replace('//CMD_RESULT ', '', 1))
+        output = b''.join(self.__stream_frame(command, timeout, compressed))
+        return output.decode(self.encoding, errors='replace')
 
-        return '\n'.join(result_lines)
+    def __can_remote_compress(self) -> bool:
+        """Check once per session whether gzip and base64 are available on the target system."""
+        if self.remote_compress_available is None:
+            self.__exec_linux(
+                'command -v gzip && command -v base64'
+            )
+            self.remote_compress_available = self.last_exit_status == 0
+        return self.remote_compress_available
 
     def exec(
-        self, command: str, timeout: int = None
+        self, command: str, timeout: int = None,
+        compressible: bool = False, check: bool = False,
+        cached: bool = False
     ) -> str:
         """
         Execute a command on the target system and return the output.
 
+        The exit status of the command is stored in last_exit_status.
+        It is None if the exit status cannot be determined on the target system.
+
         Args:
             command (str): The command to execute.
             timeout (int): The timeout for the command in seconds.
+            compressible (bool): True if the command is expected to produce a large, compressible output.
+                The output is compressed on the target system if remote_compress is enabled.
+            check (bool): True to raise an exception if the command exits with a non-zero status.
+            cached (bool): True to run the command only once until clear_memo is called
+                and return the same output and exit status to later callers.
 
         Returns:
             str: The output of the command.
 
         Raises:
-            OS2SheetCommandRunnerException: If a timeout occurs while waiting for the output.
+            OS2SheetCommandRunnerException: If a timeout occurs while waiting for the output,
+                or if check is True and the command fails.
         """
-        if self.os_type == OSTYPE_LINUX:
-            return self.__exec_linux(command, timeout)
+        if cached:
+            key = ('exec', command)
+            if key not in self.memo:
+                self.memo[key] = (self.exec(command, timeout, compressible), self.last_exit_status)
+            output, self.last_exit_status = self.memo[key]
+        elif self.os_type == OSTYPE_LINUX:
+            compressed = compressible and self.remote_compress and self.__can_remote_compress()
+            output = self.__exec_linux(command, timeout, compressed)
         else:
-            return self.__exec(command, timeout)
+            output = self.__exec(command, timeout)
+
+        if check and self.last_exit_status:
+            raise self.__exception(
+                f'Command exited with status {self.last_exit_status}',
+                command=command,
+                stdout=output,
+                exit_status=self.last_exit_status
+            )
+        return output
+
+    def exec_stream(
+        self, command: str, timeout: int = None,
+        compressible: bool = False
+    ) -> Iterator[str]:
+        """
+        Execute a command on the target system and yield the lines of the output as they arrive.
+
+        The output is not buffered as a whole, so callers can parse large outputs while they are
+        still being transferred. The exit status of the command is stored in last_exit_status
+        once all lines have been consumed. If the caller stops early, the rest of the output is
+        read and discarded, so the session stays usable.
+
+        Args:
+            command (str): The command to execute.
+            timeout (int): The timeout in seconds for each read.
+            compressible (bool): True if the command is expected to produce a large, compressible output.
+                The output is compressed on the target system if remote_compress is enabled.
+
+        Yields:
+            str: The lines of the output, without line breaks.
+
+        Raises:
+            OS2SheetCommandRunnerException: If a timeout occurs while waiting for the output.
+        """
+        if self.os_type != OSTYPE_LINUX:
+            yield from self.__exec(command, timeout).splitlines()
+            return
+
+        compressed = compressible and self.remote_compress and self.__can_remote_compress()
+        yield from self.__stream_lines(self.__stream_frame(command, timeout, compressed))
+
+    def __stream_lines(self, stream: Iterator[bytes]) -> Iterator[str]:
+        """Decode a stream of output chunks into lines, and drain it if the caller stops early."""
+        decoder = codecs.getincrementaldecoder(self.encoding)(errors='replace')
+        pending = ''
+        try:
+            for chunk in stream:
+                lines = (pending + decoder.decode(chunk)).split('\n')
+                pending = lines.pop()
+                for line in lines:
+                    yield line.rstrip('\r')
+            pending += decoder.decode(b'', final=True)
+            if pending:
+                yield pending.rstrip('\r')
+        finally:
+            for _ in stream:
+                pass
+
+    def __read_command(self, path: str, remote_filter: str = None) -> tuple[str, tuple]:
+        """Return the command that reads a file and the memo key of its output."""
+        if remote_filter is not None and self.remote_filter:
+            return f'{remote_filter} {shlex.quote(path)}', ('file', path, remote_filter)
+        return f'cat {shlex.quote(path)}', ('file', path, None)
+
+    def read_file(
+        self, path: str, timeout: int = None, compressible: bool = False,
+        remote_filter: str = None
+    ) -> str:
+        """
+        Read a file on the target system, only once until clear_memo is called.
+
+        Gatherers reading the same file share one transfer, and files loaded by
+        prefetch_files are returned without another round trip.
+
+        Args:
+            path (str): The path of the file.
+            timeout (int): The timeout in seconds for each read.
+            compressible (bool): True if the file is expected to be large and compressible.
+            remote_filter (str): A command that prints the file given as its last argument
+                with lines the caller ignores removed, e.g. REMOTE_COMMENT_FILTER.
+                Only used if the runner was created with remote_filter=True, so the caller
+                has to process the output as if it was the whole file.
+
+        Returns:
+            str: The content of the file, or an empty string if it cannot be read.
+                The exit status of the read is stored in last_exit_status.
+
+        Raises:
+            OS2SheetCommandRunnerException: If a timeout occurs while waiting for the output.
+        """
+        command, key = self.__read_command(path, remote_filter)
+        if key not in self.memo:
+            output = self.exec(command, timeout, compressible)
+            self.memo[key] = (output, self.last_exit_status)
+        output, self.last_exit_status = self.memo[key]
+        return output
+
+    def read_lines(
+        self, path: str, timeout: int = None, compressible: bool = False,
+        remote_filter: str = None
+    ) -> Iterator[str]:
+        """
+        Read a file on the target system line by line, as exec_stream does, sharing the memo of read_file.
+
+        A file in the memo is returned from it. Otherwise the lines are yielded while the file
+        is still being transferred, and the whole file is added to the memo once the stream ends.
+
+        Args:
+            path (str): The path of the file.
+            timeout (int): The timeout in seconds for each read.
+            compressible (bool): True if the file is expected to be large and compressible.
+            remote_filter (str): A command that prints the file with lines the caller ignores
+                removed, see read_file.
+
+        Yields:
+            str: The lines of the file, without line breaks. Nothing if it cannot be read.
+                The exit status of the read is stored in last_exit_status once all lines have been consumed.
+
+        Raises:
+            OS2SheetCommandRunnerException: If a timeout occurs while waiting for the output.
+        """
+        command, key = self.__read_command(path, remote_filter)
+        if key in self.memo or self.os_type != OSTYPE_LINUX:
+            yield from self.read_file(path, timeout, compressible, remote_filter).splitlines()
+            return
+
+        compressed = compressible and self.remote_compress and self.__can_remote_compress()
+        stream = self.__stream_frame(command, timeout, compressed)
+
+        def recorded() -> Iterator[bytes]:
+            chunks = []
+            for chunk in stream:
+                chunks.append(chunk)
+                yield chunk
+            # Only a complete read is kept, also when the caller stopped early and the rest was drained.
+            self.memo[key] = (
+                b''.join(chunks).decode(self.encoding, errors='replace'), self.last_exit_status
+            )
+
+        yield from self.__stream_lines(recorded())
+
+    def prefetch_files(self, files: list, timeout: int = None) -> None:
+        """
+        Load files that are not read yet into the memo of read_file in as few round trips as
+        the tty line limit allows, usually one.
+
+        Args:
+            files (list): The paths of the files, or (path, remote_filter) tuples for files
+                read with a remote_filter, see read_file. Missing files are cached as empty.
+            timeout (int): The timeout in seconds for each read.
+
+        Raises:
+            OS2SheetCommandRunnerException: If a timeout occurs while waiting for the output,
+                or if the output cannot be split into the files.
+        """
+        reads = {}
+        for file in files:
+            path, remote_filter = file if isinstance(file, tuple) else (file, None)
+            command, key = self.__read_command(path, remote_filter)
+            if key not in self.memo:
+                reads[key] = (path, remote_filter, command)
+        if self.os_type != OSTYPE_LINUX or len(reads) < 2:
+            for path, remote_filter, _ in reads.values():
+                self.read_file(path, timeout, remote_filter=remote_filter)
+            return
+
+        # Each file is followed by a marker carrying the exit status of its read.
+        # The reads are batched, so that each command line stays below the tty line limit.
+        batches = [[]]
+        batch_bytes = 0
+        for key, (_, _, read_command) in reads.items():
+            read = f"{read_command}; {self.__marker_printf('F:', '$?')}"
+            read_bytes = len(read.encode(self.encoding, errors='replace')) + 2
+            if batches[-1] and batch_bytes + read_bytes > PREFETCH_BATCH_BYTES:
+                batches.append([])
+                batch_bytes = 0
+            batches[-1].append((key, read))
+            batch_bytes += read_bytes
+        compressed = self.remote_compress and self.__can_remote_compress()
+        for batch in batches:
+            self.__prefetch_batch(batch, timeout, compressed)
+
+    def __prefetch_batch(self, batch: list, timeout: int, compressed: bool) -> None:
+        """Read a batch of (memo key, read command with its marker) in one round trip."""
+        command = '; '.join(read for _, read in batch)
+        output = b''.join(self.__stream_frame(command, timeout, compressed))
+        parts = output.split(b'\n' + self.__marker('F:'))
+        if len(parts) != len(batch) + 1:
+            raise self.__exception(
+                f'Expected {len(batch)} files in the output, got {len(parts) - 1}',
+                command=command,
+                stdout=output.decode(self.encoding, errors='replace')
+            )
+
+        content = parts[0]
+        for (key, _), part in zip(batch, parts[1:]):
+            status, _, next_content = part.partition(b'\n')
+            self.memo[key] = (
+                content.decode(self.encoding, errors='replace'), int(status)
+            )
+            content = next_content
+
+    def clear_memo(self) -> None:
+        """Forget the outputs cached by read_file, read_lines, prefetch_files and exec(cached=True)."""
+        self.memo.clear()
+
+    def probe(self, name: str, command: str) -> bool:
+        """
+        Check whether the target system supports a feature, running the check only once per session.
+
+        Args:
+            name (str): The name the result is cached under.
+            command (str): The command that exits with status 0 if the feature is supported.
+
+        Returns:
+            bool: True if the command succeeded. Always False if the exit status can't be determined.
+        """
+        if name not in self.probes:
+            self.exec(command)
+            self.probes[name] = self.last_exit_status == 0
+        return self.probes[name]
+
+    def transfer_report(self) -> dict:
+        """
+        Report the amount of data transferred from the target system.
+
+        Returns:
+            dict: A dictionary with the following keys:
+                - 'host': The hostname or IP address of the target server.
+                - 'transport_compression': True if SSH transport compression is enabled.
+                - 'remote_compression': True if remote compression is enabled and available on the target.
+                - 'received_bytes': The total bytes received from the SSH channel.
+                - 'payload_bytes': The total bytes of command outputs returned to the caller.
+                - 'bytes_saved': The bytes saved by remote compression.
+        """
+        stats = self.transfer_stats
+        return {
+            'host': self.host,
+            'transport_compression': self.compress,
+            'remote_compression': bool(self.remote_compress and self.remote_compress_available),
+            'received_bytes': stats['received_bytes'],
+            'payload_bytes': stats['payload_bytes'],
+            'bytes_saved': max(
+                0, stats['compressed_payload_bytes'] - stats['compressed_received_bytes']
+            ),
+        }
+
+    def is_alive(self) -> bool:
+        """
+        Check whether the SSH connection and the shell channel are still open.
+
+        Returns:
+            bool: True if commands can still be executed.
+        """
+        if self.ssh is None:
+            return False
+        transport = self.ssh.get_transport()
+        return transport is not None and transport.is_active() and not self.channel.closed
+
+    def set_keepalive(self, interval: int) -> None:
+        """
+        Send SSH keepalive packets while the session is idle.
+
+        Args:
+            interval (int): The seconds between keepalive packets, or 0 to disable them.
+        """
+        transport = self.ssh.get_transport()
+        if transport is not None:
+            transport.set_keepalive(interval)
 
     def close(self):
         """
@@ -278,6 +924,3 @@ class CommandRunner():
 
     def __del__(self):
         self.close()
-
-
-
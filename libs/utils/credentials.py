@@ -0,0 +1,161 @@
+import json
+import os
+import threading
+import paramiko
+
+PRIVATE_KEY_CLASSES = (
+    paramiko.Ed25519Key,
+    paramiko.ECDSAKey,
+    paramiko.RSAKey,
+)
+
+class CredentialCacheException(Exception):
+    pass
+
+class SharedHostKeyPolicy(paramiko.MissingHostKeyPolicy):
+    def __init__(self, cache: 'CredentialCache'):
+        """Host key policy that verifies against, and adds to, the known hosts of a CredentialCache."""
+        self.cache = cache
+
+    def missing_host_key(self, client, hostname, key):
+        self.cache.check_host_key(hostname, key)
+
+class CredentialCache():
+    def __init__(
+        self, known_hosts: str = None, algorithms: str = None,
+        use_agent: bool = False
+    ):
+        """
+        Initializes a process-wide cache of key material for CommandRunner connections.
+
+        Private keys are read and decrypted once per file. Host keys are loaded once from
+        known_hosts and new host keys are appended to it (trust on first use, like AutoAddPolicy,
+        but a changed host key is rejected). The algorithms negotiated with each host can be
+        remembered, so that later handshakes with the host only offer those.
+        A CredentialCache can be shared by any number of threads.
+
+        Args:
+            known_hosts: The path of the known hosts file, or None to keep host keys in memory only.
+            algorithms: The path of a JSON file the negotiated algorithms are loaded from
+                and saved to by save(), or None to keep them in memory only.
+            use_agent: True to authenticate with the keys of a running ssh-agent.
+        """
+        self.known_hosts = known_hosts
+        self.algorithms_path = algorithms
+        self.use_agent = use_agent
+        self.lock = threading.Lock()
+        self.private_keys = {}
+        self.host_keys = paramiko.HostKeys()
+        if known_hosts and os.path.exists(known_hosts):
+            self.host_keys.load(known_hosts)
+        self.algorithms = {}
+        if algorithms and os.path.exists(algorithms):
+            with open(algorithms, encoding='utf-8') as f:
+                self.algorithms = json.load(f)
+        self.host_key_policy = SharedHostKeyPolicy(self)
+
+    def private_key(self, path: str, passphrase: str = None) -> paramiko.PKey:
+        """
+        Return the private key in a file, reading and decrypting it only on the first call.
+
+        Args:
+            path: The path of the private key file.
+            passphrase: The passphrase of an encrypted key.
+
+        Returns:
+            paramiko.PKey: The private key.
+
+        Raises:
+            CredentialCacheException: If the file is not a supported private key.
+        """
+        path = os.path.expanduser(path)
+        with self.lock:
+            pkey = self.private_keys.get(path)
+            if pkey is not None:
+                return pkey
+
+            errors = []
+            for key_class in PRIVATE_KEY_CLASSES:
+                try:
+                    pkey = key_class.from_private_key_file(path, password=passphrase)
+                    break
+                except paramiko.PasswordRequiredException:
+                    raise
+                except (paramiko.SSHException, ValueError) as e:
+                    errors.append(f'{key_class.__name__}: {e}')
+            else:
+                raise CredentialCacheException(
+                    f'Unsupported private key {path}: {"; ".join(errors)}')
+
+            self.private_keys[path] = pkey
+            return pkey
+
+    def check_host_key(self, hostname: str, key: paramiko.PKey) -> None:
+        """
+        Verify the host key of a host, adding it if the host is not known yet.
+
+        Args:
+            hostname: The host name as paramiko formats it, i.e. "[host]:port" for other ports than 22.
+            key: The host key presented by the server.
+
+        Raises:
+            paramiko.BadHostKeyException: If a different key of the same type is known for the host.
+        """
+        with self.lock:
+            known = self.host_keys.lookup(hostname)
+            if known is not None and key.get_name() in known:
+                if known[key.get_name()] != key:
+                    raise paramiko.BadHostKeyException(
+                        hostname, key, known[key.get_name()])
+                return
+
+            self.host_keys.add(hostname, key.get_name(), key)
+            if self.known_hosts:
+                with open(self.known_hosts, 'a', encoding='utf-8') as f:
+                    f.write(f'{hostname} {key.get_name()} {key.get_base64()}\n')
+
+    def connect_args(self, host: str, port: int) -> dict:
+        """
+        Return the keyword arguments for SSHClient.connect that reuse the algorithms
+        negotiated with the host before.
+
+        Returns:
+            dict: disabled_algorithms, or an empty dict if nothing is remembered.
+        """
+        with self.lock:
+            remembered = self.algorithms.get(f'{host}:{port}')
+        if not remembered:
+            return {}
+        return {'disabled_algorithms': remembered['disabled']}
+
+    def remember_algorithms(self, host: str, port: int, transport: paramiko.Transport) -> None:
+        """
+        Remember the host key type and cipher negotiated on a transport.
+
+        Later connections to the host disable all other host key types and ciphers,
+        so the server can't pick a more expensive one.
+        """
+        options = transport.get_security_options()
+        disabled = {
+            'keys': [k for k in options.keys if k != transport.host_key_type],
+            'ciphers': [c for c in options.ciphers if c != transport.local_cipher],
+        }
+        with self.lock:
+            self.algorithms[f'{host}:{port}'] = {
+                'host_key_type': transport.host_key_type,
+                'cipher': transport.local_cipher,
+                'disabled': disabled,
+            }
+
+    def save(self) -> None:
+        """Persist the remembered algorithms, if a file was given."""
+        if not self.algorithms_path:
+            return
+        with self.lock:
+            with open(self.algorithms_path, 'w', encoding='utf-8') as f:
+                json.dump(self.algorithms, f)
+
+    def forget_algorithms(self, host: str, port: int) -> None:
+        """Forget the algorithms negotiated with a host, e.g. after its configuration has changed."""
+        with self.lock:
+            self.algorithms.pop(f'{host}:{port}', None)